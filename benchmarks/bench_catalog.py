@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memory and speed benchmarks for ``laterpay.catalog.Catalog``.
+
+Run with ``python benchmarks/bench_catalog.py`` (Python 3).
+"""
+from __future__ import print_function
+
+import gc
+import os
+import tempfile
+import timeit
+import tracemalloc
+
+from laterpay import FrozenItemDefinition, ItemDefinition, LaterPayClient
+from laterpay.catalog import Catalog
+
+NUMBER_OF_ITEMS = 100000
+
+
+def _rows(count):
+    # Fresh strings for every row, as when reading a catalog from a file.
+    for i in range(count):
+        yield {
+            'item_id': 'article-%d' % i,
+            'pricing': 'EUR%d,USD%d' % (i % 500, i % 700),
+            'url': 'https://example.com/news/2020/01/some-article-title-%d' % i,
+            'title': u'Some article title with spaces and ümlauts %d' % i,
+            'expiry': '+86400',
+        }
+
+
+def _measure(create, count):
+    gc.collect()
+    tracemalloc.start()
+    items = create(_rows(count))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return size
+
+
+def bench_memory(count=NUMBER_OF_ITEMS):
+    creators = [
+        ('ItemDefinition', lambda rows: [ItemDefinition(**row) for row in rows]),
+        ('FrozenItemDefinition', lambda rows: [FrozenItemDefinition(**row) for row in rows]),
+        ('Catalog', Catalog.from_rows),
+    ]
+    baseline = _measure(creators[0][1], count)
+    for name, create in creators:
+        size = _measure(create, count)
+        print('%-36s %8.1f MB  %6.0f bytes/item  (%.2fx)' % (
+            'memory[%s]' % name, size / 1e6, size / float(count), baseline / float(size),
+        ))
+
+
+def bench_open(count=NUMBER_OF_ITEMS):
+    path = os.path.join(tempfile.mkdtemp(), 'items.catalog')
+    Catalog.from_rows(_rows(count)).save(path)
+    print('%-36s %8.1f MB' % ('file size', os.path.getsize(path) / 1e6))
+
+    def open_and_read():
+        with Catalog.open(path) as catalog:
+            catalog.get_item(count // 2)
+
+    value = min(timeit.repeat(open_and_read, number=100, repeat=5)) / 100 * 1e6
+    print('%-36s %8.2f us' % ('open and read a row', value))
+    os.remove(path)
+
+
+def bench_get_buy_url(number=20000):
+    client = LaterPayClient('cp-key-1234', 'some-shared-secret')
+    rows = list(_rows(1000))
+    catalog = Catalog.from_rows(rows)
+    for name, get_buy_url in (
+        ('ItemDefinition', lambda: client.get_buy_url(ItemDefinition(**rows[500]))),
+        ('FrozenItemDefinition', lambda: client.get_buy_url(FrozenItemDefinition(**rows[500]))),
+        ('Catalog', lambda: catalog.get_buy_url(client, 500)),
+    ):
+        value = min(timeit.repeat(get_buy_url, number=number, repeat=5)) / number * 1e6
+        print('%-36s %8.2f us' % ('get_buy_url[%s]' % name, value))
+
+
+if __name__ == '__main__':
+    bench_memory()
+    bench_open()
+    bench_get_buy_url()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the cold import time of ``laterpay``.
+
+Run with ``python benchmarks/bench_import.py``.
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+
+MODULES = ('laterpay.signing', 'laterpay')
+
+
+def get_import_time(module):
+    """
+    Return the cumulative import time of ``module`` in a fresh interpreter,
+    in microseconds, as reported by ``python -X importtime``.
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.STDOUT,
+    ).decode()
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise ValueError('%s not found in the -X importtime output' % module)
+
+
+def bench_import(repeat=5):
+    for module in MODULES:
+        value = min(get_import_time(module) for _ in range(repeat))
+        print('%-36s %10.2f ms' % ('import %s' % module, value / 1000.0))
+
+
+if __name__ == '__main__':
+    bench_import()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memory and speed benchmarks for ``ItemDefinition`` and
+``FrozenItemDefinition``.
+
+Run with ``python benchmarks/bench_item_definition.py`` (Python 3).
+"""
+from __future__ import print_function
+
+import gc
+import timeit
+import tracemalloc
+
+from laterpay import FrozenItemDefinition, ItemDefinition, LaterPayClient
+
+NUMBER_OF_ITEMS = 100000
+
+
+def _rows(count):
+    # Fresh strings for every row, as when reading a catalog from a file.
+    for i in range(count):
+        yield (
+            'article-%d' % i,
+            'EUR%d,USD%d' % (i % 500, i % 700),
+            'https://example.com/news/2020/01/some-article-title-%d' % i,
+            u'Some article title with spaces and ümlauts %d' % i,
+            '+86400',
+        )
+
+
+def _measure(cls, count):
+    gc.collect()
+    tracemalloc.start()
+    items = [cls(*row) for row in _rows(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return size
+
+
+def bench_memory(count=NUMBER_OF_ITEMS):
+    baseline = _measure(ItemDefinition, count)
+    for cls in (ItemDefinition, FrozenItemDefinition):
+        size = _measure(cls, count)
+        print('%-36s %8.1f MB  %6.0f bytes/item  (%.2fx)' % (
+            'memory[%s]' % cls.__name__, size / 1e6, size / float(count), baseline / float(size),
+        ))
+
+
+def bench_get_buy_url(number=20000):
+    client = LaterPayClient('cp-key-1234', 'some-shared-secret')
+    row = next(_rows(1))
+    for cls in (ItemDefinition, FrozenItemDefinition):
+        item = cls(*row)
+        value = min(timeit.repeat(lambda: client.get_buy_url(item), number=number, repeat=5)) / number * 1e6
+        print('%-36s %8.2f us' % ('get_buy_url[%s]' % cls.__name__, value))
+
+
+if __name__ == '__main__':
+    bench_memory()
+    bench_get_buy_url()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for ``laterpay.signing``.
+
+Run with ``python benchmarks/bench_signing.py``.
+"""
+from __future__ import print_function
+
+import timeit
+
+from six.moves.urllib.parse import parse_qs, urlencode
+
+from laterpay import ItemDefinition, LaterPayClient, signing, utils
+
+URL = 'https://web.laterpay.net/dialog/buy'
+ACCESS_URL = 'https://api.laterpay.net/access'
+
+# What ``LaterPayClient._get_web_url`` hands to ``signing.sign`` via
+# ``utils.signed_query``, i.e. after ``normalise_param_structure``.
+WEB_URL_PARAMS = {
+    'article_id': ['article-12345'],
+    'pricing': ['EUR199,USD219'],
+    'url': ['https://example.com/news/2020/01/some-article-title?utm_source=feed'],
+    'title': [u'Some article title with spaces and ümlauts'],
+    'expiry': ['+86400'],
+    'cp': ['cp-key-1234'],
+    'product': ['some-product-key'],
+    'return_url': ['https://example.com/news/2020/01/some-article-title?bought=1'],
+    'failure_url': ['https://example.com/news/2020/01/some-article-title?failed=1'],
+    'ts': ['1577836800'],
+}
+
+# What ``LaterPayClient.get_access_params`` hands to ``signing.sign``.
+ACCESS_PARAMS = {
+    'cp': 'cp-key-1234',
+    'ts': '1577836800',
+    'article_id': ['article-%d' % i for i in range(10)],
+    'lptoken': 'b3e9fd2a1c7a4c2e9f0d1b3a5c7e9f1a',
+}
+
+
+def _report(name, number, **timers):
+    results = {}
+    for label, func in sorted(timers.items()):
+        results[label] = min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+    baseline = results.get('generic')
+    for label, value in sorted(results.items()):
+        if label == 'generic':
+            continue
+        line = '%-36s %-10s %8.2f us' % (name, label, value)
+        if baseline is not None:
+            line += '  (generic %.2f us, %.2fx)' % (baseline, baseline / value)
+        print(line)
+    return results
+
+
+def bench_create_base_message(number=20000):
+    for name, params, url in (
+        ('create_base_message[web_url]', WEB_URL_PARAMS, URL),
+        ('create_base_message[access]', ACCESS_PARAMS, ACCESS_URL),
+    ):
+        items = list(params.items())
+        assert signing.create_base_message(params, url) == signing.create_base_message(items, url)
+        _report(
+            name,
+            number,
+            fast=lambda: signing.create_base_message(params, url, 'GET'),
+            generic=lambda: signing.create_base_message(items, url, 'GET'),
+        )
+
+
+def bench_sign(number=20000):
+    signer = signing.Signer('some-shared-secret')
+
+    def uncached():
+        message = signing._build_message_prefix('GET', URL) + signing._join_quoted_params(
+            signing._quote_params(WEB_URL_PARAMS))
+        return signing.Signer('some-shared-secret').create_HMAC(message)
+
+    assert uncached() == signer.sign(WEB_URL_PARAMS, URL, 'GET')
+    _report(
+        'sign[web_url]',
+        number,
+        cached=lambda: signer.sign(WEB_URL_PARAMS, URL, 'GET'),
+        generic=uncached,
+    )
+
+
+def _python_HMAC_compare(a, b):
+    # The pure Python comparison ``signing.time_independent_HMAC_compare``
+    # used before switching to ``hmac.compare_digest``.
+    if len(a) != len(b):
+        return False
+    result = 0
+    a, b = a.lower(), b.lower()
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+def bench_verify(number=20000):
+    signer = signing.Signer('some-shared-secret')
+    signature = signer.sign(ACCESS_PARAMS, ACCESS_URL, 'GET').upper()
+
+    def python_verify():
+        return _python_HMAC_compare(signature, signer.sign(ACCESS_PARAMS, ACCESS_URL, 'GET'))
+
+    assert python_verify() and signer.verify(signature, ACCESS_PARAMS, ACCESS_URL, 'GET')
+    _report(
+        'verify[access]',
+        number,
+        native=lambda: signer.verify(signature, ACCESS_PARAMS, ACCESS_URL, 'GET'),
+        generic=python_verify,
+    )
+    mac = signature.lower()
+    _report(
+        'time_independent_HMAC_compare',
+        number * 10,
+        native=lambda: signing.time_independent_HMAC_compare(signature, mac),
+        generic=lambda: _python_HMAC_compare(signature, mac),
+    )
+
+
+def bench_verify_query_string(number=20000):
+    signer = signing.Signer('some-shared-secret')
+    query_string = utils.signed_query(signer, WEB_URL_PARAMS, URL)
+
+    def parse_and_verify():
+        params = parse_qs(query_string)
+        return signer.verify(params['hmac'], params, URL, 'GET')
+
+    assert parse_and_verify() and signer.verify_query_string('hmac', query_string, URL, 'GET')
+    _report(
+        'verify_query_string[web_url]',
+        number,
+        raw=lambda: signer.verify_query_string('hmac', query_string, URL, 'GET'),
+        generic=parse_and_verify,
+    )
+
+
+def bench_signed_query(number=20000):
+    signer = signing.Signer('some-shared-secret')
+
+    def encode_twice():
+        # ``urlencode`` for the query string, then quoting again for signing.
+        params = signing.normalise_param_structure(WEB_URL_PARAMS)
+        qs = urlencode(list(params.items()), doseq=True)
+        return '%s&hmac=%s' % (qs, signer.sign(params, URL, method='GET'))
+
+    assert encode_twice() == utils.signed_query(signer, WEB_URL_PARAMS, URL)
+    _report(
+        'signed_query[web_url]',
+        number,
+        single_pass=lambda: utils.signed_query(signer, WEB_URL_PARAMS, URL),
+        generic=encode_twice,
+    )
+
+
+def bench_get_buy_urls(number=20):
+    client = LaterPayClient('cp-key-1234', 'some-shared-secret')
+    items = [
+        ItemDefinition(
+            'article-%d' % i,
+            'EUR199,USD219',
+            'https://example.com/news/2020/01/article-%d' % i,
+            u'Article title number %d with ümlauts' % i,
+            expiry='+86400',
+        )
+        for i in range(200)
+    ]
+    kwargs = {
+        'product_key': 'some-product-key',
+        'return_url': 'https://example.com/news/2020/01/some-article-title?bought=1',
+        'failure_url': 'https://example.com/news/2020/01/some-article-title?failed=1',
+    }
+    results = _report(
+        'get_buy_urls[200 items]',
+        number,
+        batch=lambda: client.get_buy_urls(items, **kwargs),
+        generic=lambda: [client.get_buy_url(item, **kwargs) for item in items],
+    )
+    assert results['batch'] <= results['generic'], 'get_buy_urls is slower than looping over get_buy_url'
+
+
+if __name__ == '__main__':
+    bench_create_base_message()
+    bench_sign()
+    bench_verify()
+    bench_verify_query_string()
+    bench_signed_query()
+    bench_get_buy_urls()
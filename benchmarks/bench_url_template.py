@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Speed benchmark for ``UrlTemplate`` against ``LaterPayClient.get_buy_url``.
+
+Run with ``python benchmarks/bench_url_template.py``.
+"""
+from __future__ import print_function
+
+import timeit
+
+from laterpay import FrozenItemDefinition, ItemDefinition, LaterPayClient
+
+URL_KWARGS = {
+    'product_key': 'some-product',
+    'return_url': 'https://example.com/return?to=article',
+    'failure_url': 'https://example.com/failure',
+    'muid': 'some-user',
+}
+
+
+def bench(number=20000):
+    client = LaterPayClient('cp-key-1234', 'some-shared-secret')
+    template = client.compile_buy_url(**URL_KWARGS)
+    row = (
+        'article-1',
+        'EUR199,USD299',
+        'https://example.com/news/2020/01/some-article-title',
+        u'Some article title with spaces and ümlauts',
+        '+86400',
+    )
+    for cls in (ItemDefinition, FrozenItemDefinition):
+        item = cls(*row)
+        for name, func in [
+            ('get_buy_url', lambda: client.get_buy_url(item, **URL_KWARGS)),
+            ('UrlTemplate.render', lambda: template.render(item)),
+        ]:
+            value = min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+            print('%-48s %8.2f us' % ('%s[%s]' % (name, cls.__name__), value))
+
+
+if __name__ == '__main__':
+    bench()
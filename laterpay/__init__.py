@@ -18,29 +18,48 @@ try:
 except ImportError:
     from collections import Iterable
 
+import collections
 import logging
-import pkg_resources
+import os
 import random
 import re
 import string
+import threading
 import time
 import warnings
 
-import jwt
-import requests
-
 import six
 from six.moves.urllib.parse import quote_plus
 
-from . import compat, constants, signing, utils
+from . import coalescing, compat, constants, signing, utils
+from .retry import TRANSIENT_STATUS_CODES, CircuitOpenError
+from .cache import LRUCache
+
 
+# Read by setup.py, sent in the User-Agent header.
+__version__ = '5.10.0a1'
 
 _logger = logging.getLogger(__name__)
 
 _PRICING_RE = re.compile(r'[A-Z]{3}\d+')
+# Matches a comma separated list of prices, each starting like _PRICING_RE.
+_PRICING_LIST_RE = re.compile(r'[A-Z]{3}\d+[^,]*(?:,[A-Z]{3}\d+[^,]*)*\Z')
 _EXPIRY_RE = re.compile(r'^(\+?\d+)$')
 _SUB_ID_RE = re.compile(r'^[a-zA-Z0-9_-]{1,128}$')
 
+_PRICING_ERROR = 'Pricing is not valid: %s'
+_EXPIRY_ERROR = ("Invalid expiry value %s, it should be '+3600' or UTC-based "
+                 "epoch timestamp in seconds of type int")
+_SUB_ID_ERROR = (
+    "Invalid sub_id value '%s'. It can be any string consisting of lowercase or "
+    "uppercase ASCII characters, digits, underscore and hyphen, the length of "
+    "which is between 1 and 128 characters."
+)
+_PERIOD_ERROR = (
+    "Period not set or invalid value '%s'. The subscription period "
+    "must be an int in the range [3600, 31536000] (including)."
+)
+
 
 class InvalidTokenException(Exception):
     """
@@ -56,6 +75,27 @@ class InvalidItemDefinition(Exception):
     """
 
 
+class InvalidItemDefinitions(InvalidItemDefinition):
+    """
+    Raised when validating many item definitions at once, listing all errors.
+
+    ``errors`` maps the index of every invalid item to the ``list`` of its
+    error messages.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        messages = [
+            'item %s: %s' % (index, '; '.join(errors[index]))
+            for index in sorted(errors)[:10]
+        ]
+        if len(errors) > 10:
+            messages.append('...')
+        super(InvalidItemDefinitions, self).__init__(
+            '%d invalid item definitions: %s' % (len(errors), ', '.join(messages))
+        )
+
+
 class APIException(Exception):
     """
     This will be deprecated in a future release.
@@ -66,6 +106,140 @@ class APIException(Exception):
     """
 
 
+class _ValidationMemo(object):
+    """
+    Match values against ``regex``, remembering up to ``maxsize`` valid ones.
+
+    Item catalogs repeat a few distinct pricing, expiry and ``sub_id`` values,
+    and looking them up in a ``set`` is much cheaper than matching them
+    again. When full, the memo is cleared instead of evicting single entries,
+    which keeps lookups lock-free.
+    """
+
+    def __init__(self, regex, maxsize=4096):
+        self._match = regex.match
+        self.maxsize = maxsize
+        self._valid = set()
+
+    def __call__(self, value):
+        if value in self._valid:
+            return True
+        if not self._match(value):
+            return False
+        if len(self._valid) >= self.maxsize:
+            self._valid.clear()
+        self._valid.add(value)
+        return True
+
+
+_is_valid_pricing = _ValidationMemo(_PRICING_LIST_RE)
+_is_valid_expiry = _ValidationMemo(_EXPIRY_RE)
+_is_valid_sub_id = _ValidationMemo(_SUB_ID_RE)
+
+
+def _get_item_data(item_id, pricing, url, title, expiry=None, sub_id=None,
+                   period=None, item_type=None, election_id=None):
+    """
+    Validate the arguments of an item definition.
+
+    Return the ``dict`` of its params and its item type.
+    """
+    if not _is_valid_pricing(pricing):
+        raise InvalidItemDefinition(_PRICING_ERROR % pricing)
+
+    if expiry is not None and not _is_valid_expiry(expiry):
+        raise InvalidItemDefinition(_EXPIRY_ERROR % expiry)
+
+    data = {
+        'pricing': pricing,
+        'url': url,
+        'title': title,
+        'expiry': expiry,
+    }
+
+    if item_type in {
+        constants.ITEM_TYPE_CONTRIBUTION,
+        constants.ITEM_TYPE_DONATION,
+        constants.ITEM_TYPE_POLITICAL_CONTRIBUTION,
+    }:
+        data['campaign_id'] = item_id
+
+        if item_type == constants.ITEM_TYPE_POLITICAL_CONTRIBUTION:
+            data['election_id'] = election_id
+    else:
+        data['article_id'] = item_id
+        item_type = None
+
+    if sub_id is not None:
+        if _is_valid_sub_id(sub_id):
+            data['sub_id'] = sub_id
+        else:
+            raise InvalidItemDefinition(_SUB_ID_ERROR % sub_id)
+        if isinstance(period, int):
+            data['period'] = period
+        else:
+            raise InvalidItemDefinition(_PERIOD_ERROR % period)
+
+    return data, item_type
+
+
+def _check_column(errors, values, is_valid, message, required=False):
+    """
+    Add ``message`` to ``errors`` for every invalid value in ``values``.
+
+    ``None`` values are skipped, unless the column is ``required``. Each
+    distinct value is only checked once.
+    """
+    verdicts = {}
+    for index, value in enumerate(values):
+        if value is None:
+            if required:
+                errors.setdefault(index, []).append(message % (value, ))
+            continue
+        try:
+            valid = verdicts[value]
+        except KeyError:
+            try:
+                valid = verdicts[value] = is_valid(value)
+            except TypeError:
+                valid = verdicts[value] = False
+        except TypeError:
+            # Unhashable
+            valid = False
+        if not valid:
+            errors.setdefault(index, []).append(message % (value, ))
+
+
+def validate_item_columns(pricing=(), expiry=(), sub_id=(), period=()):
+    """
+    Validate the arguments of many item definitions, given column by column.
+
+    Every column is checked in one pass, validating each distinct value only
+    once. Instead of stopping at the first invalid item, all of them are
+    reported together.
+
+    :param pricing: sequence of ``pricing`` values, one per item. ``None``
+        stands for a missing pricing and is invalid.
+    :param expiry: sequence of ``expiry`` values or ``None``
+    :param sub_id: sequence of ``sub_id`` values or ``None``
+    :param period: sequence of ``period`` values, checked for the items with
+        a ``sub_id``
+    :raises InvalidItemDefinitions: if any item is invalid
+    """
+    errors = {}
+    _check_column(errors, pricing, _is_valid_pricing, _PRICING_ERROR, required=True)
+    _check_column(errors, expiry, _is_valid_expiry, _EXPIRY_ERROR)
+    _check_column(errors, sub_id, _is_valid_sub_id, _SUB_ID_ERROR)
+    period = list(period)
+    for index, value in enumerate(sub_id):
+        if value is not None:
+            item_period = period[index] if index < len(period) else None
+            if not isinstance(item_period, int):
+                errors.setdefault(index, []).append(_PERIOD_ERROR % (item_period, ))
+    if errors:
+        raise InvalidItemDefinitions(errors)
+
+
 class ItemDefinition(object):
     """
     Contains data about content being sold through LaterPay.
@@ -78,51 +252,201 @@ class ItemDefinition(object):
 
     def __init__(self, item_id, pricing, url, title, expiry=None, sub_id=None,
                  period=None, item_type=None, election_id=None):
-        for price in pricing.split(','):
-            if not _PRICING_RE.match(price):
-                raise InvalidItemDefinition('Pricing is not valid: %s' % pricing)
-
-        if expiry is not None and not _EXPIRY_RE.match(expiry):
-            raise InvalidItemDefinition("Invalid expiry value %s, it should be '+3600' or UTC-based "
-                                        "epoch timestamp in seconds of type int" % expiry)
-
-        self.data = {
-            'pricing': pricing,
-            'url': url,
-            'title': title,
-            'expiry': expiry,
-        }
+        self.data, self.item_type = _get_item_data(
+            item_id, pricing, url, title, expiry=expiry, sub_id=sub_id,
+            period=period, item_type=item_type, election_id=election_id,
+        )
+
+
+class FrozenItemDefinition(signing.QuotedParams):
+    """
+    A compact, immutable ``ItemDefinition``.
+
+    It takes the same arguments as ``ItemDefinition`` and can be used in its
+    place. Instead of a ``data`` dict it only keeps the params quoted and
+    sorted for signing, which are computed once, so creating URLs for the
+    item neither rebuilds nor re-quotes them. Use it when holding many items
+    in memory. See ``benchmarks/bench_item_definition.py``.
+    """
+
+    __slots__ = ('item_type',)
+
+    _shared_value_keys = frozenset(['pricing', 'expiry', 'period', 'sub_id', 'election_id'])
+
+    def __init__(self, item_id, pricing, url, title, expiry=None, sub_id=None,
+                 period=None, item_type=None, election_id=None):
+        data, item_type = _get_item_data(
+            item_id, pricing, url, title, expiry=expiry, sub_id=sub_id,
+            period=period, item_type=item_type, election_id=election_id,
+        )
+        super(FrozenItemDefinition, self).__init__(
+            dict((key, value) for key, value in six.iteritems(data) if value is not None)
+        )
+        object.__setattr__(self, 'item_type', item_type)
+
+    def __setattr__(self, name, value):
+        """
+        Refuse to set attributes, the item is immutable.
+        """
+        raise AttributeError('FrozenItemDefinition is immutable')
+
+    def __delattr__(self, name):
+        """
+        Refuse to delete attributes, the item is immutable.
+        """
+        raise AttributeError('FrozenItemDefinition is immutable')
+
+    def __reduce__(self):
+        """
+        Pickle the quoted params, which are not quoted again when unpickled.
+        """
+        return (_restore_frozen_item_definition, (self._quoted, self.item_type))
+
+    def __eq__(self, other):
+        """
+        Compare the params and item type with another ``FrozenItemDefinition``.
+        """
+        if not isinstance(other, FrozenItemDefinition):
+            return NotImplemented
+        return (self._quoted, self.item_type) == (other._quoted, other.item_type)
+
+    def __ne__(self, other):
+        """
+        Return the negation of ``__eq__``.
+        """
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        """
+        Return the hash of the params and the item type.
+        """
+        return hash((self._quoted, self.item_type))
+
+    def __repr__(self):
+        """
+        Show the url-encoded params.
+        """
+        return '<FrozenItemDefinition %s>' % self.query_string
+
+    @property
+    def data(self):
+        """
+        Return a new ``dict`` of the item's params.
+
+        This is like ``ItemDefinition.data`` without the ``None`` values. All
+        values are native strings, apart from ``period``.
+        """
+        data = dict(self.items())
+        if 'period' in data:
+            data['period'] = int(data['period'])
+        return data
+
+
+def _get_unavailable_access_data(article_ids):
+    """
+    Return the /access data standing in for a request refused by the circuit breaker.
+    """
+    return {
+        'status': 'ok',
+        'articles': {},
+        'unavailable': [compat.stringify(article_id) for article_id in article_ids],
+    }
 
-        if item_type in {
-            constants.ITEM_TYPE_CONTRIBUTION,
-            constants.ITEM_TYPE_DONATION,
-            constants.ITEM_TYPE_POLITICAL_CONTRIBUTION,
-        }:
-            self.data['campaign_id'] = item_id
-            self.item_type = item_type
 
-            if item_type == constants.ITEM_TYPE_POLITICAL_CONTRIBUTION:
-                self.data['election_id'] = election_id
+def _restore_frozen_item_definition(quoted, item_type):
+    item_definition = FrozenItemDefinition.__new__(FrozenItemDefinition)
+    object.__setattr__(item_definition, '_quoted', quoted)
+    object.__setattr__(item_definition, 'item_type', item_type)
+    return item_definition
+
+
+class UrlTemplate(object):
+    """
+    Creates web URLs of one kind for many items.
+
+    Created by ``LaterPayClient.compile_buy_url`` and friends, it resolves
+    the URL prefix and url-encodes and quotes the params not depending on
+    the item once. Rendering a URL for an item then only encodes and signs
+    the item's params. See ``benchmarks/bench_url_template.py``.
+
+    The params of the template take precedence over those of the item and
+    are appended to the item's params in the query string.
+    """
+
+    def __init__(self, client, get_page_type, prefix, data):
+        self._client = client
+        self._get_page_type = get_page_type
+        self._prefix = prefix
+        self._data = data
+        self._keys = frozenset(data)
+        self._base_urls = {}
+        # The timestamp and the ``signing.CanonicalParams`` including it.
+        self._common_params = (None, None)
+
+    def _get_base_url(self, item_definition):
+        page_type = self._get_page_type(item_definition)
+        base_url = self._base_urls.get(page_type)
+        if base_url is None:
+            base_url = self._base_urls[page_type] = '%s/%s' % (self._prefix, page_type)
+        return base_url
+
+    def _get_common_params(self):
+        """
+        Return the ``signing.CanonicalParams`` of the template.
+
+        They include the current timestamp, unless the template params have
+        a "ts" or are for a permalink.
+        """
+        if 'ts' in self._data or 'permalink' in self._data:
+            ts = None
         else:
-            self.data['article_id'] = item_id
-            self.item_type = None
+            ts = str(int(time.time()))
+        cached_ts, common_params = self._common_params
+        if common_params is None or ts != cached_ts:
+            data = dict(self._data)
+            if ts is not None:
+                data['ts'] = ts
+            common_params = signing.CanonicalParams(data)
+            self._common_params = (ts, common_params)
+        return common_params
+
+    def render(self, item_definition):
+        """
+        Return the URL for ``item_definition``.
+        """
+        base_url = self._get_base_url(item_definition)
+        common_params = self._get_common_params()
+        signer = self._client.signer
+
+        if isinstance(item_definition, FrozenItemDefinition) and not any(
+            key in self._keys for key in item_definition.keys()
+        ):
+            signature = signer.sign(item_definition, base_url, method='GET', common_params=common_params)
+            return '%s?%s&%s&hmac=%s' % (
+                base_url,
+                item_definition.query_string,
+                common_params.query_string,
+                signature,
+            )
 
-        if sub_id is not None:
-            if _SUB_ID_RE.match(sub_id):
-                self.data['sub_id'] = sub_id
-            else:
-                raise InvalidItemDefinition(
-                    "Invalid sub_id value '%s'. It can be any string consisting of lowercase or "
-                    "uppercase ASCII characters, digits, underscore and hyphen, the length of "
-                    "which is between 1 and 128 characters." % sub_id
-                )
-            if isinstance(period, int):
-                self.data['period'] = period
-            else:
-                raise InvalidItemDefinition(
-                    "Period not set or invalid value '%s'. The subscription period "
-                    "must be an int in the range [3600, 31536000] (including)." % period,
-                )
+        # Quote the item's params once, for both the query string and the
+        # signature, and splice them into the template's params.
+        pairs = []
+        for key, value in six.iteritems(item_definition.data):
+            if value is None or key in self._keys:
+                continue
+            key = signing._quote_token(compat.stringify(key))
+            for value in (value if isinstance(value, (list, tuple)) else [value]):
+                pairs.append((key, signing._quote_token(compat.stringify(value))))
+        signature = signer._sign_quoted_pairs(
+            signing._get_signed_pairs(pairs), base_url, 'GET', common_params=common_params,
+        )
+        return '%s?%s&hmac=%s' % (
+            base_url,
+            utils._join_queries(signing._join_query_pairs(pairs), common_params.query_string),
+            signature,
+        )
 
 
 class LaterPayClient(object):
@@ -134,7 +458,14 @@ class LaterPayClient(object):
                  web_root='https://web.laterpay.net',
                  lptoken=None,
                  timeout_seconds=10,
-                 connection_handler=None):
+                 connection_handler=None,
+                 pool_size=10,
+                 keep_alive=True,
+                 access_cache=None,
+                 single_flight=False,
+                 max_url_length=2000,
+                 retry_policy=None,
+                 circuit_breaker=None):
         """
         Instantiate a LaterPay API client.
 
@@ -142,12 +473,43 @@ class LaterPayClient(object):
 
         https://docs.laterpay.net/
 
+        :param shared_secret: the shared secret, or a
+            ``laterpay.signing.KeyRing`` to accept signatures created with
+            previous secrets while rotating it.
         :param timeout_seconds: number of seconds after which backend api
             requests (e.g. /access) will time out (10 by default).
-        :param connection_handler: Defaults to Python requests. Set it to
-            ``requests.Session()`` to use a `Python requests Session object
-            <http://docs.python-requests.org/en/master/user/advanced/#session-objects>`_.
-
+        :param connection_handler: Defaults to a `Python requests Session
+            object <http://docs.python-requests.org/en/master/user/advanced/#session-objects>`_
+            owned by the client, which keeps connections to the API open.
+            Set it to e.g. the ``requests`` module or your own session to
+            manage connections yourself.
+        :param pool_size: maximum number of connections the default session
+            keeps open to the API (10 by default).
+        :param keep_alive: whether the default session keeps connections open
+            between requests (``True`` by default).
+        :param access_cache: an optional ``laterpay.cache.AccessCache``, e.g.
+            ``InMemoryAccessCache()`` or a ``SQLiteAccessCache`` shared by
+            several processes, to cache the results of /access calls per
+            user and article.
+        :param single_flight: if ``True``, concurrent identical /access
+            requests from several threads share a single API request and its
+            result (``False`` by default).
+        :param max_url_length: the maximum length of /access URLs (2000 by
+            default). Requests for more article ids are split into several
+            requests, sent concurrently.
+        :param retry_policy: an optional ``laterpay.retry.RetryPolicy`` to
+            retry /access requests failing with connection errors, timeouts
+            or transient HTTP errors.
+        :param circuit_breaker: an optional ``laterpay.retry.CircuitBreaker``.
+            While it is open, /access requests raise
+            ``laterpay.retry.CircuitOpenError`` right away. Articles found in
+            the ``access_cache`` (including stale ones) are still served from
+            it, see :meth:`get_access_data`.
+
+        The default session is recreated in child processes after a fork, so
+        the client can be created before the workers of a pre-fork server.
+        Call :meth:`close` or use the client as a context manager to close
+        the connections.
         """
         self.cp_key = cp_key
         self.api_root = api_root
@@ -155,7 +517,95 @@ class LaterPayClient(object):
         self.shared_secret = shared_secret
         self.lptoken = lptoken
         self.timeout_seconds = timeout_seconds
-        self.connection_handler = connection_handler or requests
+        self.connection_handler = connection_handler
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.access_cache = access_cache
+        self.max_url_length = max_url_length
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self._single_flight = self._create_single_flight() if single_flight else None
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+        self._canonical_params_cache = LRUCache(maxsize=32)
+        self._request_headers_cache = None
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_pool = None
+        self._refresh_pid = None
+
+    def _create_single_flight(self):
+        return coalescing.SingleFlight()
+
+    def __enter__(self):
+        """
+        Return the client, to be closed on exit.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Close the client.
+        """
+        self.close()
+
+    @property
+    def connection_handler(self):
+        if self._connection_handler is not None:
+            return self._connection_handler
+        with self._session_lock:
+            pid = os.getpid()
+            if self._session is None or self._session_pid != pid:
+                # After a fork the parent's connections must not be shared,
+                # so the child starts with a fresh session.
+                self._session = self._create_session()
+                self._session_pid = pid
+            return self._session
+
+    @connection_handler.setter
+    def connection_handler(self, value):
+        self._connection_handler = value
+
+    def _create_session(self):
+        import requests
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self):
+        """
+        Close the connections of the default session.
+
+        A custom ``connection_handler`` is left alone. The client can still
+        be used afterwards, opening new connections as needed.
+
+        Pending background refreshes of the ``access_cache`` are finished
+        first.
+        """
+        with self._refresh_lock:
+            pool, self._refresh_pool = self._refresh_pool, None
+        if pool is not None and self._refresh_pid == os.getpid():
+            pool.close()
+            pool.join()
+        with self._session_lock:
+            session, self._session = self._session, None
+            if session is not None and self._session_pid == os.getpid():
+                session.close()
+
+    @property
+    def shared_secret(self):
+        return self.signer.secret
+
+    @shared_secret.setter
+    def shared_secret(self, value):
+        # Key the HMAC once per secret instead of on every signed URL.
+        self.signer = signing._get_signer(value)
 
     def get_gettoken_redirect(self, return_to):
         """
@@ -168,7 +618,7 @@ class LaterPayClient(object):
             'redir': return_to,
             'cp': self.cp_key,
         }
-        return utils.signed_url(self.shared_secret, data, url, method='GET')
+        return utils.signed_url(self.signer, data, url, method='GET')
 
     def get_controls_links_url(self,
                                next_url,
@@ -208,7 +658,7 @@ class LaterPayClient(object):
 
         url = '%s/controls/links' % self.web_root
 
-        return utils.signed_url(self.shared_secret, data, url, method='GET')
+        return utils.signed_url(self.signer, data, url, method='GET')
 
     def get_controls_balance_url(self, forcelang=None):
         """
@@ -223,7 +673,7 @@ class LaterPayClient(object):
 
         base_url = "{web_root}/controls/balance".format(web_root=self.web_root)
 
-        return utils.signed_url(self.shared_secret, data, base_url, method='GET')
+        return utils.signed_url(self.signer, data, base_url, method='GET')
 
     def get_login_dialog_url(self, next_url, use_jsevents=False):
         """Get the URL for a login page."""
@@ -263,28 +713,20 @@ class LaterPayClient(object):
     def _gettoken_url(self):
         return '%s/gettoken' % self.api_root
 
-    def _get_web_url(self,
-                     item_definition,
-                     page_type,
-                     product_key=None,
-                     dialog=True,
-                     use_jsevents=False,
-                     transaction_reference=None,
-                     consumable=False,
-                     return_url=None,
-                     failure_url=None,
-                     muid=None,
-                     is_permalink=False,
-                     **kwargs):
-
-        # filter out params with None value.
-        data = {
-            k: v
-            for k, v
-            in six.iteritems(item_definition.data)
-            if v is not None
-        }
-        data['cp'] = self.cp_key
+    def _get_web_url_params(self,
+                            product_key=None,
+                            dialog=True,
+                            use_jsevents=False,
+                            transaction_reference=None,
+                            consumable=False,
+                            return_url=None,
+                            failure_url=None,
+                            muid=None,
+                            **kwargs):
+        """
+        Return the URL prefix and the item independent params for a web URL.
+        """
+        data = {'cp': self.cp_key}
 
         if product_key is not None:
             data['product'] = product_key
@@ -316,37 +758,258 @@ class LaterPayClient(object):
 
         data.update(kwargs)
 
+        return prefix, data
+
+    def _get_web_url(self,
+                     item_definition,
+                     page_type,
+                     product_key=None,
+                     dialog=True,
+                     use_jsevents=False,
+                     transaction_reference=None,
+                     consumable=False,
+                     return_url=None,
+                     failure_url=None,
+                     muid=None,
+                     is_permalink=False,
+                     **kwargs):
+
+        prefix, common_data = self._get_web_url_params(
+            product_key=product_key,
+            dialog=dialog,
+            use_jsevents=use_jsevents,
+            transaction_reference=transaction_reference,
+            consumable=consumable,
+            return_url=return_url,
+            failure_url=failure_url,
+            muid=muid,
+            **kwargs
+        )
+
         base_url = "%s/%s" % (prefix, page_type)
 
+        if isinstance(item_definition, FrozenItemDefinition) and not any(
+            key in common_data for key in item_definition.keys()
+        ):
+            return self._get_frozen_item_web_url(item_definition, base_url, common_data, is_permalink)
+
+        # filter out params with None value and those overridden by the
+        # common params.
+        data = {
+            k: v
+            for k, v
+            in six.iteritems(item_definition.data)
+            if v is not None and k not in common_data
+        }
+
         return utils.signed_url(
-            self.shared_secret,
+            self.signer,
             data,
             base_url,
             method='GET',
-            is_permalink=is_permalink,
+            add_timestamp=False,
+            common_params=self._get_web_url_common_params(common_data, is_permalink),
         )
 
-    def get_buy_url(self, item_definition, *args, **kwargs):
+    def _get_frozen_item_web_url(self, item_definition, base_url, common_data, is_permalink):
         """
-        Get the URL at which a user can start the checkout process.
+        Return the web URL for a ``FrozenItemDefinition``.
 
-        The created URL is a "pay_now" link for a single item, timepass,
-        contribution, or donations.
+        The item's quoted params are spliced into the signed message as they
+        are.
+        """
+        common_params = self._get_web_url_common_params(common_data, is_permalink)
+        signature = self.signer.sign(item_definition, base_url, method='GET', common_params=common_params)
+        return '%s?%s&%s&hmac=%s' % (
+            base_url,
+            item_definition.query_string,
+            common_params.query_string,
+            signature,
+        )
 
-        https://docs.laterpay.net/platform/dialogs/buy/
+    def _get_web_url_common_params(self, common_data, is_permalink):
+        """
+        Return the ``signing.CanonicalParams`` of the item independent params.
+
+        The "ts" or "permalink" param is added last, so web URLs list the
+        item's params, the item independent ones, then the timestamp. The
+        params, including the timestamp, are prepared once and cached.
+        """
+        if is_permalink:
+            common_data.pop('ts', None)
+            common_data['permalink'] = '1'
+        elif 'ts' not in common_data:
+            common_data['ts'] = str(int(time.time()))
+        return self._get_canonical_params(common_data)
+
+    def _get_canonical_params(self, shared_data):
+        """
+        Return the ``signing.CanonicalParams`` for the params of many URLs.
+
+        The prepared params are cached, since a client usually creates URLs
+        with a few distinct combinations of them only.
+        """
+        # Key on the values as they are signed, so that e.g. ``1`` and
+        # ``True`` don't share an entry.
+        shared_data = signing.normalise_param_structure(shared_data)
+        key = tuple(sorted((k, tuple(v)) for k, v in six.iteritems(shared_data)))
+        canonical_params = self._canonical_params_cache.get(key)
+        if canonical_params is None:
+            canonical_params = signing.CanonicalParams(shared_data)
+            self._canonical_params_cache.set(key, canonical_params)
+        return canonical_params
+
+    def _get_web_urls(self,
+                      item_definitions,
+                      get_page_type,
+                      product_key=None,
+                      dialog=True,
+                      use_jsevents=False,
+                      transaction_reference=None,
+                      consumable=False,
+                      return_url=None,
+                      failure_url=None,
+                      muid=None,
+                      is_permalink=False,
+                      **kwargs):
         """
+        Return the web URLs for many items, in the order of `item_definitions`.
+
+        The item independent params are only built, url-encoded and quoted for
+        signing once per page type.
+        """
+        prefix, common_data = self._get_web_url_params(
+            product_key=product_key,
+            dialog=dialog,
+            use_jsevents=use_jsevents,
+            transaction_reference=transaction_reference,
+            consumable=consumable,
+            return_url=return_url,
+            failure_url=failure_url,
+            muid=muid,
+            **kwargs
+        )
+        # Share a single timestamp across all page types.
+        if not is_permalink and 'ts' not in common_data:
+            common_data['ts'] = str(int(time.time()))
+
+        # Group the items by page type, remembering their position.
+        groups = {}
+        for index, item_definition in enumerate(item_definitions):
+            if isinstance(item_definition, FrozenItemDefinition) and not any(
+                key in common_data for key in item_definition.keys()
+            ):
+                # Signed with its quoted params as they are.
+                data = item_definition
+            else:
+                # filter out params with None value and those overridden by
+                # the common params.
+                data = {
+                    k: v
+                    for k, v
+                    in six.iteritems(item_definition.data)
+                    if v is not None and k not in common_data
+                }
+            groups.setdefault(get_page_type(item_definition), []).append((index, data))
+
+        urls = [None] * sum(len(group) for group in groups.values())
+        for page_type, group in six.iteritems(groups):
+            base_url = "%s/%s" % (prefix, page_type)
+            group_urls = utils.signed_urls(
+                self.signer,
+                [params for _, params in group],
+                base_url,
+                method='GET',
+                is_permalink=is_permalink,
+                common_params=common_data,
+            )
+            for (index, _), url in zip(group, group_urls):
+                urls[index] = url
+
+        return urls
+
+    def _get_buy_page_type(self, item_definition):
         item_type = item_definition.item_type
         if item_type == constants.ITEM_TYPE_CONTRIBUTION:
-            page_type = 'contribute/pay_now'
+            return 'contribute/pay_now'
         elif item_type == constants.ITEM_TYPE_DONATION:
-            page_type = 'donate/pay_now'
+            return 'donate/pay_now'
         elif item_type == constants.ITEM_TYPE_POLITICAL_CONTRIBUTION:
-            page_type = 'political_contribution/pay_now'
-        else:
-            page_type = 'buy'
+            return 'political_contribution/pay_now'
+        return 'buy'
 
+    def _get_add_page_type(self, item_definition):
+        item_type = item_definition.item_type
+        if item_type == constants.ITEM_TYPE_CONTRIBUTION:
+            return 'contribute/pay_later'
+        elif item_type == constants.ITEM_TYPE_DONATION:
+            return 'donate/pay_later'
+        elif item_type == constants.ITEM_TYPE_POLITICAL_CONTRIBUTION:
+            return 'political_contribution/pay_later'
+        return 'add'
+
+    def _get_subscribe_page_type(self, item_definition):
+        return 'subscribe'
+
+    def _compile_web_url(self,
+                         get_page_type,
+                         product_key=None,
+                         dialog=True,
+                         use_jsevents=False,
+                         transaction_reference=None,
+                         consumable=False,
+                         return_url=None,
+                         failure_url=None,
+                         muid=None,
+                         is_permalink=False,
+                         **kwargs):
+        prefix, data = self._get_web_url_params(
+            product_key=product_key,
+            dialog=dialog,
+            use_jsevents=use_jsevents,
+            transaction_reference=transaction_reference,
+            consumable=consumable,
+            return_url=return_url,
+            failure_url=failure_url,
+            muid=muid,
+            **kwargs
+        )
+        if is_permalink:
+            data.pop('ts', None)
+            data['permalink'] = '1'
+        return UrlTemplate(self, get_page_type, prefix, data)
+
+    def get_buy_url(self, item_definition, *args, **kwargs):
+        """
+        Get the URL at which a user can start the checkout process.
+
+        The created URL is a "pay_now" link for a single item, timepass,
+        contribution, or donations.
+
+        https://docs.laterpay.net/platform/dialogs/buy/
+        """
+        page_type = self._get_buy_page_type(item_definition)
         return self._get_web_url(item_definition, page_type, *args, **kwargs)
 
+    def get_buy_urls(self, item_definitions, *args, **kwargs):
+        """
+        Get the buy URLs for many items at once.
+
+        Takes the same arguments as :meth:`get_buy_url` but an iterable of
+        item definitions, and returns a ``list`` of URLs in the same order.
+        The signing setup is shared across all items.
+        """
+        return self._get_web_urls(item_definitions, self._get_buy_page_type, *args, **kwargs)
+
+    def compile_buy_url(self, *args, **kwargs):
+        """
+        Return a ``UrlTemplate`` creating buy URLs for many items.
+
+        Takes the same arguments as :meth:`get_buy_url`, apart from the item
+        definition, which is passed to ``UrlTemplate.render`` instead.
+        """
+        return self._compile_web_url(self._get_buy_page_type, *args, **kwargs)
+
     def get_add_url(self, item_definition, *args, **kwargs):
         """
         Get the URL at which a user can start the checkout process.
@@ -356,25 +1019,55 @@ class LaterPayClient(object):
 
         https://docs.laterpay.net/platform/dialogs/add/
         """
-        item_type = item_definition.item_type
-        if item_type == constants.ITEM_TYPE_CONTRIBUTION:
-            page_type = 'contribute/pay_later'
-        elif item_type == constants.ITEM_TYPE_DONATION:
-            page_type = 'donate/pay_later'
-        elif item_type == constants.ITEM_TYPE_POLITICAL_CONTRIBUTION:
-            page_type = 'political_contribution/pay_later'
-        else:
-            page_type = 'add'
-
+        page_type = self._get_add_page_type(item_definition)
         return self._get_web_url(item_definition, page_type, *args, **kwargs)
 
+    def get_add_urls(self, item_definitions, *args, **kwargs):
+        """
+        Get the add URLs for many items at once.
+
+        Takes the same arguments as :meth:`get_add_url` but an iterable of
+        item definitions, and returns a ``list`` of URLs in the same order.
+        The signing setup is shared across all items.
+        """
+        return self._get_web_urls(item_definitions, self._get_add_page_type, *args, **kwargs)
+
+    def compile_add_url(self, *args, **kwargs):
+        """
+        Return a ``UrlTemplate`` creating add URLs for many items.
+
+        Takes the same arguments as :meth:`get_add_url`, apart from the item
+        definition, which is passed to ``UrlTemplate.render`` instead.
+        """
+        return self._compile_web_url(self._get_add_page_type, *args, **kwargs)
+
     def get_subscribe_url(self, item_definition, *args, **kwargs):
         """
         Get the URL at which a user can subscribe to an item.
 
         https://docs.laterpay.net/platform/dialogs/subscribe/
         """
-        return self._get_web_url(item_definition, 'subscribe', *args, **kwargs)
+        page_type = self._get_subscribe_page_type(item_definition)
+        return self._get_web_url(item_definition, page_type, *args, **kwargs)
+
+    def get_subscribe_urls(self, item_definitions, *args, **kwargs):
+        """
+        Get the subscribe URLs for many items at once.
+
+        Takes the same arguments as :meth:`get_subscribe_url` but an iterable
+        of item definitions, and returns a ``list`` of URLs in the same order.
+        The signing setup is shared across all items.
+        """
+        return self._get_web_urls(item_definitions, self._get_subscribe_page_type, *args, **kwargs)
+
+    def compile_subscribe_url(self, *args, **kwargs):
+        """
+        Return a ``UrlTemplate`` creating subscribe URLs for many items.
+
+        Takes the same arguments as :meth:`get_subscribe_url`, apart from the item
+        definition, which is passed to ``UrlTemplate.render`` instead.
+        """
+        return self._compile_web_url(self._get_subscribe_page_type, *args, **kwargs)
 
     def has_token(self):
         """
@@ -388,11 +1081,17 @@ class LaterPayClient(object):
         """
         Return a ``dict`` of request headers to be sent to the API.
         """
-        version = pkg_resources.get_distribution('laterpay-client').version
-        return {
-            'X-LP-APIVersion': '2',
-            'User-Agent': 'LaterPay Client Python v%s' % version,
-        }
+        return dict(self._request_headers)
+
+    @property
+    def _request_headers(self):
+        # Built once per client and shared by all API requests.
+        if self._request_headers_cache is None:
+            self._request_headers_cache = {
+                'X-LP-APIVersion': '2',
+                'User-Agent': 'LaterPay Client Python v%s' % __version__,
+            }
+        return self._request_headers_cache
 
     def get_access_url(self):
         """
@@ -413,26 +1112,43 @@ class LaterPayClient(object):
         :param lptoken: optional lptoken as `str`
         :param str muid: merchant defined user ID. Optional.
         """
-        if isinstance(article_ids, (six.text_type, six.binary_type)):
-            article_ids = [article_ids]
-        elif isinstance(article_ids, Iterable):
-            article_ids = list(sorted(article_ids))
-        else:
-            warnings.warn(
-                'laterpay.LaterPayClient.get_access_params expects a string or '
-                'a subclass of collections.Iterable as `article_ids`. Received '
-                'a %r instead.' % type(article_ids),
-                DeprecationWarning
-            )
-            article_ids = [article_ids]
-
         params = {
             'cp': self.cp_key,
             'ts': str(int(time.time())),
-            'article_id': article_ids,
+            'article_id': self._get_article_ids(article_ids),
         }
+        identity_param, identity = self._get_access_identity(lptoken, muid)
+        params[identity_param] = identity
+
+        params['hmac'] = signing.sign(
+            secret=self.signer,
+            params=params.copy(),
+            url=self.get_access_url(),
+            method='GET',
+        )
+
+        return params
 
+    def _get_article_ids(self, article_ids):
         """
+        Return ``article_ids`` as a sorted list.
+        """
+        if isinstance(article_ids, (six.text_type, six.binary_type)):
+            return [article_ids]
+        elif isinstance(article_ids, Iterable):
+            return list(sorted(article_ids))
+        warnings.warn(
+            'laterpay.LaterPayClient.get_access_params expects a string or '
+            'a subclass of collections.Iterable as `article_ids`. Received '
+            'a %r instead.' % type(article_ids),
+            DeprecationWarning
+        )
+        return [article_ids]
+
+    def _get_access_identity(self, lptoken=None, muid=None):
+        """
+        Return the name and value of the param identifying the user.
+
         Matrix on which combinations of `lptoken`, `muid`, and `self.lptoken`
         are allowed. In words:
 
@@ -453,39 +1169,307 @@ class LaterPayClient(object):
                |   m   |   m   | not m | not m
         """
         if lptoken is None and muid is not None:
-            params['muid'] = muid
+            return 'muid', muid
         elif lptoken is not None and muid is None:
-            params['lptoken'] = lptoken
+            return 'lptoken', lptoken
         elif lptoken is None and muid is None and self.lptoken is not None:
-            params['lptoken'] = self.lptoken
-        else:
-            raise AssertionError(
-                'Either lptoken, self.lptoken or muid has to be passed. '
-                'Passing neither or both lptoken and muid is not allowed.',
-            )
-
-        params['hmac'] = signing.sign(
-            secret=self.shared_secret,
-            params=params.copy(),
-            url=self.get_access_url(),
-            method='GET',
+            return 'lptoken', self.lptoken
+        raise AssertionError(
+            'Either lptoken, self.lptoken or muid has to be passed. '
+            'Passing neither or both lptoken and muid is not allowed.',
         )
 
-        return params
-
     def get_access_data(self, article_ids, lptoken=None, muid=None):
         """
         Perform a request to /access API and return obtained data.
 
-        This method uses ``requests.get`` or ``requests.Session().get`` to
-        fetch the data and then calls ``.raise_for_status()`` on the response.
+        This method uses the ``connection_handler``, by default a pooled
+        ``requests.Session``, to fetch the data and then calls
+        ``.raise_for_status()`` on the response.
         It does not handle any errors raised by ``requests`` API.
 
+        With an ``access_cache``, only the articles missing from the cache
+        are requested from the API. Stale entries within the cache's
+        ``stale_ttl`` are returned right away and refreshed in a background
+        thread.
+
+        While the ``circuit_breaker`` is open, the cached entries are
+        returned and the ids of the articles missing from the cache are
+        listed in the response's ``unavailable`` key. If none of the
+        articles are cached, ``laterpay.retry.CircuitOpenError`` is raised.
+
         :param article_ids: Iterable of article ids or a single article id as a
                             string
         :param lptoken: optional lptoken as `str`
         :param str muid: merchant defined user ID. Optional.
         """
+        if self.access_cache is None:
+            return self._fetch_access_data(article_ids, lptoken=lptoken, muid=muid)
+
+        keys, cached, missing, stale = self._get_cached_access_data(article_ids, lptoken=lptoken, muid=muid)
+        data = None
+        if missing:
+            try:
+                data = self._fetch_access_data(missing, lptoken=lptoken, muid=muid)
+            except CircuitOpenError:
+                if not cached:
+                    raise
+                data = _get_unavailable_access_data(missing)
+        if stale:
+            self._refresh_stale_access_data(stale, lptoken=lptoken, muid=muid)
+        return self._update_access_cache(data, keys, cached)
+
+    def _get_access_key(self, article_ids, lptoken=None, muid=None):
+        """
+        Return a key identifying an /access request.
+
+        It holds the same data as ``get_access_params``, apart from the
+        ``ts`` and ``hmac`` params changing with every request.
+        """
+        identity_param, identity = self._get_access_identity(lptoken, muid)
+        article_ids = tuple(compat.stringify(article_id) for article_id in self._get_article_ids(article_ids))
+        return (self.cp_key, identity_param, compat.stringify(identity), article_ids)
+
+    def _fetch_access_data(self, article_ids, lptoken=None, muid=None):
+        """
+        Request the /access data of ``article_ids``.
+
+        With ``single_flight`` enabled, the request is shared with identical
+        concurrent ones.
+        """
+        if self._single_flight is None:
+            return self._request_access_data(article_ids, lptoken=lptoken, muid=muid)
+        key = self._get_access_key(article_ids, lptoken=lptoken, muid=muid)
+        return self._single_flight.do(key, self._request_access_data, article_ids, lptoken=lptoken, muid=muid)
+
+    def _get_cached_access_data(self, article_ids, lptoken=None, muid=None):
+        """
+        Look up the /access data of ``article_ids`` in the ``access_cache``.
+
+        Return a ``dict`` mapping cache keys to article ids, a ``dict`` with
+        the cached entries including stale ones, the list of article ids to
+        request, and a ``dict`` mapping the keys of stale entries to their
+        article ids.
+        """
+        identity_param, identity = self._get_access_identity(lptoken, muid)
+        identity = '%s:%s' % (identity_param, compat.stringify(identity))
+        keys = collections.OrderedDict()
+        for article_id in self._get_article_ids(article_ids):
+            keys[(self.cp_key, identity, compat.stringify(article_id))] = article_id
+        cached, stale_cached = self.access_cache.get_many_with_stale(keys)
+        cached.update(stale_cached)
+        missing = [article_id for key, article_id in keys.items() if key not in cached]
+        stale = collections.OrderedDict(
+            (key, article_id) for key, article_id in keys.items() if key in stale_cached
+        )
+        return keys, cached, missing, stale
+
+    def _refresh_stale_access_data(self, keys, lptoken=None, muid=None):
+        """
+        Refresh the stale access cache entries ``keys`` in the background.
+
+        Entries which are already being refreshed are skipped, as are all
+        entries while the ``circuit_breaker`` is open.
+        """
+        if self.circuit_breaker is not None and self.circuit_breaker.is_open:
+            return
+        with self._refresh_lock:
+            keys = collections.OrderedDict(
+                (key, article_id) for key, article_id in keys.items() if key not in self._refreshing
+            )
+            self._refreshing.update(keys)
+        if keys:
+            self._schedule_refresh(keys, lptoken=lptoken, muid=muid)
+
+    def _schedule_refresh(self, keys, lptoken=None, muid=None):
+        with self._refresh_lock:
+            pid = os.getpid()
+            if self._refresh_pool is None or self._refresh_pid != pid:
+                # Threads do not survive a fork.
+                from multiprocessing.pool import ThreadPool
+
+                self._refresh_pool = ThreadPool(self.pool_size)
+                self._refresh_pid = pid
+            self._refresh_pool.apply_async(self._refresh_access_cache, (keys,), {'lptoken': lptoken, 'muid': muid})
+
+    def _refresh_access_cache(self, keys, lptoken=None, muid=None):
+        try:
+            data = self._fetch_access_data(list(keys.values()), lptoken=lptoken, muid=muid)
+            self._update_access_cache(data, keys, {})
+        except Exception:
+            _logger.exception('Refreshing stale access data failed')
+        finally:
+            self._refresh_done(keys)
+
+    def _refresh_done(self, keys):
+        with self._refresh_lock:
+            self._refreshing.difference_update(keys)
+
+    def _update_access_cache(self, data, keys, cached):
+        """
+        Cache the articles of the /access response ``data``.
+
+        Return ``data`` merged with the ``cached`` entries. ``data`` is
+        ``None`` if all articles were cached. Error responses are neither
+        cached nor merged.
+        """
+        if data is None:
+            data = {'status': 'ok', 'articles': {}}
+        elif data.get('status') != 'ok':
+            return data
+        articles = data.get('articles') or {}
+
+        fetched = {}
+        for key in keys:
+            if key not in cached and key[-1] in articles:
+                fetched[key] = articles[key[-1]]
+        self.access_cache.set_many(fetched)
+
+        data = dict(data)
+        data['articles'] = dict(articles)
+        for key, value in cached.items():
+            data['articles'][key[-1]] = value
+        return data
+
+    def _get_article_id_chunks(self, article_ids, lptoken=None, muid=None):
+        """
+        Split ``article_ids`` into chunks for separate /access requests.
+
+        The URL of each chunk stays below ``max_url_length``. Every chunk
+        holds at least one article id.
+        """
+        article_ids = self._get_article_ids(article_ids)
+        identity_param, identity = self._get_access_identity(lptoken, muid)
+        # URL, cp, ts and the user, plus room for a SHA224 hmac.
+        length = len(self.get_access_url()) + len('?cp=&ts=&=&hmac=') + 10 + 56
+        length += len(quote_plus(compat.stringify(self.cp_key)))
+        length += len(identity_param) + len(quote_plus(compat.stringify(identity)))
+
+        chunks = []
+        chunk, chunk_length = [], length
+        for article_id in article_ids:
+            article_id_length = len('&article_id=') + len(quote_plus(compat.stringify(article_id)))
+            if chunk and chunk_length + article_id_length > self.max_url_length:
+                chunks.append(chunk)
+                chunk, chunk_length = [], length
+            chunk.append(article_id)
+            chunk_length += article_id_length
+        chunks.append(chunk)
+        return chunks
+
+    def _merge_access_data(self, responses):
+        """
+        Merge the /access ``responses`` of several chunks into one.
+
+        The first error response is returned as it is.
+        """
+        for data in responses:
+            if data.get('status') != 'ok':
+                return data
+        merged = dict(responses[0])
+        merged['articles'] = {}
+        for data in responses:
+            merged['articles'].update(data.get('articles') or {})
+        return merged
+
+    def _request_access_data(self, article_ids, lptoken=None, muid=None):
+        """
+        Request the /access data of ``article_ids`` from the API.
+
+        Long lists of article ids are split into several requests, which are
+        sent concurrently over up to ``pool_size`` connections.
+        """
+        chunks = self._get_article_id_chunks(article_ids, lptoken=lptoken, muid=muid)
+        if len(chunks) == 1:
+            return self._send_access_request(chunks[0], lptoken=lptoken, muid=muid)
+
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(min(len(chunks), self.pool_size))
+        try:
+            responses = pool.map(
+                lambda chunk: self._send_access_request(chunk, lptoken=lptoken, muid=muid),
+                chunks,
+            )
+        finally:
+            pool.close()
+            pool.join()
+        return self._merge_access_data(responses)
+
+    def _send_access_request(self, article_ids, lptoken=None, muid=None):
+        """
+        Send a single /access request.
+
+        Transient errors are retried according to the ``retry_policy``, and
+        requests fail fast while the ``circuit_breaker`` is open. Every
+        attempt is signed anew.
+        """
+        if self.retry_policy is not None:
+            self.retry_policy.record_request()
+        retry = 0
+        while True:
+            self._check_circuit()
+            try:
+                data = self._get_access_response(article_ids, lptoken=lptoken, muid=muid)
+            except Exception as exc:
+                delay = self._get_retry_delay(exc, retry)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                retry += 1
+            else:
+                self._record_outcome(True)
+                return data
+
+    def _check_circuit(self):
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow_request():
+            raise CircuitOpenError('The circuit breaker for the LaterPay API is open')
+
+    def _record_outcome(self, success):
+        if self.circuit_breaker is None:
+            return
+        if success:
+            self.circuit_breaker.record_success()
+        else:
+            self.circuit_breaker.record_failure()
+
+    def _is_transient_error(self, exc):
+        """
+        Return whether the request failing with ``exc`` is worth retrying.
+        """
+        import requests
+
+        if isinstance(exc, requests.HTTPError):
+            return exc.response is not None and exc.response.status_code in self._retry_on_status
+        return isinstance(exc, (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ))
+
+    @property
+    def _retry_on_status(self):
+        if self.retry_policy is not None:
+            return self.retry_policy.retry_on_status
+        return TRANSIENT_STATUS_CODES
+
+    def _get_retry_delay(self, exc, retry):
+        """
+        Record the failure ``exc`` of an attempt and return the retry delay.
+
+        This is the number of seconds to wait before the ``retry``-th retry,
+        or ``None`` to give up.
+        """
+        transient = self._is_transient_error(exc)
+        # Other errors, like a 4xx response, mean the API itself is working.
+        self._record_outcome(not transient)
+        if not transient or self.retry_policy is None:
+            return None
+        if not self.retry_policy.acquire_retry(retry):
+            return None
+        return self.retry_policy.get_backoff(retry)
+
+    def _get_access_response(self, article_ids, lptoken=None, muid=None):
         params = self.get_access_params(article_ids=article_ids, lptoken=lptoken, muid=muid)
         url = self.get_access_url()
         headers = self.get_request_headers()
@@ -517,4 +1501,6 @@ class LaterPayClient(object):
         }
         if muid:
             data['muid'] = compat.stringify(muid)
+        import jwt
+
         return jwt.encode(data, self.shared_secret).decode()
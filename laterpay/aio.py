@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+An asyncio based LaterPay API client.
+
+Requires Python 3 and `aiohttp <https://docs.aiohttp.org/>`_, e.g. installed
+with ``pip install laterpay-client[async]``.
+"""
+import asyncio
+import copy
+import logging
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:  # pragma: no cover
+    HAS_AIOHTTP = False
+
+from laterpay import LaterPayClient, _get_unavailable_access_data, compat, signing
+from laterpay.coalescing import _get_batch_result
+from laterpay.retry import CircuitOpenError
+
+_logger = logging.getLogger(__name__)
+
+
+class AsyncSingleFlight(object):
+    """
+    Deduplicate concurrent coroutine calls with the same key.
+
+    The asyncio counterpart of ``laterpay.coalescing.SingleFlight``. The
+    shared call runs in its own task, so cancelling one waiting caller does
+    not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        """
+        Return ``await func(*args, **kwargs)``, shared by calls with ``key``.
+
+        If a call for ``key`` is already in flight, its result is returned
+        instead of calling ``func`` again. Every caller, including the one
+        starting the call, gets its own deep copy of the result, which is kept
+        pristine in the shared task.
+        """
+        task = self._tasks.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+
+class _AsyncBatch(object):
+
+    def __init__(self, loop):
+        self.article_ids = set()
+        self.future = loop.create_future()
+        self.handle = None
+
+
+class AsyncAccessBatcher(object):
+    """
+    Combine the /access lookups of concurrent coroutines into fewer requests.
+
+    The asyncio counterpart of ``laterpay.coalescing.AccessBatcher``, taking
+    the same arguments with an ``AsyncLaterPayClient``.
+    """
+
+    def __init__(self, client, window=0.005, max_batch_size=50):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1, not %r' % max_batch_size)
+        self.client = client
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._batches = {}
+
+    async def get_access_data(self, article_ids, lptoken=None, muid=None):
+        """
+        Return the /access data of ``article_ids`` for the given user.
+        """
+        article_ids = self.client._get_article_ids(article_ids)
+        identity = self.client._get_access_identity(lptoken, muid)
+
+        batch = self._batches.get(identity)
+        if batch is None:
+            loop = asyncio.get_event_loop()
+            batch = self._batches[identity] = _AsyncBatch(loop)
+            batch.handle = loop.call_later(self.window, self._send, identity, batch)
+        batch.article_ids.update(compat.stringify(article_id) for article_id in article_ids)
+        if len(batch.article_ids) >= self.max_batch_size:
+            batch.handle.cancel()
+            self._send(identity, batch)
+
+        data = await asyncio.shield(batch.future)
+        return _get_batch_result(data, article_ids)
+
+    def _send(self, identity, batch):
+        if self._batches.get(identity) is batch:
+            del self._batches[identity]
+        identity_param, identity_value = identity
+        task = asyncio.ensure_future(self.client.get_access_data(
+            sorted(batch.article_ids),
+            **{identity_param: identity_value}
+        ))
+        task.add_done_callback(lambda done: self._resolve(batch, done))
+
+    def _resolve(self, batch, task):
+        if task.cancelled():
+            batch.future.cancel()
+        elif task.exception() is not None:
+            batch.future.set_exception(task.exception())
+        else:
+            batch.future.set_result(task.result())
+
+
+class AsyncLaterPayClient(LaterPayClient):
+    """
+    A ``LaterPayClient`` calling the LaterPay API without blocking the loop.
+
+    URLs and /access params are created exactly like with
+    ``LaterPayClient``, while ``get_access_data`` is a coroutine.
+
+    Takes the same arguments as ``LaterPayClient`` plus:
+
+    :param max_concurrency: maximum number of concurrent API requests. Further
+        requests wait for a free slot. Unlimited by default, apart from the
+        ``pool_size`` connections to the API.
+
+    With ``single_flight=True``, identical concurrent /access requests of
+    all coroutines share a single API request.
+
+    The ``connection_handler`` defaults to an ``aiohttp.ClientSession`` with
+    a connection pool of ``pool_size`` connections, created on first use.
+    Close it with :meth:`close` or use the client as an asynchronous context
+    manager.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if not HAS_AIOHTTP:  # pragma: no cover
+            raise ImportError('AsyncLaterPayClient requires aiohttp to be installed')
+        self.max_concurrency = kwargs.pop('max_concurrency', None)
+        super(AsyncLaterPayClient, self).__init__(*args, **kwargs)
+        self._semaphore = None
+        self._refresh_tasks = set()
+
+    def __enter__(self):
+        """
+        Refuse to be used with ``with``, as closing the client is a coroutine.
+        """
+        raise TypeError('Use "async with" with an AsyncLaterPayClient')
+
+    async def __aenter__(self):
+        """
+        Return the client, to be closed on exit.
+        """
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """
+        Close the client.
+        """
+        await self.close()
+
+    @property
+    def connection_handler(self):
+        if self._connection_handler is not None:
+            return self._connection_handler
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    @connection_handler.setter
+    def connection_handler(self, value):
+        self._connection_handler = value
+
+    def _create_single_flight(self):
+        return AsyncSingleFlight()
+
+    def _create_session(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, force_close=not self.keep_alive)
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout_seconds),
+        )
+
+    async def close(self):
+        """
+        Close the connections of the default session.
+
+        A custom ``connection_handler`` is left alone. Pending background
+        refreshes of the ``access_cache`` are finished first.
+        """
+        if self._refresh_tasks:
+            await asyncio.gather(*self._refresh_tasks, return_exceptions=True)
+        session, self._session = self._session, None
+        if session is not None:
+            await session.close()
+
+    def _get_semaphore(self):
+        # Created lazily to bind it to the running loop.
+        if self._semaphore is None and self.max_concurrency is not None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def get_access_data(self, article_ids, lptoken=None, muid=None):
+        """
+        Perform a request to /access API and return obtained data.
+
+        This coroutine uses the ``connection_handler`` to fetch the data and
+        raises ``aiohttp.ClientResponseError`` for error responses.
+
+        With an ``access_cache``, only the articles missing from the cache
+        are requested from the API. Stale entries within the cache's
+        ``stale_ttl`` are returned right away and refreshed in a background
+        task. While the ``circuit_breaker`` is open, the cached entries are
+        returned as by ``LaterPayClient.get_access_data``.
+
+        :param article_ids: Iterable of article ids or a single article id as a
+                            string
+        :param lptoken: optional lptoken as `str`
+        :param str muid: merchant defined user ID. Optional.
+        """
+        if self.access_cache is None:
+            return await self._fetch_access_data(article_ids, lptoken=lptoken, muid=muid)
+
+        keys, cached, missing, stale = self._get_cached_access_data(article_ids, lptoken=lptoken, muid=muid)
+        data = None
+        if missing:
+            try:
+                data = await self._fetch_access_data(missing, lptoken=lptoken, muid=muid)
+            except CircuitOpenError:
+                if not cached:
+                    raise
+                data = _get_unavailable_access_data(missing)
+        if stale:
+            self._refresh_stale_access_data(stale, lptoken=lptoken, muid=muid)
+        return self._update_access_cache(data, keys, cached)
+
+    def _schedule_refresh(self, keys, lptoken=None, muid=None):
+        task = asyncio.ensure_future(self._refresh_access_cache(keys, lptoken=lptoken, muid=muid))
+        # Keep a reference, the loop only holds weak ones.
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    async def _refresh_access_cache(self, keys, lptoken=None, muid=None):
+        try:
+            data = await self._fetch_access_data(list(keys.values()), lptoken=lptoken, muid=muid)
+            self._update_access_cache(data, keys, {})
+        except Exception:
+            _logger.exception('Refreshing stale access data failed')
+        finally:
+            self._refresh_done(keys)
+
+    async def _fetch_access_data(self, article_ids, lptoken=None, muid=None):
+        if self._single_flight is None:
+            return await self._request_access_data(article_ids, lptoken=lptoken, muid=muid)
+        key = self._get_access_key(article_ids, lptoken=lptoken, muid=muid)
+        return await self._single_flight.do(key, self._request_access_data, article_ids, lptoken=lptoken, muid=muid)
+
+    async def _request_access_data(self, article_ids, lptoken=None, muid=None):
+        chunks = self._get_article_id_chunks(article_ids, lptoken=lptoken, muid=muid)
+        if len(chunks) == 1:
+            return await self._send_access_request(chunks[0], lptoken=lptoken, muid=muid)
+        responses = await asyncio.gather(*[
+            self._send_access_request(chunk, lptoken=lptoken, muid=muid) for chunk in chunks
+        ])
+        return self._merge_access_data(responses)
+
+    async def _send_access_request(self, article_ids, lptoken=None, muid=None):
+        if self.retry_policy is not None:
+            self.retry_policy.record_request()
+        retry = 0
+        while True:
+            self._check_circuit()
+            try:
+                data = await self._get_access_response(article_ids, lptoken=lptoken, muid=muid)
+            except Exception as exc:
+                delay = self._get_retry_delay(exc, retry)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                retry += 1
+            else:
+                self._record_outcome(True)
+                return data
+
+    def _is_transient_error(self, exc):
+        if isinstance(exc, aiohttp.ClientResponseError):
+            return exc.status in self._retry_on_status
+        return isinstance(exc, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+    async def _get_access_response(self, article_ids, lptoken=None, muid=None):
+        params = self.get_access_params(article_ids=article_ids, lptoken=lptoken, muid=muid)
+        semaphore = self._get_semaphore()
+        if semaphore is None:
+            return await self._get(params)
+        async with semaphore:
+            return await self._get(params)
+
+    async def _get(self, params):
+        # aiohttp needs a flat sequence of string pairs for repeated keys.
+        query = [
+            (key, value)
+            for key, values in signing.normalise_param_structure(params).items()
+            for value in values
+        ]
+        async with self.connection_handler.get(
+            self.get_access_url(),
+            params=query,
+            headers=self.get_request_headers(),
+            timeout=aiohttp.ClientTimeout(total=self.timeout_seconds),
+        ) as response:
+            response.raise_for_status()
+            return await response.json()
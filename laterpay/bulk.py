@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Sign URLs for large item catalogs, e.g. permalinks for newsletters and feeds.
+
+Items are streamed from JSONL or CSV files, signed in chunks by a pool of
+worker processes and written out in input order, one URL per line::
+
+    $ export LATERPAY_SHARED_SECRET=...
+    $ python -m laterpay.bulk --cp-key my-cp-key items.jsonl > urls.txt
+
+Each input row holds the keyword arguments of a ``laterpay.ItemDefinition``,
+e.g. ``{"item_id": "a1", "pricing": "EUR199", "url": "...", "title": "..."}``.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+
+from laterpay import ItemDefinition, LaterPayClient
+
+FORMATS = ('jsonl', 'csv')
+PAGES = ('buy', 'add', 'subscribe')
+
+_worker = {}
+
+
+def read_items(fileobj, format='jsonl'):
+    """
+    Yield ``ItemDefinition`` keyword arguments read from ``fileobj``.
+
+    :param fileobj: text file object to read from
+    :param str format: "jsonl" (one JSON object per line) or "csv" (with a
+        header row). Empty CSV fields are omitted and "period" is converted
+        to ``int``.
+    """
+    if format == 'jsonl':
+        for line in fileobj:
+            if line.strip():
+                yield json.loads(line)
+    elif format == 'csv':
+        for row in csv.DictReader(fileobj):
+            row = {key: value for key, value in row.items() if value != ''}
+            if 'period' in row:
+                row['period'] = int(row['period'])
+            yield row
+    else:
+        raise ValueError('format must be one of %s, not %r' % (FORMATS, format))
+
+
+def _init_worker(cp_key, shared_secret, web_root, page, url_kwargs):
+    client = LaterPayClient(cp_key, shared_secret, web_root=web_root)
+    _worker['get_urls'] = getattr(client, 'get_%s_urls' % page)
+    _worker['url_kwargs'] = url_kwargs
+
+
+def _sign_chunk(rows):
+    items = [ItemDefinition(**row) for row in rows]
+    return _worker['get_urls'](items, **_worker['url_kwargs'])
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def sign_items(cp_key,
+               shared_secret,
+               rows,
+               page='buy',
+               web_root='https://web.laterpay.net',
+               processes=None,
+               chunk_size=500,
+               max_pending_chunks=None,
+               **url_kwargs):
+    """
+    Yield signed URLs for ``rows`` in input order.
+
+    The rows are signed in chunks by a pool of worker processes. At most
+    ``max_pending_chunks`` chunks are read ahead, so memory stays bounded no
+    matter how many rows there are.
+
+    :param cp_key: the merchant's cp key
+    :param shared_secret: the shared secret string
+    :param rows: iterable of ``dict``s of ``ItemDefinition`` keyword arguments
+    :param str page: "buy", "add" or "subscribe"
+    :param str web_root: root of the web URLs
+    :param int processes: number of worker processes, defaults to the number
+        of CPUs. With ``0`` the rows are signed in the current process.
+    :param int chunk_size: number of rows signed per task
+    :param int max_pending_chunks: number of chunks in flight, defaults to
+        twice the number of processes
+    :param url_kwargs: further arguments for ``LaterPayClient.get_buy_url``
+        and friends. ``is_permalink`` defaults to ``True``.
+    """
+    if page not in PAGES:
+        raise ValueError('page must be one of %s, not %r' % (PAGES, page))
+    url_kwargs.setdefault('is_permalink', True)
+    initargs = (cp_key, shared_secret, web_root, page, url_kwargs)
+    chunks = _chunks(rows, chunk_size)
+
+    if processes == 0:
+        _init_worker(*initargs)
+        for chunk in chunks:
+            for url in _sign_chunk(chunk):
+                yield url
+        return
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if max_pending_chunks is None:
+        max_pending_chunks = 2 * processes
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_sign_chunk, (chunk, )))
+            if len(pending) >= max_pending_chunks:
+                for url in pending.popleft().get():
+                    yield url
+        while pending:
+            for url in pending.popleft().get():
+                yield url
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(argv=None):
+    """
+    Run the command line interface.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m laterpay.bulk',
+        description='Sign LaterPay URLs for items read from a JSONL or CSV file.',
+    )
+    parser.add_argument('input', nargs='?', default='-', help='input file, "-" for stdin (default)')
+    parser.add_argument('-o', '--output', default='-', help='output file, "-" for stdout (default)')
+    parser.add_argument('--format', choices=FORMATS, help='input format, guessed from the file name by default')
+    parser.add_argument('--cp-key', required=True)
+    parser.add_argument(
+        '--secret-env', default='LATERPAY_SHARED_SECRET',
+        help='environment variable holding the shared secret (default: %(default)s)',
+    )
+    parser.add_argument('--page', choices=PAGES, default='buy')
+    parser.add_argument('--web-root', default='https://web.laterpay.net')
+    parser.add_argument('--product-key')
+    parser.add_argument('--no-dialog', dest='dialog', action='store_false')
+    parser.add_argument('--expiring', dest='is_permalink', action='store_false',
+                        help='create expiring URLs instead of permalinks')
+    parser.add_argument('--processes', type=int, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    shared_secret = os.environ.get(args.secret_env)
+    if not shared_secret:
+        parser.error('the shared secret must be set in $%s' % args.secret_env)
+
+    input_format = args.format
+    if input_format is None:
+        input_format = 'csv' if args.input.endswith('.csv') else 'jsonl'
+
+    if args.input == '-':
+        infile = sys.stdin
+    else:
+        infile = io.open(args.input, 'r', encoding='utf-8', newline='')
+    if args.output == '-':
+        outfile = sys.stdout
+    else:
+        outfile = io.open(args.output, 'w', encoding='utf-8')
+
+    try:
+        urls = sign_items(
+            args.cp_key,
+            shared_secret,
+            read_items(infile, input_format),
+            page=args.page,
+            web_root=args.web_root,
+            processes=args.processes,
+            chunk_size=args.chunk_size,
+            product_key=args.product_key,
+            dialog=args.dialog,
+            is_permalink=args.is_permalink,
+        )
+        for url in urls:
+            # URLs are ASCII, so this is text for the file on Python 2, too.
+            outfile.write(u'%s\n' % url)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Caches used throughout the LaterPay client.
+
+Besides the internal ``LRUCache``, this module provides caches for the results
+of /access calls, see ``LaterPayClient(access_cache=...)``.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping holding at most ``maxsize`` entries.
+
+    When full, adding an entry evicts the least recently used one.
+
+    :param int maxsize: maximum number of entries
+    """
+
+    def __init__(self, maxsize=128):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1, not %r' % maxsize)
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Return the number of cached keys.
+        """
+        return len(self._data)
+
+    def __contains__(self, key):
+        """
+        Return whether ``key`` is cached, without marking it as used.
+        """
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Return the value for ``key`` and mark it as recently used.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Store ``value`` for ``key``, evicting the oldest entry if needed.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Remove ``key`` and return its value, or ``default``.
+        """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._data.clear()
+
+
+def _grants_access(value):
+    return isinstance(value, dict) and bool(value.get('access'))
+
+
+class AccessCache(object):
+    """
+    Base class for caches of /access results.
+
+    Entries map a ``(cp_key, identity, article_id)`` key to the data the API
+    returned for that article, e.g. ``{'access': True}``. Entries granting
+    access live for ``ttl`` seconds, entries denying it only for
+    ``negative_ttl`` seconds, so a purchase shows up quickly.
+
+    With a ``stale_ttl``, expired entries granting access are kept for that
+    many more seconds. ``LaterPayClient`` then returns them right away while
+    refreshing them in the background (stale-while-revalidate).
+
+    Subclasses implement :meth:`_get_many`, :meth:`_set_many` and
+    :meth:`clear`.
+
+    :param ttl: seconds to keep entries granting access (60 by default).
+    :param negative_ttl: seconds to keep entries denying access (5 by
+        default). ``0`` disables caching them.
+    :param stale_ttl: seconds to serve expired entries granting access while
+        they are refreshed (0 by default, i.e. disabled).
+    """
+
+    def __init__(self, ttl=60, negative_ttl=5, stale_ttl=0):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+
+    def get_ttl(self, value):
+        """
+        Return the number of seconds to cache the article data ``value``.
+        """
+        if _grants_access(value):
+            return self.ttl
+        return self.negative_ttl
+
+    def get_many(self, keys, now=None):
+        """
+        Return a ``dict`` with the unexpired entries for ``keys``.
+        """
+        return self.get_many_with_stale(keys, now=now)[0]
+
+    def get_many_with_stale(self, keys, now=None):
+        r"""
+        Return two ``dict``\ s with the unexpired and stale entries for ``keys``.
+
+        Stale entries have expired less than ``stale_ttl`` seconds ago and
+        grant access.
+        """
+        if now is None:
+            now = time.time()
+        fresh, stale = {}, {}
+        for key, (expires, value) in self._get_many(list(keys), now).items():
+            if expires > now:
+                fresh[key] = value
+            elif _grants_access(value):
+                stale[key] = value
+        return fresh, stale
+
+    def set_many(self, mapping, now=None):
+        """
+        Store all entries of ``mapping``, each with its TTL.
+        """
+        if now is None:
+            now = time.time()
+        entries = []
+        for key, value in mapping.items():
+            ttl = self.get_ttl(value)
+            if ttl > 0:
+                entries.append((key, value, now + ttl))
+        if entries:
+            self._set_many(entries, now)
+
+    def _get_many(self, keys, now):
+        """
+        Return a ``dict`` mapping ``keys`` to ``(expires, value)`` tuples.
+
+        Only entries which expired less than ``stale_ttl`` seconds ago are
+        included.
+        """
+        raise NotImplementedError
+
+    def _set_many(self, entries, now):
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        raise NotImplementedError
+
+
+class InMemoryAccessCache(AccessCache):
+    """
+    An ``AccessCache`` local to the process.
+
+    It holds up to ``maxsize`` entries. When full, the least recently used
+    entries are evicted first.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, negative_ttl=5, stale_ttl=0):
+        super(InMemoryAccessCache, self).__init__(ttl=ttl, negative_ttl=negative_ttl, stale_ttl=stale_ttl)
+        self._cache = LRUCache(maxsize=maxsize)
+
+    def __len__(self):
+        """
+        Return the number of cached entries, including expired ones.
+        """
+        return len(self._cache)
+
+    def _get_many(self, keys, now):
+        found = {}
+        for key in keys:
+            entry = self._cache.get(key)
+            if entry is None:
+                continue
+            if entry[0] + self.stale_ttl > now:
+                found[key] = entry
+            else:
+                self._cache.pop(key)
+        return found
+
+    def _set_many(self, entries, now):
+        for key, value, expires in entries:
+            self._cache.set(key, (expires, value))
+
+    def clear(self):
+        self._cache.clear()
+
+
+class SQLiteAccessCache(AccessCache):
+    """
+    An ``AccessCache`` stored in a local SQLite database.
+
+    All processes opening the same ``path``, e.g. the workers of a web
+    server, share the entries. Up to ``maxsize`` entries are kept, evicting
+    the least recently used ones first.
+
+    :param path: the database file. It is created if it does not exist.
+    """
+
+    def __init__(self, path, maxsize=100000, ttl=60, negative_ttl=5, stale_ttl=0):
+        super(SQLiteAccessCache, self).__init__(ttl=ttl, negative_ttl=negative_ttl, stale_ttl=stale_ttl)
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1, not %r' % maxsize)
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS access_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'expires REAL NOT NULL, used REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS access_cache_used ON access_cache (used)')
+
+    def _connect(self):
+        # SQLite connections must neither be shared between threads nor
+        # survive a fork.
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            import sqlite3
+
+            self._local.connection = sqlite3.connect(self.path, timeout=10)
+            self._local.pid = pid
+        return self._local.connection
+
+    def _get_many(self, keys, now):
+        if not keys:
+            return {}
+        encoded = dict((json.dumps(key), key) for key in keys)
+        found = {}
+        with self._connect() as connection:
+            # Stay below SQLite's limit of host parameters per statement.
+            encoded_keys = list(encoded)
+            for start in range(0, len(encoded_keys), 500):
+                chunk = encoded_keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = connection.execute(
+                    'SELECT key, value, expires FROM access_cache WHERE expires > ? AND key IN (%s)' % placeholders,
+                    [now - self.stale_ttl] + chunk,
+                ).fetchall()
+                for encoded_key, value, expires in rows:
+                    found[encoded[encoded_key]] = (expires, json.loads(value))
+                connection.execute(
+                    'UPDATE access_cache SET used = ? WHERE key IN (%s)' % placeholders,
+                    [now] + chunk,
+                )
+        return found
+
+    def _set_many(self, entries, now):
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO access_cache (key, value, expires, used) VALUES (?, ?, ?, ?)',
+                [(json.dumps(key), json.dumps(value), expires, now) for key, value, expires in entries],
+            )
+            connection.execute('DELETE FROM access_cache WHERE expires <= ?', (now - self.stale_ttl,))
+            connection.execute(
+                'DELETE FROM access_cache WHERE key IN ('
+                'SELECT key FROM access_cache ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self.maxsize,),
+            )
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM access_cache')
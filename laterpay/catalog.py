@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+r"""
+A compact, columnar store for large item catalogs.
+
+A ``Catalog`` holds the arguments of many ``laterpay.ItemDefinition``\ s in
+a few flat arrays instead of one Python object per item:
+
+* ``item_id``, ``url`` and ``title`` are kept UTF-8 encoded in one buffer
+  per column, with an array of offsets into it.
+* ``pricing``, ``expiry``, ``sub_id``, ``item_type`` and ``election_id``
+  repeat a lot and are interned: each distinct value is stored once, the
+  rows only hold its index.
+* ``period`` is packed into an array of 64 bit integers.
+
+Catalogs are built from rows streamed from JSONL or CSV files, and can be
+saved to and memory-mapped from a compact binary file::
+
+    catalog = Catalog.load(open('items.jsonl'))
+    catalog.save('items.catalog')
+
+    with Catalog.open('items.catalog') as catalog:
+        url = catalog.get_buy_url(client, 42)
+
+Rows are only turned into params when a URL is created for them, straight
+from the quoted values of the columns. See ``benchmarks/bench_catalog.py``.
+
+Requires Python 3, for 64 bit integer arrays and ``memoryview.cast``.
+"""
+import array
+import collections
+import itertools
+import json
+import mmap
+import struct
+import sys
+
+import six
+from six.moves import intern
+from six.moves.urllib.parse import quote
+
+from laterpay import (
+    InvalidItemDefinition,
+    InvalidItemDefinitions,
+    _get_item_data,
+    _restore_frozen_item_definition,
+    constants,
+    validate_item_columns,
+)
+from laterpay.compat import byteify, stringify
+
+__all__ = ('Catalog', 'CatalogItem')
+
+_MAGIC = b'LPCATLG1'
+_HEADER = struct.Struct('<8sQ')
+_ALIGNMENT = 8
+
+# Packed ``None`` of the integer columns.
+_NONE = -2 ** 63
+
+_TEXT_COLUMNS = ('item_id', 'url', 'title')
+_SYMBOL_COLUMNS = ('pricing', 'expiry', 'sub_id', 'item_type', 'election_id')
+_INTEGER_COLUMNS = ('period',)
+
+# Bit set in the offset ending a ``None`` entry of a string table.
+_NONE_OFFSET = 1 << 63
+_OFFSET_MASK = _NONE_OFFSET - 1
+
+
+def _decode(value):
+    return bytes(value).decode('utf-8')
+
+
+def _to_text(value):
+    """
+    Return ``value`` as stored in a string table, i.e. ``None`` or a string.
+    """
+    return None if value is None else stringify(value)
+
+
+class CatalogItem(collections.namedtuple('CatalogItem', ['data', 'item_type'])):
+    """
+    A row of a ``Catalog``, usable in place of an ``ItemDefinition``.
+    """
+
+    __slots__ = ()
+
+
+class _Strings(object):
+    """
+    An append-only table of strings, stored UTF-8 encoded in one buffer.
+
+    With ``intern`` set, adding a string already in the table returns the
+    index of the existing entry, and strings are kept decoded and quoted
+    once read.
+    Tables created from existing ``offsets`` and ``data`` are read-only.
+
+    ``None`` is stored as an empty entry whose end offset is marked with
+    ``_NONE_OFFSET``.
+    """
+
+    def __init__(self, offsets=None, data=None, intern=False):
+        self.offsets = array.array('Q', [0]) if offsets is None else offsets
+        self.data = bytearray() if data is None else data
+        self._indexes = {} if intern and offsets is None else None
+        self._decoded = {} if intern else None
+        self._quoted = {} if intern else None
+
+    def __len__(self):
+        """
+        Return the number of entries.
+        """
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if self._decoded is not None:
+            value = self._decoded.get(index)
+            if value is None:
+                value = self._decoded[index] = self._get(index)
+            return value
+        return self._get(index)
+
+    def _get(self, index):
+        end = self.offsets[index + 1]
+        if end & _NONE_OFFSET:
+            return None
+        return _decode(self.data[self.offsets[index] & _OFFSET_MASK:end])
+
+    def get_quoted(self, index):
+        """
+        Return the entry at ``index`` quoted for signing, or ``None``.
+        """
+        if self._quoted is not None:
+            value = self._quoted.get(index)
+            if value is None:
+                value = self._quoted[index] = self._get_quoted(index)
+            return value
+        return self._get_quoted(index)
+
+    def _get_quoted(self, index):
+        end = self.offsets[index + 1]
+        if end & _NONE_OFFSET:
+            return None
+        # Quoting the UTF-8 encoded bytes saves decoding them.
+        return quote(bytes(self.data[self.offsets[index] & _OFFSET_MASK:end]), safe='')
+
+    def add(self, value):
+        if self._indexes is not None:
+            index = self._indexes.get(value)
+            if index is not None:
+                return index
+            index = self._indexes[value] = len(self)
+        else:
+            index = len(self)
+        if value is None:
+            self.offsets.append(len(self.data) | _NONE_OFFSET)
+        else:
+            self.data.extend(byteify(value))
+            self.offsets.append(len(self.data))
+        return index
+
+
+class Catalog(object):
+    """
+    A columnar store of item definitions.
+
+    Rows are appended with the arguments of ``laterpay.ItemDefinition``,
+    which are validated the same way. Catalogs memory-mapped with
+    :meth:`open` are read-only.
+    """
+
+    def __init__(self):
+        self._texts = dict((name, _Strings()) for name in _TEXT_COLUMNS)
+        self._symbols = dict((name, _Strings(intern=True)) for name in _SYMBOL_COLUMNS)
+        # Symbol indexes are stored plus one, 0 stands for ``None``.
+        self._symbol_indexes = dict((name, array.array('I')) for name in _SYMBOL_COLUMNS)
+        self._integers = dict((name, array.array('q')) for name in _INTEGER_COLUMNS)
+        self._length = 0
+        self._mapped = None
+        self._views = []
+
+    @classmethod
+    def from_rows(cls, rows):
+        r"""
+        Create a catalog from ``dict``\ s of ``ItemDefinition`` arguments.
+
+        Raises ``laterpay.InvalidItemDefinitions`` listing all invalid rows.
+        """
+        catalog = cls()
+        catalog.extend(rows)
+        return catalog
+
+    @classmethod
+    def load(cls, fileobj, format='jsonl'):
+        """
+        Create a catalog from rows streamed from a JSONL or CSV file.
+
+        See ``laterpay.bulk.read_items`` for the file formats.
+        """
+        from laterpay.bulk import read_items
+
+        return cls.from_rows(read_items(fileobj, format))
+
+    def __len__(self):
+        """
+        Return the number of rows.
+        """
+        return self._length
+
+    def __enter__(self):
+        """
+        Return the catalog, to be closed on exit.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Close the catalog.
+        """
+        self.close()
+
+    @property
+    def read_only(self):
+        """
+        Whether rows can be appended to the catalog.
+        """
+        return self._mapped is not None
+
+    def append(self, item_id, pricing, url, title, expiry=None, sub_id=None,
+               period=None, item_type=None, election_id=None):
+        """
+        Validate and append an item, taking ``ItemDefinition`` arguments.
+
+        Return the index of the new row.
+        """
+        if self.read_only:
+            raise TypeError('Memory-mapped catalogs are read-only')
+        data, item_type = _get_item_data(
+            item_id, pricing, url, title, expiry=expiry, sub_id=sub_id,
+            period=period, item_type=item_type, election_id=election_id,
+        )
+        row = {
+            'item_id': _to_text(item_id),
+            'pricing': pricing,
+            'url': _to_text(url),
+            'title': _to_text(title),
+            'sub_id': data.get('sub_id'),
+            'item_type': item_type,
+            'election_id': _to_text(data.get('election_id')),
+            'expiry': expiry,
+            'period': data.get('period', _NONE),
+        }
+        for name in _INTEGER_COLUMNS:
+            if data.get(name) is not None and not _NONE < row[name] < 2 ** 63:
+                raise InvalidItemDefinition('%s is out of range: %s' % (name, data[name]))
+        # Nothing fails from here on, so the columns stay aligned.
+        for name in _TEXT_COLUMNS:
+            self._texts[name].add(row[name])
+        for name in _SYMBOL_COLUMNS:
+            value = row[name]
+            self._symbol_indexes[name].append(
+                0 if value is None else self._symbols[name].add(value) + 1
+            )
+        for name in _INTEGER_COLUMNS:
+            self._integers[name].append(row[name])
+        self._length += 1
+        return self._length - 1
+
+    def extend(self, rows, chunk_size=1000):
+        r"""
+        Append many items, given as ``dict``\ s of ``ItemDefinition`` arguments.
+
+        The rows are validated in chunks of ``chunk_size`` with
+        ``laterpay.validate_item_columns``. All valid rows are appended, then
+        ``laterpay.InvalidItemDefinitions`` is raised if any were invalid,
+        e.g. lacking arguments, listing them by their position in ``rows``.
+        """
+        if self.read_only:
+            raise TypeError('Memory-mapped catalogs are read-only')
+        errors = {}
+        start = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            try:
+                validate_item_columns(**dict(
+                    (name, [row.get(name) for row in chunk])
+                    for name in ('pricing', 'expiry', 'sub_id', 'period')
+                ))
+            except InvalidItemDefinitions as e:
+                chunk_errors = e.errors
+            else:
+                chunk_errors = {}
+            for index, row in enumerate(chunk):
+                if index in chunk_errors:
+                    errors[start + index] = chunk_errors[index]
+                    continue
+                try:
+                    self.append(**row)
+                except (InvalidItemDefinition, TypeError) as e:
+                    # e.g. missing or unexpected arguments
+                    errors[start + index] = [str(e)]
+            start += len(chunk)
+        if errors:
+            raise InvalidItemDefinitions(errors)
+
+    def _get_symbol(self, name, index):
+        symbol_index = self._symbol_indexes[name][index]
+        if symbol_index:
+            return self._symbols[name][symbol_index - 1]
+        return None
+
+    def _get_index(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('catalog index out of range')
+        return index
+
+    def get_item(self, index):
+        """
+        Return the row at ``index`` as a ``CatalogItem``.
+
+        Its ``data`` and ``item_type`` are those of the ``ItemDefinition``
+        created with the same arguments, so it can be passed to
+        ``LaterPayClient.get_buy_url`` and friends.
+        """
+        index = self._get_index(index)
+        item_type = self._get_symbol('item_type', index)
+        data = {
+            'pricing': self._get_symbol('pricing', index),
+            'url': self._texts['url'][index],
+            'title': self._texts['title'][index],
+            'expiry': self._get_symbol('expiry', index),
+        }
+        if item_type is None:
+            data['article_id'] = self._texts['item_id'][index]
+        else:
+            data['campaign_id'] = self._texts['item_id'][index]
+            if item_type == constants.ITEM_TYPE_POLITICAL_CONTRIBUTION:
+                data['election_id'] = self._get_symbol('election_id', index)
+        sub_id = self._get_symbol('sub_id', index)
+        if sub_id is not None:
+            data['sub_id'] = sub_id
+            data['period'] = self._integers['period'][index]
+        return CatalogItem(data, item_type)
+
+    __getitem__ = get_item
+
+    def iter_items(self, indexes=None):
+        r"""
+        Yield the ``CatalogItem``\ s at ``indexes``, all rows by default.
+        """
+        if indexes is None:
+            indexes = six.moves.range(self._length)
+        for index in indexes:
+            yield self.get_item(index)
+
+    def _get_quoted_symbol(self, name, index):
+        symbol_index = self._symbol_indexes[name][index]
+        if symbol_index:
+            return self._symbols[name].get_quoted(symbol_index - 1)
+        return None
+
+    def _get_frozen_item(self, index):
+        """
+        Return the row at ``index`` as a ``FrozenItemDefinition``.
+
+        The params are quoted straight from the columns, in the sorted order
+        of their keys, without building a ``dict`` of them first.
+        """
+        index = self._get_index(index)
+        item_type = self._get_symbol('item_type', index)
+        sub_id = self._get_quoted_symbol('sub_id', index)
+        pairs = (
+            ('article_id' if item_type is None else 'campaign_id',
+             self._texts['item_id'].get_quoted(index)),
+            ('election_id',
+             self._get_quoted_symbol('election_id', index)
+             if item_type == constants.ITEM_TYPE_POLITICAL_CONTRIBUTION else None),
+            ('expiry', self._get_quoted_symbol('expiry', index)),
+            ('period', None if sub_id is None else str(self._integers['period'][index])),
+            ('pricing', self._get_quoted_symbol('pricing', index)),
+            ('sub_id', sub_id),
+            ('title', self._texts['title'].get_quoted(index)),
+            ('url', self._texts['url'].get_quoted(index)),
+        )
+        quoted = []
+        for key, value in pairs:
+            if value is not None:
+                quoted.append(intern(key))
+                quoted.append(value)
+        return _restore_frozen_item_definition(tuple(quoted), item_type)
+
+    def _iter_frozen_items(self, indexes=None):
+        if indexes is None:
+            indexes = six.moves.range(self._length)
+        for index in indexes:
+            yield self._get_frozen_item(index)
+
+    def get_buy_url(self, client, index, *args, **kwargs):
+        """
+        Return ``client.get_buy_url`` for the row at ``index``.
+        """
+        return client.get_buy_url(self._get_frozen_item(index), *args, **kwargs)
+
+    def get_add_url(self, client, index, *args, **kwargs):
+        """
+        Return ``client.get_add_url`` for the row at ``index``.
+        """
+        return client.get_add_url(self._get_frozen_item(index), *args, **kwargs)
+
+    def get_subscribe_url(self, client, index, *args, **kwargs):
+        """
+        Return ``client.get_subscribe_url`` for the row at ``index``.
+        """
+        return client.get_subscribe_url(self._get_frozen_item(index), *args, **kwargs)
+
+    def get_buy_urls(self, client, indexes=None, *args, **kwargs):
+        """
+        Return ``client.get_buy_urls`` for the rows at ``indexes``.
+
+        Defaults to all rows.
+        """
+        return client.get_buy_urls(self._iter_frozen_items(indexes), *args, **kwargs)
+
+    def get_add_urls(self, client, indexes=None, *args, **kwargs):
+        """
+        Return ``client.get_add_urls`` for the rows at ``indexes``.
+
+        Defaults to all rows.
+        """
+        return client.get_add_urls(self._iter_frozen_items(indexes), *args, **kwargs)
+
+    def get_subscribe_urls(self, client, indexes=None, *args, **kwargs):
+        """
+        Return ``client.get_subscribe_urls`` for the rows at ``indexes``.
+
+        Defaults to all rows.
+        """
+        return client.get_subscribe_urls(self._iter_frozen_items(indexes), *args, **kwargs)
+
+    def _iter_sections(self):
+        """
+        Yield the name and the buffer of every section of the binary file.
+        """
+        for name in _TEXT_COLUMNS:
+            yield name + '.offsets', self._texts[name].offsets
+            yield name + '.data', self._texts[name].data
+        for name in _SYMBOL_COLUMNS:
+            yield name, self._symbol_indexes[name]
+            yield name + '.offsets', self._symbols[name].offsets
+            yield name + '.data', self._symbols[name].data
+        for name in _INTEGER_COLUMNS:
+            yield name, self._integers[name]
+
+    def save(self, path):
+        """
+        Write the catalog to a binary file at ``path``.
+
+        The file holds every column as it is in memory, aligned to 8 bytes,
+        followed by a JSON header locating them. It is read back with
+        :meth:`open`.
+        """
+        sections = {}
+        with open(path, 'wb') as fileobj:
+            fileobj.write(_HEADER.pack(_MAGIC, 0))
+            for name, section in self._iter_sections():
+                buffer = memoryview(section)
+                sections[name] = [fileobj.tell(), buffer.format, len(buffer)]
+                fileobj.write(buffer)
+                fileobj.write(b'\0' * (-fileobj.tell() % _ALIGNMENT))
+            header_offset = fileobj.tell()
+            fileobj.write(json.dumps({
+                'rows': self._length,
+                'byteorder': sys.byteorder,
+                'itemsizes': dict(
+                    (typecode, array.array(typecode).itemsize) for typecode in 'BIQq'
+                ),
+                'sections': sections,
+            }, sort_keys=True).encode('utf-8'))
+            fileobj.seek(0)
+            fileobj.write(_HEADER.pack(_MAGIC, header_offset))
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory-map a catalog written by :meth:`save`.
+
+        Rows are read from the file as they are needed, so opening even a
+        large catalog is cheap. The catalog is read-only and should be
+        closed after use.
+        """
+        with open(path, 'rb') as fileobj:
+            mapped = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls._from_buffer(mapped)
+        except Exception:
+            mapped.close()
+            raise
+
+    @classmethod
+    def _from_buffer(cls, mapped):
+        magic, header_offset = _HEADER.unpack_from(mapped)
+        if magic != _MAGIC:
+            raise ValueError('Not a catalog file')
+        catalog = cls()
+        catalog._mapped = mapped
+        try:
+            catalog._load_sections(header_offset)
+        except Exception:
+            catalog.close()
+            raise
+        return catalog
+
+    def _load_sections(self, header_offset):
+        view = memoryview(self._mapped)
+        self._views.append(view)
+        header = json.loads(_decode(view[header_offset:]))
+        if header['byteorder'] != sys.byteorder or any(
+            array.array(typecode).itemsize != itemsize
+            for typecode, itemsize in six.iteritems(header['itemsizes'])
+        ):
+            raise ValueError('Catalog file was written on an incompatible platform')
+
+        def load(name):
+            offset, typecode, length = header['sections'][name]
+            section = view[offset:offset + length * header['itemsizes'][typecode]]
+            if typecode != 'B':
+                section = section.cast(typecode)
+            self._views.append(section)
+            return section
+
+        for name in _TEXT_COLUMNS:
+            self._texts[name] = _Strings(load(name + '.offsets'), load(name + '.data'))
+        for name in _SYMBOL_COLUMNS:
+            self._symbol_indexes[name] = load(name)
+            self._symbols[name] = _Strings(
+                load(name + '.offsets'), load(name + '.data'), intern=True,
+            )
+        for name in _INTEGER_COLUMNS:
+            self._integers[name] = load(name)
+        self._length = header['rows']
+
+    def close(self):
+        """
+        Release the file of a memory-mapped catalog.
+
+        The catalog must not be used afterwards.
+        """
+        if self._mapped is None:
+            return
+        self._texts = self._symbols = self._symbol_indexes = self._integers = {}
+        while self._views:
+            self._views.pop().release()
+        self._mapped.close()
+        self._mapped = None
+        self._length = 0
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to send fewer identical requests to the LaterPay API.
+"""
+import copy
+import sys
+import threading
+
+import six
+
+from . import compat
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Deduplicate concurrent calls with the same key.
+
+    While a call for a key is in flight, other threads calling :meth:`do`
+    with the same key wait for it and share its result or exception instead
+    of calling the function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Return ``func(*args, **kwargs)``, shared by calls with ``key``.
+
+        If a call for ``key`` is already in flight, its result is returned
+        instead of calling ``func`` again. Waiting callers get deep copies of
+        a pristine copy of the result, taken before they are woken up. So
+        every caller, the one calling ``func`` included, can modify its result
+        without affecting the others.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.exc_info is not None:
+                six.reraise(*call.exc_info)
+            return copy.deepcopy(call.result)
+
+        try:
+            result = func(*args, **kwargs)
+            call.result = copy.deepcopy(result)
+            return result
+        except BaseException:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+def _get_batch_result(data, article_ids):
+    """
+    Return the part of the /access response ``data`` about ``article_ids``.
+    """
+    if data.get('status') != 'ok':
+        return copy.deepcopy(data)
+    article_ids = [compat.stringify(article_id) for article_id in article_ids]
+    result = dict(
+        (key, copy.deepcopy(value)) for key, value in data.items() if key not in ('articles', 'unavailable')
+    )
+    articles = data.get('articles') or {}
+    result['articles'] = dict(
+        (article_id, copy.deepcopy(articles[article_id])) for article_id in article_ids if article_id in articles
+    )
+    if 'unavailable' in data:
+        unavailable = set(data['unavailable'])
+        result['unavailable'] = [article_id for article_id in article_ids if article_id in unavailable]
+    return result
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.article_ids = set()
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.data = None
+        self.exc_info = None
+
+
+class AccessBatcher(object):
+    """
+    Combine the /access lookups of concurrent callers into fewer requests.
+
+    Lookups for the same user arriving within ``window`` seconds of each
+    other are sent to the API as a single signed request via
+    ``client.get_access_data``. The batch is sent earlier as soon as it holds
+    ``max_batch_size`` article ids. Each caller gets the part of the
+    response about its own articles.
+
+    The first caller of a batch waits for the window to pass and sends the
+    request, so no background thread is needed. Callers which are alone in
+    their window are delayed by up to ``window`` seconds.
+
+    :param client: the ``LaterPayClient`` to send the requests with.
+    :param window: seconds to wait for further lookups (0.005 by default).
+    :param max_batch_size: maximum number of article ids per batch (50 by
+        default).
+    """
+
+    def __init__(self, client, window=0.005, max_batch_size=50):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1, not %r' % max_batch_size)
+        self.client = client
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._batches = {}
+
+    def get_access_data(self, article_ids, lptoken=None, muid=None):
+        """
+        Return the /access data of ``article_ids`` for the given user.
+
+        Takes the same arguments as ``LaterPayClient.get_access_data`` and
+        returns a response of the same form.
+        """
+        article_ids = self.client._get_article_ids(article_ids)
+        identity = self.client._get_access_identity(lptoken, muid)
+
+        with self._lock:
+            batch = self._batches.get(identity)
+            leader = batch is None
+            if leader:
+                batch = self._batches[identity] = _Batch()
+            batch.article_ids.update(compat.stringify(article_id) for article_id in article_ids)
+            if len(batch.article_ids) >= self.max_batch_size:
+                # Later lookups go to a new batch.
+                del self._batches[identity]
+                batch.full.set()
+
+        if leader:
+            self._send(identity, batch)
+        else:
+            batch.done.wait()
+
+        if batch.exc_info is not None:
+            six.reraise(*batch.exc_info)
+        return _get_batch_result(batch.data, article_ids)
+
+    def _send(self, identity, batch):
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._batches.get(identity) is batch:
+                del self._batches[identity]
+        identity_param, identity_value = identity
+        try:
+            batch.data = self.client.get_access_data(
+                sorted(batch.article_ids),
+                **{identity_param: identity_value}
+            )
+        except BaseException:
+            batch.exc_info = sys.exc_info()
+        finally:
+            batch.done.set()
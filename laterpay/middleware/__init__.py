@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Middleware verifying incoming LaterPay-signed requests.
+
+``WSGIMiddleware`` works on all supported Python versions, ``ASGIMiddleware``
+requires Python 3.
+"""
+import six
+
+from .verifier import InvalidRequest, ReplayCache, RequestVerifier
+from .wsgi import WSGIMiddleware
+
+if six.PY3:
+    from .asgi import ASGIMiddleware
+
+__all__ = [
+    'ASGIMiddleware',
+    'InvalidRequest',
+    'ReplayCache',
+    'RequestVerifier',
+    'WSGIMiddleware',
+]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from .verifier import InvalidRequest
+
+
+class ASGIMiddleware(object):
+    """
+    ASGI middleware rejecting requests that fail LaterPay verification.
+
+    Rejected requests get a "403 Forbidden" response. Verified requests are
+    passed on to ``app`` with ``scope['laterpay.verified']`` set to ``True``.
+
+    See ``WSGIMiddleware`` for a description of the arguments.
+    """
+
+    def __init__(self, app, verifier, paths=None, url_root=None):
+        self.app = app
+        self.verifier = verifier
+        self.paths = frozenset(paths) if paths is not None else None
+        self.url_root = url_root
+
+    def _get_url(self, scope):
+        path = scope.get('root_path', '') + scope['path']
+        if self.url_root is not None:
+            return self.url_root + path
+        host = None
+        for name, value in scope.get('headers', ()):
+            if name == b'host':
+                host = value.decode('latin-1')
+                break
+        if host is None:
+            host, port = scope['server']
+            if (scope['scheme'], port) not in (('http', 80), ('https', 443)):
+                host = '%s:%s' % (host, port)
+        return '%s://%s%s' % (scope['scheme'], host, path)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and (self.paths is None or scope['path'] in self.paths):
+            try:
+                self.verifier.verify(
+                    scope['method'],
+                    self._get_url(scope),
+                    scope.get('query_string', b'').decode('latin-1'),
+                )
+            except InvalidRequest as e:
+                body = str(e).encode('utf-8')
+                await send({
+                    'type': 'http.response.start',
+                    'status': 403,
+                    'headers': [
+                        (b'content-type', b'text/plain; charset=utf-8'),
+                        (b'content-length', str(len(body)).encode('ascii')),
+                    ],
+                })
+                await send({'type': 'http.response.body', 'body': body})
+                return
+            scope = dict(scope, **{'laterpay.verified': True})
+        await self.app(scope, receive, send)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import heapq
+import threading
+import time
+
+from six.moves.urllib.parse import unquote_plus
+
+from laterpay import signing
+
+
+class InvalidRequest(Exception):
+    """
+    Raised when an incoming request fails verification.
+    """
+
+
+class ReplayCache(object):
+    """
+    Remember recently seen signatures to reject replayed requests.
+
+    Each signature is remembered until it expires, i.e. until the request
+    it signs fails the timestamp check. Signatures are kept in sets bucketed
+    by their expiry, and whole buckets are dropped once they have expired,
+    so eviction is cheap and memory is bounded by the request rate. Once
+    ``max_entries`` unexpired signatures are held, new ones are refused
+    instead of forgetting any which could still be replayed.
+
+    :param int max_age: number of seconds a signature is remembered if
+        ``add`` is not given its expiry
+    :param int max_entries: upper bound on the number of remembered signatures
+    :param int bucket_seconds: width of a time bucket in seconds
+    """
+
+    def __init__(self, max_age=300, max_entries=1000000, bucket_seconds=10):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.bucket_seconds = bucket_seconds
+        self._seen = set()
+        self._buckets = {}  # bucket number: [signatures]
+        self._bucket_heap = []  # bucket numbers, the earliest expiring first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Return the number of remembered signatures, including expired ones.
+        """
+        return len(self._seen)
+
+    def _evict(self, now):
+        # Buckets hold the signatures expiring before their end.
+        current = int(now // self.bucket_seconds)
+        heap = self._bucket_heap
+        while heap and heap[0] < current:
+            signatures = self._buckets.pop(heapq.heappop(heap))
+            self._seen.difference_update(signatures)
+
+    def add(self, signature, now=None, expires=None):
+        """
+        Remember ``signature`` until ``expires``.
+
+        Return ``False`` if it was seen before. ``expires`` defaults to
+        ``max_age`` seconds from ``now``. Raises ``InvalidRequest`` if the
+        cache is full.
+        """
+        if now is None:
+            now = time.time()
+        if expires is None:
+            expires = now + self.max_age
+        # Signatures are accepted in either case
+        signature = signature.lower()
+        bucket = int(expires // self.bucket_seconds)
+        with self._lock:
+            self._evict(now)
+            if signature in self._seen:
+                return False
+            if len(self._seen) >= self.max_entries:
+                raise InvalidRequest('Too many recent requests')
+            self._seen.add(signature)
+            signatures = self._buckets.get(bucket)
+            if signatures is None:
+                signatures = self._buckets[bucket] = []
+                heapq.heappush(self._bucket_heap, bucket)
+            signatures.append(signature)
+            return True
+
+
+def _get_query_param(query_string, name):
+    """
+    Return the first non-blank value of ``name`` in a url-encoded ``query_string``.
+
+    Keys are decoded before comparing them, like ``signing.verify_query_string``
+    does.
+    """
+    for field in query_string.split('&'):
+        key, _, value = field.partition('=')
+        if value and unquote_plus(key) == name:
+            return unquote_plus(value)
+    return None
+
+
+class RequestVerifier(object):
+    """
+    Verify the signature, timestamp and uniqueness of LaterPay requests.
+
+    :param secret: shared secret, ``laterpay.signing.Signer`` or
+        ``laterpay.signing.KeyRing`` the requests are signed with
+    :param int max_age: maximum age of the "ts" param in seconds. Requests
+        with a timestamp further in the past or future are rejected.
+    :param replay_cache: ``ReplayCache`` of seen signatures. Pass ``None`` to
+        disable replay protection. Defaults to a new ``ReplayCache``.
+    :param str signature_param: name of the query param with the signature
+    """
+
+    _DEFAULT = object()
+
+    def __init__(self, secret, max_age=300, replay_cache=_DEFAULT, signature_param='hmac'):
+        if replay_cache is self._DEFAULT:
+            replay_cache = ReplayCache(max_age=max_age)
+        self.signer = signing._get_signer(secret)
+        self.max_age = max_age
+        self.replay_cache = replay_cache
+        self.signature_param = signature_param
+
+    def verify(self, method, url, query_string, now=None):
+        """
+        Verify a request, raising ``InvalidRequest`` if it is not valid.
+
+        :param str method: HTTP method of the request
+        :param str url: base url of the request, without query or fragment
+        :param str query_string: the raw, url-encoded query string
+        :param now: current Unix timestamp, defaults to ``time.time()``
+        """
+        if now is None:
+            now = time.time()
+
+        ts = _get_query_param(query_string, 'ts')
+        try:
+            ts = int(ts)
+        except (TypeError, ValueError):
+            raise InvalidRequest('Missing or invalid timestamp')
+        if abs(now - ts) > self.max_age:
+            raise InvalidRequest('Stale timestamp')
+
+        # Remember the very signature that was verified, so that appending
+        # further signature params does not get a replay past the cache.
+        signature = self.signer._get_verified_signature(self.signature_param, query_string, url, method)
+        if signature is None:
+            raise InvalidRequest('Invalid signature')
+
+        if self.replay_cache is not None:
+            # The signature is valid until its timestamp is too old.
+            if not self.replay_cache.add(signature, now, expires=ts + self.max_age):
+                raise InvalidRequest('Replayed request')
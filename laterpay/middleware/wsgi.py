@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from .verifier import InvalidRequest
+
+
+class WSGIMiddleware(object):
+    """
+    WSGI middleware rejecting requests that fail LaterPay verification.
+
+    Rejected requests get a "403 Forbidden" response. Verified requests are
+    passed on to ``app`` with ``environ['laterpay.verified']`` set to
+    ``True``.
+
+    :param app: the WSGI application to wrap
+    :param verifier: a ``RequestVerifier``
+    :param paths: optional collection of paths to verify, e.g. the callback
+        endpoints. All requests are verified if not given.
+    :param str url_root: optional scheme and host the requests were signed
+        for, e.g. "https://example.com". Useful behind proxies. Taken from
+        the request by default.
+    """
+
+    def __init__(self, app, verifier, paths=None, url_root=None):
+        self.app = app
+        self.verifier = verifier
+        self.paths = frozenset(paths) if paths is not None else None
+        self.url_root = url_root
+
+    def _get_url(self, environ):
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        if self.url_root is not None:
+            return self.url_root + path
+        host = environ.get('HTTP_HOST')
+        if not host:
+            host = environ['SERVER_NAME']
+            port = environ.get('SERVER_PORT')
+            if port and (environ['wsgi.url_scheme'], port) not in (('http', '80'), ('https', '443')):
+                host = '%s:%s' % (host, port)
+        return '%s://%s%s' % (environ['wsgi.url_scheme'], host, path)
+
+    def __call__(self, environ, start_response):
+        if self.paths is None or environ.get('PATH_INFO', '') in self.paths:
+            try:
+                self.verifier.verify(
+                    environ['REQUEST_METHOD'],
+                    self._get_url(environ),
+                    environ.get('QUERY_STRING', ''),
+                )
+            except InvalidRequest as e:
+                body = str(e).encode('utf-8')
+                start_response('403 Forbidden', [
+                    ('Content-Type', 'text/plain; charset=utf-8'),
+                    ('Content-Length', str(len(body))),
+                ])
+                return [body]
+            environ['laterpay.verified'] = True
+        return self.app(environ, start_response)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Retry policies and circuit breakers for requests to the LaterPay API.
+
+See ``LaterPayClient(retry_policy=..., circuit_breaker=...)``.
+"""
+import collections
+import random
+import threading
+import time
+
+
+#: HTTP status codes of responses worth retrying.
+TRANSIENT_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while the circuit breaker is open.
+    """
+
+
+class _SlidingCounter(object):
+    """
+    Count events within the last ``window`` seconds.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._events = collections.deque()
+
+    def add(self, now, value=True):
+        self._events.append((now, value))
+        self._expire(now)
+
+    def count(self, now, value=None):
+        self._expire(now)
+        if value is None:
+            return len(self._events)
+        return sum(1 for _, event_value in self._events if event_value == value)
+
+    def clear(self):
+        self._events.clear()
+
+    def _expire(self, now):
+        while self._events and self._events[0][0] <= now - self.window:
+            self._events.popleft()
+
+
+class RetryPolicy(object):
+    """
+    Retry idempotent API requests failing with transient errors.
+
+    Failed requests are retried up to ``max_retries`` times after a random
+    delay between 0 and ``backoff * 2 ** retry`` seconds, capped at
+    ``max_backoff`` ("full jitter"), so clients do not retry in lockstep.
+
+    To not overload a struggling API, retries are limited by a budget: within
+    ``budget_window`` seconds at most ``min_retries`` plus ``budget_ratio``
+    times the number of requests may be retries.
+
+    :param max_retries: maximum number of retries per request (2 by default).
+    :param backoff: base delay in seconds (0.05 by default).
+    :param max_backoff: maximum delay in seconds (1 by default).
+    :param budget_ratio: ratio of retries to requests (0.2 by default).
+    :param min_retries: retries always allowed within the window (10 by
+        default).
+    :param budget_window: seconds to count requests and retries in (10 by
+        default).
+    :param retry_on_status: HTTP status codes to retry, by default
+        ``TRANSIENT_STATUS_CODES``. Connection errors and timeouts are
+        always retried.
+    """
+
+    def __init__(self,
+                 max_retries=2,
+                 backoff=0.05,
+                 max_backoff=1,
+                 budget_ratio=0.2,
+                 min_retries=10,
+                 budget_window=10,
+                 retry_on_status=TRANSIENT_STATUS_CODES):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget_ratio = budget_ratio
+        self.min_retries = min_retries
+        self.retry_on_status = frozenset(retry_on_status)
+        self._requests = _SlidingCounter(budget_window)
+        self._retries = _SlidingCounter(budget_window)
+        self._lock = threading.Lock()
+
+    def get_backoff(self, retry):
+        """
+        Return the seconds to wait before the ``retry``-th retry, from 0.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+    def record_request(self, now=None):
+        """
+        Count a request, adding to the retry budget.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._requests.add(now)
+
+    def acquire_retry(self, retry, now=None):
+        """
+        Return whether the ``retry``-th retry of a request is allowed.
+
+        If so, the retry is taken from the budget.
+        """
+        if retry >= self.max_retries:
+            return False
+        if now is None:
+            now = time.time()
+        with self._lock:
+            allowed = self.min_retries + self.budget_ratio * self._requests.count(now)
+            if self._retries.count(now) >= allowed:
+                return False
+            self._retries.add(now)
+            return True
+
+
+class CircuitBreaker(object):
+    """
+    Stop sending requests to the API while most of them fail.
+
+    The breaker opens once at least ``min_requests`` requests were sent
+    within ``window`` seconds and more than ``failure_threshold`` of them
+    failed. While open, requests fail fast with ``CircuitOpenError``. After
+    ``reset_timeout`` seconds a single trial request is let through: if it
+    succeeds the breaker closes again, otherwise it stays open.
+
+    :param failure_threshold: ratio of failed requests opening the breaker
+        (0.5 by default).
+    :param min_requests: minimum number of requests within the window before
+        the breaker opens (10 by default).
+    :param window: seconds to count requests in (30 by default).
+    :param reset_timeout: seconds to stay open before a trial request (30 by
+        default).
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=0.5, min_requests=10, window=30, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self._outcomes = _SlidingCounter(window)
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        Return the current state: ``CLOSED``, ``OPEN`` or ``HALF_OPEN``.
+        """
+        with self._lock:
+            return self._get_state(time.time())
+
+    @property
+    def is_open(self):
+        """
+        Whether requests currently fail fast.
+        """
+        return self.state != self.CLOSED
+
+    def _get_state(self, now):
+        if self._state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow_request(self, now=None):
+        """
+        Return whether a request may be sent now.
+
+        In the half-open state only the first caller may send its trial
+        request.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            state = self._get_state(now)
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self, now=None):
+        """
+        Record a successful request.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if self._get_state(now) == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+            self._outcomes.add(now, True)
+
+    def record_failure(self, now=None):
+        """
+        Record a failed request, opening the breaker if needed.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            state = self._get_state(now)
+            self._outcomes.add(now, False)
+            if state == self.HALF_OPEN:
+                self._open(now)
+            elif state == self.CLOSED:
+                total = self._outcomes.count(now)
+                failures = self._outcomes.count(now, False)
+                if total >= self.min_requests and failures > self.failure_threshold * total:
+                    self._open(now)
+
+    def _open(self, now):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._trial_in_flight = False
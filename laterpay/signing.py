@@ -1,21 +1,29 @@
 # -*- coding: utf-8 -*-
+import bisect
 import hashlib
 import hmac
+import sys
 import warnings
 
 import six
-from six.moves.urllib.parse import quote, urlparse
-try:
-    from furl.omdict1D import omdict
-    HAS_FURL = True
-except ImportError:  # pragma: no cover
-    HAS_FURL = False
+from six.moves import intern
+from six.moves.urllib.parse import quote, unquote, unquote_plus, urlencode, urlparse
 
 from . import compat
+from .cache import LRUCache
 
 ALLOWED_METHODS = ('GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'HEAD')
 MESSAGE_FORMAT = '{method}&{url}&{params}'
 
+# Applications sign against a handful of base URLs only, so a small bound
+# suffices for the ``(method, url)`` keyed caches.
+_MESSAGE_PREFIX_CACHE_SIZE = 128
+
+_message_prefix_cache = LRUCache(maxsize=_MESSAGE_PREFIX_CACHE_SIZE)
+
+# The characters ``quote(..., safe='')`` never escapes.
+_UNRESERVED_CHARS = ''.join(c for c in map(chr, range(128)) if quote(c, safe='') == c)
+
 
 def time_independent_HMAC_compare(a, b):
     """
@@ -24,13 +32,163 @@ def time_independent_HMAC_compare(a, b):
     This function should probably not be part of the public API, and thus will
     be deprecated in a future release to be replaced with a internal function.
     """
-    if len(a) != len(b):
+    # Hex signatures are accepted in either case, so compare them lowercased.
+    return hmac.compare_digest(compat.byteify(a).lower(), compat.byteify(b).lower())
+
+
+class Signer(object):
+    """
+    Create and verify LaterPay signatures with a single shared secret.
+
+    The HMAC is keyed once when the ``Signer`` is created. Every signature
+    then starts from a copy of that keyed state, which saves re-encoding the
+    secret and re-doing the key padding for each message.
+
+    :param secret: secret string used to create the signatures
+    """
+
+    def __init__(self, secret):
+        self.secret = secret
+        self._hmac = hmac.new(compat.byteify(secret), digestmod=hashlib.sha224)
+        self._message_hmacs = LRUCache(maxsize=_MESSAGE_PREFIX_CACHE_SIZE)
+
+    def create_HMAC(self, *parts):
+        """
+        Return the standard LaterPay HMAC of `*parts`.
+        """
+        authcode = self._hmac.copy()
+        for part in parts:
+            authcode.update(compat.byteify(part))
+        return compat.stringify(authcode.hexdigest())
+
+    def _get_message_hmac(self, method, url):
+        """
+        Return a fresh HMAC already fed with the message prefix for `url`.
+        """
+        key = (method, url)
+        authcode = self._message_hmacs.get(key)
+        if authcode is None:
+            authcode = self._hmac.copy()
+            authcode.update(compat.byteify(_create_message_prefix(method, url)))
+            self._message_hmacs.set(key, authcode)
+        return authcode.copy()
+
+    def sign(self, params, url, method='POST', common_params=None):
+        """
+        Create signature for given `params`, `url` and HTTP `method`.
+
+        See :func:`laterpay.signing.sign` for a description of the arguments.
+        """
+        return self._sign_param_str(_get_param_str(params, common_params), url, method)
+
+    def _sign_quoted_pairs(self, pairs, url, method, common_params=None):
+        """
+        Create signature for sorted, quoted ``(key, value)`` pairs.
+
+        :param common_params: optional :class:`CanonicalParams`
+        """
+        if common_params is None:
+            param_str = _join_quoted_params(pairs)
+        else:
+            param_str = common_params._extend_pairs(pairs)
+        return self._sign_param_str(param_str, url, method)
+
+    def _sign_param_str(self, param_str, url, method):
+        """
+        Return the signature of an already canonicalised param string.
+        """
+        authcode = self._get_message_hmac(method, url)
+        authcode.update(compat.byteify(param_str))
+        return compat.stringify(authcode.hexdigest())
+
+    def verify(self, signature, params, url, method):
+        """
+        Verify the signature of a given `params` dict.
+
+        See :func:`laterpay.signing.verify` for a description of the arguments.
+        """
+        return self._verify_param_str(signature, _get_param_str(params), url, method)
+
+    def verify_query_string(self, signature_param, query_string, url, method):
+        """
+        Verify the signature contained in a raw, url-encoded query string.
+
+        See :func:`laterpay.signing.verify_query_string` for a description of
+        the arguments.
+        """
+        return self._get_verified_signature(signature_param, query_string, url, method) is not None
+
+    def _get_verified_signature(self, signature_param, query_string, url, method):
+        """
+        Return the signature of a raw query string if it is valid, else ``None``.
+
+        This is the signature :meth:`verify_query_string` checks, i.e. the
+        value of the first key decoding to ``signature_param``.
+        """
+        signature, param_str = _parse_signed_query_string(signature_param, query_string)
+        if signature is None or not self._verify_param_str(signature, param_str, url, method):
+            return None
+        return signature
+
+    def _verify_param_str(self, signature, param_str, url, method):
+        """
+        Verify the signature of an already canonicalised param string.
+        """
+        if isinstance(signature, (list, tuple)):
+            signature = signature[0]
+        if not isinstance(signature, (six.binary_type, six.text_type)):
+            signature = compat.stringify(signature)
+
+        mac = self._sign_param_str(param_str, url, method)
+
+        return time_independent_HMAC_compare(signature, mac)
+
+
+class KeyRing(Signer):
+    """
+    Sign with one shared secret and verify with any of several.
+
+    This allows rotating the shared secret: new signatures are created with
+    the first, current secret, while signatures created with any of the
+    others are still accepted. The params are canonicalised only once per
+    verification, and the secret that verified the most recent signature is
+    tried first.
+
+    :param secrets: iterable of secret strings or :class:`Signer` objects,
+                    the current secret first
+    """
+
+    def __init__(self, secrets):
+        self.signers = [_get_signer(secret) for secret in secrets]
+        if not self.signers:
+            raise ValueError('A KeyRing needs at least one secret')
+        primary = self.signers[0]
+        self.secret = primary.secret
+        self._hmac = primary._hmac
+        self._message_hmacs = primary._message_hmacs
+        self._preferred = primary
+
+    def _verify_param_str(self, signature, param_str, url, method):
+        """
+        Verify the signature of an already canonicalised param string.
+        """
+        preferred = self._preferred
+        if preferred._verify_param_str(signature, param_str, url, method):
+            return True
+        for signer in self.signers:
+            if signer is not preferred and signer._verify_param_str(signature, param_str, url, method):
+                self._preferred = signer
+                return True
         return False
-    result = 0
-    a, b = a.lower(), b.lower()
-    for x, y in zip(a, b):
-        result |= ord(x) ^ ord(y)
-    return result == 0
+
+
+def _get_signer(secret):
+    """
+    Return a :class:`Signer` for ``secret``, unless it already is one.
+    """
+    if isinstance(secret, Signer):
+        return secret
+    return Signer(secret)
 
 
 def create_HMAC(HMAC_secret, *parts):
@@ -40,10 +198,7 @@ def create_HMAC(HMAC_secret, *parts):
     This function should probably not be part of the public API, and thus will
     be deprecated in a future release to be replaced with a internal function.
     """
-    authcode = hmac.new(compat.byteify(HMAC_secret), digestmod=hashlib.sha224)
-    for part in parts:
-        authcode.update(compat.byteify(part))
-    return compat.stringify(authcode.hexdigest())
+    return _get_signer(HMAC_secret).create_HMAC(*parts)
 
 
 def sort_params(param_dict):
@@ -80,6 +235,17 @@ def _sort_params(param_dict):
     return sorted(param_list)
 
 
+def _is_omdict(params):
+    """
+    Return whether ``params`` is a ``furl.omdict1D.omdict``.
+
+    Such a multi-dict can only exist once ``orderedmultidict``, which furl
+    builds on, was imported, so furl is not imported for this check.
+    """
+    module = sys.modules.get('orderedmultidict')
+    return module is not None and isinstance(params, module.omdict)
+
+
 def normalise_param_structure(params):
     """
     Canonicalise representation of key-value data with non-unique keys.
@@ -116,7 +282,7 @@ def normalise_param_structure(params):
         iterator = six.iteritems(params)
     elif isinstance(params, (list, tuple)):
         iterator = params
-    elif HAS_FURL and isinstance(params, omdict):
+    elif _is_omdict(params):
         iterator = params.iterallitems()
     else:
         raise TypeError('params needs to be dict, list or tuple. It is a %r' % type(params))
@@ -135,61 +301,412 @@ def normalise_param_structure(params):
     return out
 
 
-def create_base_message(params, url, method='POST'):
+def _quote_flat_params(params):
     """
-    Construct a message to be signed.
+    Return the sorted, quoted ``(key, value)`` pairs of a flat ``dict``.
+
+    This is the fast path of :func:`create_base_message` for the common case
+    of a ``dict`` with native string keys and native string (or ``list`` of
+    native string) values, e.g. the output of
+    :func:`normalise_param_structure`. The keys and values are quoted and
+    collected in a single pass. Returns ``None`` if ``params`` has any other
+    shape, in which case the caller has to take the generic path.
+    """
+    if type(params) is not dict:
+        return None
+
+    pairs = []
+    append = pairs.append
+    for key, value in six.iteritems(params):
+        if type(key) is not str:
+            return None
+        if key == 'hmac' or key == 'gettoken':
+            continue
+        key = quote(key, safe='')
+        if type(value) is str:
+            append((key, quote(value, safe='')))
+        elif type(value) is list:
+            for item in value:
+                if type(item) is not str:
+                    return None
+                append((key, quote(item, safe='')))
+        else:
+            return None
+    pairs.sort()
+    return pairs
 
-    You are unlikely to need to call this directly and should not consider it a
-    stable part of the API. This will be deprecated and replaced with a internal
-    method accordingly, in a future release.
 
-    https://docs.laterpay.net/platform/intro/signing_urls/
+def _quote_params(params):
+    """
+    Return the sorted, quoted ``(key, value)`` pairs to be signed.
+    """
+    if isinstance(params, QuotedParams):
+        return params._get_pairs()
+    pairs = _quote_flat_params(params)
+    if pairs is None:
+        params = normalise_param_structure(params)
+        if 'hmac' in params:
+            params.pop('hmac')
+        if 'gettoken' in params:
+            params.pop('gettoken')
+        params = {
+            # urlquote all keys and values
+            quote(key, safe=''): [quote(value, safe='') for value in values]
+            for key, values
+            in six.iteritems(params)
+        }
+        pairs = _sort_params(params)
+    return pairs
+
+
+def _quote_query_params(params):
+    """
+    Return the quoted ``(key, value)`` pairs of `params` in query order.
+
+    `params` is a ``dict`` of native string keys and native string (or
+    ``list`` of native string) values, e.g. the output of
+    :func:`normalise_param_structure`.
+
+    Every key and value is quoted only once: the pairs give the url-encoded
+    query string (see :func:`_join_query_pairs`) as well as, filtered and
+    sorted (see :func:`_get_signed_pairs`), the params to be signed.
+    """
+    pairs = []
+    append = pairs.append
+    for key, values in six.iteritems(params):
+        key = quote(key, safe='')
+        if isinstance(values, list):
+            for value in values:
+                append((key, quote(value, safe='')))
+        else:
+            append((key, quote(values, safe='')))
+    return pairs
+
+
+def _quote_token(token):
+    """
+    Return ``quote(token, safe='')``, skipping the call if nothing needs escaping.
+    """
+    if not token.rstrip(_UNRESERVED_CHARS):
+        return token
+    return quote(token, safe='')
+
+
+def _join_query_pairs(pairs):
+    """
+    Join quoted ``(key, value)`` pairs into the url-encoded query string.
+
+    The result is the same as that of ``urlencode``, since ``quote_plus``
+    only differs from ``quote(..., safe='')`` in encoding spaces as "+".
+    Quoted pairs contain no other "%20" than escaped spaces.
+    """
+    return '&'.join(['%s=%s' % pair for pair in pairs]).replace('%20', '+')
+
+
+def _get_signed_pairs(pairs):
+    """
+    Return the sorted quoted pairs to be signed.
+
+    These are all `pairs` but "hmac" and "gettoken".
+    """
+    return sorted(pair for pair in pairs if pair[0] != 'hmac' and pair[0] != 'gettoken')
+
+
+def _escape_quoted_pair(key, value):
+    """
+    Return the ``key=value`` token of the signed param string.
+    """
+    # The already quoted keys and values only contain unreserved characters
+    # and percent escapes, so quoting the token again boils down to escaping
+    # "%" and "=".
+    return '{}%3D{}'.format(key.replace('%', '%25'), value.replace('%', '%25'))
+
+
+def _join_quoted_params(pairs):
+    """
+    Join sorted, quoted ``(key, value)`` pairs into the signed param string.
+    """
+    return '%26'.join(_escape_quoted_pair(key, value) for key, value in pairs)
+
+
+def _canonicalise_query_token(token):
+    """
+    Return the signing form of a key or value taken from an encoded query.
+    """
+    if not token.rstrip(_UNRESERVED_CHARS):
+        # Nothing was (or needs to be) escaped, so the wire form is what
+        # would be signed already.
+        return token
+    return quote(unquote_plus(token), safe='')
+
+
+def _parse_signed_query_string(signature_param, query_string):
+    """
+    Return the signature and the signed param string of a raw query string.
+
+    The query is split like ``parse_qs`` does it, i.e. blank values are
+    ignored. The keys and values are canonicalised from their url-encoded
+    form; only tokens containing escapes are decoded and quoted again.
+    """
+    query_string = compat.stringify(query_string)
+    signature = None
+    pairs = []
+    for field in query_string.split('&'):
+        key, _, value = field.partition('=')
+        if not value:
+            continue
+        key = _canonicalise_query_token(key)
+        if key == signature_param:
+            if signature is None:
+                signature = unquote_plus(value)
+            continue
+        if key == 'hmac' or key == 'gettoken':
+            continue
+        pairs.append((key, _canonicalise_query_token(value)))
+    pairs.sort()
+    return signature, _join_quoted_params(pairs)
+
+
+class QuotedParams(object):
+    """
+    Params quoted and sorted for signing once, e.g. those of an item.
+
+    Only the quoted keys and values are kept, in a single flat tuple. The
+    url-encoded query string is derived from them, as ``quote_plus`` only
+    differs from the quoting used for signing in encoding spaces as ``+``.
+
+    Instances can be passed as the params to :func:`sign`, :func:`sign_many`
+    and :meth:`CanonicalParams.extend`.
+
+    :param params: params dict (values can be strings or lists of strings)
+    """
+
+    __slots__ = ('_quoted',)
+
+    #: Names of params whose values repeat across many instances, e.g.
+    #: prices. Their quoted values are shared like the keys.
+    _shared_value_keys = frozenset()
+
+    def __init__(self, params):
+        quoted = []
+        shared_value_keys = self._shared_value_keys
+        for key, value in _quote_params(params):
+            # Keys repeat across instances, so share them.
+            quoted.append(intern(key))
+            quoted.append(intern(value) if key in shared_value_keys else value)
+        # Bypass __setattr__, which immutable subclasses disable.
+        object.__setattr__(self, '_quoted', tuple(quoted))
+
+    def _get_pairs(self):
+        """
+        Return the sorted, quoted ``(key, value)`` pairs.
+        """
+        quoted = self._quoted
+        return list(zip(quoted[::2], quoted[1::2]))
+
+    @property
+    def query_string(self):
+        """
+        Return the url-encoded params, as ``urlencode`` does.
+        """
+        return _join_query_pairs(self._get_pairs())
+
+    def keys(self):
+        """
+        Return the set of param names.
+        """
+        return set(unquote(key) if '%' in key else key for key in self._quoted[::2])
+
+    def items(self):
+        """
+        Return the ``(key, value)`` pairs, unquoted again.
+        """
+        return [(unquote(key), unquote(value)) for key, value in self._get_pairs()]
+
+
+class CanonicalParams(object):
+    """
+    Params that are shared by many signatures, prepared for signing once.
+
+    The shared params are url-encoded, quoted and sorted when the object is
+    created. Extending them with the params of a single signature merges the
+    latter into the sorted shared part, which is neither quoted nor sorted
+    again.
+
+    :param params: params dict (values can be strings or lists of strings)
+    """
+
+    def __init__(self, params):
+        self.params = normalise_param_structure(params)
+        self.query_string = urlencode(list(self.params.items()), doseq=True)
+        self._pairs = _quote_params(self.params)
+        self._tokens = [_escape_quoted_pair(key, value) for key, value in self._pairs]
+
+    def __contains__(self, key):
+        """
+        Return whether ``key`` is one of the shared params.
+        """
+        return key in self.params
+
+    def extend(self, params):
+        """
+        Return the signed param string of the shared params and `params`.
+
+        :param params: params dict (values can be strings or lists of strings)
+        """
+        return self._extend_pairs(_quote_params(params))
+
+    def _extend_pairs(self, pairs):
+        """
+        Return the signed param string of the shared params and `pairs`.
+
+        `pairs` are the sorted, quoted ``(key, value)`` pairs of a single
+        signature.
+        """
+        shared_pairs = self._pairs
+        shared_tokens = self._tokens
+        tokens = []
+        start = 0
+        for pair in pairs:
+            index = bisect.bisect_right(shared_pairs, pair, start)
+            tokens.extend(shared_tokens[start:index])
+            tokens.append(_escape_quoted_pair(*pair))
+            start = index
+        tokens.extend(shared_tokens[start:])
+        return '%26'.join(tokens)
+
+
+def _get_param_str(params, common_params=None):
+    """
+    Return the signed param string of `params` and optional `common_params`.
+    """
+    if common_params is None:
+        return _join_quoted_params(_quote_params(params))
+    if not isinstance(common_params, CanonicalParams):
+        common_params = CanonicalParams(common_params)
+    return common_params.extend(params)
+
+
+def _create_message_prefix(method, url):
+    """
+    Return the ``{method}&{url}&`` part of the message to be signed.
+
+    The result is cached per ``(method, url)``.
+    """
+    key = (method, url)
+    prefix = _message_prefix_cache.get(key)
+    if prefix is None:
+        prefix = _build_message_prefix(method, url)
+        _message_prefix_cache.set(key, prefix)
+    return prefix
+
+
+def _build_message_prefix(method, url):
+    """
+    Build the ``{method}&{url}&`` part of the message to be signed.
     """
     # Process method
     method = compat.stringify(method).upper()
     if method not in ALLOWED_METHODS:
         raise ValueError('method should be one of: {}'.format(ALLOWED_METHODS))
 
-    # Process params
-    params = normalise_param_structure(params)
-    if 'hmac' in params:
-        params.pop('hmac')
-    if 'gettoken' in params:
-        params.pop('gettoken')
-    params = {
-        # urlquote all keys and values
-        quote(key, safe=''): [quote(value, safe='') for value in values]
-        for key, values
-        in six.iteritems(params)
-    }
-    params = _sort_params(params)
-    param_str = '&'.join('{}={}'.format(k, v) for k, v in params)
-    param_str = quote(param_str, safe='')
-
     # Process url
     url = compat.stringify(url)
     url_parsed = urlparse(url)
     url = url_parsed.scheme + "://" + url_parsed.netloc + url_parsed.path
     url = quote(url, safe='')
 
-    return MESSAGE_FORMAT.format(method=method, url=url, params=param_str)
+    return MESSAGE_FORMAT.format(method=method, url=url, params='')
+
 
+def create_base_message(params, url, method='POST'):
+    """
+    Construct a message to be signed.
 
-def sign(secret, params, url, method='POST'):
+    You are unlikely to need to call this directly and should not consider it a
+    stable part of the API. This will be deprecated and replaced with a internal
+    method accordingly, in a future release.
+
+    https://docs.laterpay.net/platform/intro/signing_urls/
+    """
+    prefix = _create_message_prefix(method, url)
+    return prefix + _join_quoted_params(_quote_params(params))
+
+
+def sign(secret, params, url, method='POST', common_params=None):
     """
     Create signature for given `params`, `url` and HTTP `method`.
 
-    :param secret: secret string used to create the signature
+    :param secret: secret string or :class:`Signer` used to create the
+                   signature
     :param params: params dict (values can be strings or lists of strings)
     :param url: base url for which the params were signed.
                 Example: https://example.net/here
                 (no query params or fragments)
     :param method: HTTP method used to transport the signed data
                    ('POST' is default)
+    :param common_params: optional params dict or :class:`CanonicalParams`
+                          signed together with `params`, as if both were
+                          merged keeping repeated keys
+    """
+    return _get_signer(secret).sign(params, url, method=method, common_params=common_params)
+
+
+def sign_many(secret, iterable_of_params, url, method='POST', common_params=None):
     """
-    message = create_base_message(params, url, method=method)
-    mac = create_HMAC(secret, message)
-    return mac
+    Create signatures for many `params` dicts sharing `url` and `method`.
+
+    The keyed HMAC, the quoted `url` and the quoted `common_params` are
+    computed once for the whole batch instead of once per signature.
+
+    :param secret: secret string or :class:`Signer` used to create the
+                   signatures
+    :param iterable_of_params: iterable of params dicts (values can be strings
+                               or lists of strings)
+    :param url: base url for which the params are signed.
+                Example: https://example.net/here
+                (no query params or fragments)
+    :param method: HTTP method used to transport the signed data
+                   ('POST' is default)
+    :param common_params: optional params dict or :class:`CanonicalParams`
+                          signed together with every params dict in
+                          `iterable_of_params`, as if both were merged keeping
+                          repeated keys
+
+    :return: list of signatures in the order of `iterable_of_params`
+    """
+    message_hmac = _get_signer(secret)._get_message_hmac(method, url)
+    if common_params is not None and not isinstance(common_params, CanonicalParams):
+        common_params = CanonicalParams(common_params)
+
+    signatures = []
+    for params in iterable_of_params:
+        authcode = message_hmac.copy()
+        authcode.update(compat.byteify(_get_param_str(params, common_params)))
+        signatures.append(compat.stringify(authcode.hexdigest()))
+    return signatures
+
+
+def verify_query_string(signature_param, secret, query_string, url, method):
+    """
+    Verify the signature contained in a raw, url-encoded query string.
+
+    This is equivalent to parsing `query_string` with ``parse_qs`` and passing
+    the result to :func:`verify`, but canonicalises the params directly from
+    their url-encoded form instead of decoding and quoting them again.
+
+    :param signature_param: name of the query param containing the signature,
+                            e.g. "hmac"
+    :param secret: secret string, :class:`Signer` or :class:`KeyRing` used
+                   to create the signature
+    :param query_string: the url-encoded query string, without the leading
+                         "?". Example: "cp=abc&ts=1330088810&hmac=f6e5..."
+    :param url: base url for which the params were signed.
+                Example: https://example.net/here
+                (no query params or fragments)
+    :param method: HTTP method used to transport the signed data
+    """
+    return _get_signer(secret).verify_query_string(signature_param, query_string, url, method)
 
 
 def verify(signature, secret, params, url, method):
@@ -197,17 +714,12 @@ def verify(signature, secret, params, url, method):
     Verify the signature of a given `params` dict.
 
     :param signature: signature string to be verified
-    :param secret: secret string used to create the signature
+    :param secret: secret string, :class:`Signer` or :class:`KeyRing` used
+                   to create the signature
     :param params: params dict (values can be strings or lists of strings)
     :param url: base url for which the params were signed.
                 Example: https://example.net/here
                 (no query params or fragments)
     :param method: HTTP method used to transport the signed data
     """
-    if isinstance(signature, (list, tuple)):
-        signature = signature[0]
-    signature = compat.stringify(signature)
-
-    mac = sign(secret, params, url, method)
-
-    return time_independent_HMAC_compare(signature, mac)
+    return _get_signer(secret).verify(signature, params, url, method)
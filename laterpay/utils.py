@@ -1,9 +1,7 @@
 # -*- coding: utf-8 -*-
 import time
 
-from six.moves.urllib.parse import urlencode
-
-from laterpay import signing
+from laterpay import compat, signing
 
 
 def signed_query(secret,
@@ -12,18 +10,20 @@ def signed_query(secret,
                  method="GET",
                  add_timestamp=True,
                  is_permalink=False,
-                 signature_param_name="hmac"):
+                 signature_param_name="hmac",
+                 common_params=None):
     """
     Create a signed and url-encoded query string from passed in ``params``.
 
-    The params are signed using ``laterpay.signing.sign()`` and the signature
-    is appended to the query as the ``signature_param_name`` param.
+    The params are signed as by ``laterpay.signing.sign()`` and the signature
+    is appended to the query as the ``signature_param_name`` param. Each key
+    and value is quoted once for both the query string and the signature.
 
     A "ts" param containing current Unix timestamp will also be added to the
     query if ``add_timestamp`` is ``True`` (default) and there is no "ts" key
     in the ``params`` dict.
 
-    :param secret: The shared secret
+    :param secret: The shared secret or a ``laterpay.signing.Signer``
     :param params: A ``dict`` of URL parameters. Each value in this ``dict``
                    can be either a string or a list of strings.
     :param url: The base url (no params) passed to ``signing.sign()``.
@@ -37,30 +37,128 @@ def signed_query(secret,
                 ignored and a timestamp will not be added to the query.
     :param signature_param_name: Name of the appended signature param
                                  (default "hmac")
+    :param common_params: An optional ``dict`` or
+                          ``laterpay.signing.CanonicalParams`` of URL
+                          parameters shared with other queries. Passing the
+                          same ``CanonicalParams`` to many calls saves
+                          encoding and quoting them again each time. They are
+                          appended to the query as they are.
 
     :return: url-encoded and signed query string
     """
     params = signing.normalise_param_structure(params)
+    if common_params is not None and not isinstance(common_params, signing.CanonicalParams):
+        common_params = signing.CanonicalParams(common_params)
 
     if is_permalink:
         params["permalink"] = "1"
         if "ts" in params:
             params.pop("ts")
-    elif "ts" not in params and add_timestamp:
+    elif "ts" not in params and add_timestamp and (common_params is None or "ts" not in common_params):
         params["ts"] = str(int(time.time()))
 
-    param_list = list(params.items())
-
-    qs = urlencode(param_list, doseq=True)
+    # Quote every key and value once, for both the query string and the
+    # signature.
+    pairs = signing._quote_query_params(params)
+    qs = signing._join_query_pairs(pairs)
+    signed_pairs = signing._get_signed_pairs(pairs)
 
-    signature = signing.sign(secret, params, url=url, method=method)
+    signer = signing._get_signer(secret)
+    if common_params is None:
+        signature = signer._sign_quoted_pairs(signed_pairs, url, method)
+    else:
+        qs = _join_queries(qs, common_params.query_string)
+        signature = signer._sign_quoted_pairs(signed_pairs, url, method, common_params=common_params)
 
     return "{}&{}={}".format(qs, signature_param_name, signature)
 
 
+def _join_queries(*queries):
+    """
+    Join the non-empty url-encoded ``queries`` into one.
+    """
+    return "&".join(query for query in queries if query)
+
+
 def signed_url(secret, params, url, **kwargs):
     """
     Return the same as ``signed_query`` but including the base URL.
     """
     qs = signed_query(secret, params, url, **kwargs)
     return "{}?{}".format(url, qs)
+
+
+def signed_queries(secret,
+                   iterable_of_params,
+                   url,
+                   method="GET",
+                   add_timestamp=True,
+                   is_permalink=False,
+                   signature_param_name="hmac",
+                   common_params=None):
+    """
+    Create signed and url-encoded query strings for many ``params``.
+
+    This is the batch version of ``signed_query``. The ``common_params`` are
+    included in every query. They are url-encoded and quoted for signing only
+    once, and the same timestamp is used for the whole batch.
+
+    The "ts" and "permalink" params are handled as in ``signed_query``, with
+    the "ts" param being added to ``common_params``.
+
+    :param iterable_of_params: An iterable of ``dict``s of URL parameters or
+                               of ``laterpay.signing.QuotedParams``.
+    :param common_params: An optional ``dict`` of URL parameters shared by all
+                          queries.
+
+    See ``signed_query`` for the other parameters.
+
+    :return: ``list`` of url-encoded and signed query strings
+    """
+    common_params = signing.normalise_param_structure(common_params or {})
+    param_dicts = [
+        params if isinstance(params, signing.QuotedParams) else signing.normalise_param_structure(params)
+        for params in iterable_of_params
+    ]
+
+    if is_permalink:
+        common_params["permalink"] = "1"
+        for params in [common_params] + param_dicts:
+            if isinstance(params, dict) and "ts" in params:
+                params.pop("ts")
+    elif "ts" not in common_params and add_timestamp:
+        common_params["ts"] = str(int(time.time()))
+
+    common_params = signing.CanonicalParams(common_params)
+    common_qs = common_params.query_string
+    message_hmac = signing._get_signer(secret)._get_message_hmac(method, url)
+
+    queries = []
+    for params in param_dicts:
+        # Quote every key and value once, for both the query string and the
+        # signature.
+        if isinstance(params, signing.QuotedParams):
+            signed_pairs = params._get_pairs()
+            qs = signing._join_query_pairs(signed_pairs)
+        else:
+            pairs = signing._quote_query_params(params)
+            qs = signing._join_query_pairs(pairs)
+            signed_pairs = signing._get_signed_pairs(pairs)
+        authcode = message_hmac.copy()
+        authcode.update(compat.byteify(common_params._extend_pairs(signed_pairs)))
+        queries.append("{}&{}={}".format(
+            _join_queries(qs, common_qs),
+            signature_param_name,
+            compat.stringify(authcode.hexdigest()),
+        ))
+    return queries
+
+
+def signed_urls(secret, iterable_of_params, url, **kwargs):
+    """
+    Return the same as ``signed_queries`` but including the base URL.
+    """
+    return [
+        "{}?{}".format(url, qs)
+        for qs in signed_queries(secret, iterable_of_params, url, **kwargs)
+    ]
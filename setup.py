@@ -3,8 +3,11 @@ from setuptools import find_packages, setup
 
 import codecs
 import os
+import re
 
-_version = "5.10.0a1"
+with codecs.open(os.path.join('laterpay', '__init__.py'), 'r', 'utf-8') as f:
+    # laterpay itself can't be imported before its dependencies are installed
+    _version = re.search(r"^__version__ = '([^']+)'$", f.read(), re.M).group(1)
 _packages = find_packages('.', exclude=["*.tests", "*.tests.*", "tests.*", "tests"])
 
 if os.path.exists('README.rst'):
@@ -34,6 +37,10 @@ setup(
         'six',
     ],
 
+    extras_require={
+        'async': ['aiohttp'],
+    },
+
     classifiers=(
         "Development Status :: 3 - Alpha",
         # "Development Status :: 5 - Production/Stable",
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ``laterpay.aio``.
+
+They use ``async def`` and only run on Python 3.7+, see ``tests/test_aio.py``.
+"""
+import asyncio
+import time
+import unittest
+
+import mock
+
+from laterpay import signing
+from laterpay.aio import HAS_AIOHTTP, AsyncAccessBatcher, AsyncLaterPayClient, AsyncSingleFlight
+from laterpay.cache import InMemoryAccessCache
+from laterpay.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+if HAS_AIOHTTP:
+    import aiohttp
+    from aiohttp import web
+
+
+class StubAccessServer(object):
+    """
+    A local /access endpoint checking the signature of incoming requests.
+    """
+
+    def __init__(self, secret, delay=0, status=200):
+        self.secret = secret
+        self.delay = delay
+        self.status = status
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def access(self, request):
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+        params = {key: request.query.getall(key) for key in request.query}
+        url = '%s://%s%s' % (request.scheme, request.host, request.path)
+        if not signing.verify(params.get('hmac'), self.secret, params, url, request.method):
+            return web.json_response({'status': 'error'}, status=401)
+        if self.status != 200:
+            return web.json_response({'status': 'error'}, status=self.status)
+        return web.json_response({
+            'status': 'ok',
+            'articles': {article_id: {'access': article_id.endswith('1')} for article_id in params['article_id']},
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/access', self.access)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return 'http://127.0.0.1:%d' % port
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def run_until_complete(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+
+    def test_leader_mutating_result(self):
+        single_flight = AsyncSingleFlight()
+
+        async def func():
+            await asyncio.sleep(0.01)
+            return {'articles': {'a1': {'access': True}}}
+
+        async def leader():
+            result = await single_flight.do('key', func)
+            # Runs before the waiting callers are resumed
+            result['articles'].clear()
+            return result
+
+        async def test():
+            return await asyncio.gather(leader(), *[single_flight.do('key', func) for _ in range(3)])
+
+        results = run_until_complete(test())
+        self.assertEqual(results[0], {'articles': {}})
+        self.assertEqual(results[1:], [{'articles': {'a1': {'access': True}}}] * 3)
+
+
+@unittest.skipUnless(HAS_AIOHTTP, 'aiohttp is not installed')
+class TestAsyncLaterPayClient(unittest.TestCase):
+
+    def run_with_server(self, test, **kwargs):
+        async def run():
+            server = StubAccessServer('fake-shared-secret', **kwargs)
+            api_root = await server.start()
+            try:
+                await test(server, api_root)
+            finally:
+                await server.stop()
+
+        run_until_complete(run())
+
+    def test_get_access_data(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient('fake-cp-key', 'fake-shared-secret', api_root=api_root) as client:
+                data = await client.get_access_data(['article-1', 'article-2'], lptoken='fake-lptoken')
+                session = client.connection_handler
+                await client.get_access_data('article-1', muid='some-user')
+                self.assertIs(client.connection_handler, session)
+
+            self.assertTrue(session.closed)
+            self.assertEqual(data, {
+                'status': 'ok',
+                'articles': {
+                    'article-1': {'access': True},
+                    'article-2': {'access': False},
+                },
+            })
+            self.assertEqual(len(server.requests), 2)
+            request = server.requests[0]
+            self.assertEqual(request.headers['X-LP-APIVersion'], '2')
+            self.assertEqual(request.query.getall('article_id'), ['article-1', 'article-2'])
+            self.assertEqual(request.query['lptoken'], 'fake-lptoken')
+            self.assertEqual(request.query['cp'], 'fake-cp-key')
+            self.assertEqual(server.requests[1].query['muid'], 'some-user')
+
+        self.run_with_server(test)
+
+    def test_custom_request_headers(self):
+        class Client(AsyncLaterPayClient):
+            def get_request_headers(self):
+                headers = super(Client, self).get_request_headers()
+                headers['X-Custom'] = 'value'
+                return headers
+
+        async def test(server, api_root):
+            async with Client('fake-cp-key', 'fake-shared-secret', api_root=api_root) as client:
+                await client.get_access_data('article-1', muid='some-user')
+            self.assertEqual(server.requests[0].headers['X-Custom'], 'value')
+            self.assertEqual(server.requests[0].headers['X-LP-APIVersion'], '2')
+
+        self.run_with_server(test)
+
+    def test_access_cache(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root, access_cache=InMemoryAccessCache(),
+            ) as client:
+                await client.get_access_data('article-1', muid='some-user')
+                data = await client.get_access_data(['article-1', 'article-2'], muid='some-user')
+            self.assertEqual(data['articles'], {
+                'article-1': {'access': True},
+                'article-2': {'access': False},
+            })
+            self.assertEqual(len(server.requests), 2)
+            self.assertEqual(server.requests[1].query.getall('article_id'), ['article-2'])
+
+        self.run_with_server(test)
+
+    def test_single_flight(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root, single_flight=True,
+            ) as client:
+                results = await asyncio.gather(*[
+                    client.get_access_data(['article-1', 'article-2'], muid='some-user') for _ in range(5)
+                ])
+                other = await client.get_access_data('article-1', muid='other-user')
+            self.assertEqual(len(server.requests), 2)
+            self.assertEqual(len(set(id(result) for result in results)), 5)
+            self.assertTrue(all(result == results[0] for result in results))
+            self.assertEqual(other['articles'], {'article-1': {'access': True}})
+
+        self.run_with_server(test, delay=0.05)
+
+    def test_single_flight_error(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root, single_flight=True,
+            ) as client:
+                results = await asyncio.gather(*[
+                    client.get_access_data('article-1', muid='some-user') for _ in range(3)
+                ], return_exceptions=True)
+            self.assertEqual(len(server.requests), 1)
+            self.assertTrue(all(isinstance(result, aiohttp.ClientResponseError) for result in results))
+
+        self.run_with_server(test, delay=0.05, status=500)
+
+    def test_access_batcher(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient('fake-cp-key', 'fake-shared-secret', api_root=api_root) as client:
+                batcher = AsyncAccessBatcher(client, window=0.05)
+                results = await asyncio.gather(
+                    batcher.get_access_data('article-1', muid='some-user'),
+                    batcher.get_access_data(['article-2', 'article-3'], muid='some-user'),
+                    batcher.get_access_data('article-1', muid='other-user'),
+                )
+            self.assertEqual(len(server.requests), 2)
+            self.assertEqual(server.requests[0].query.getall('article_id'), ['article-1', 'article-2', 'article-3'])
+            self.assertEqual(results, [
+                {'status': 'ok', 'articles': {'article-1': {'access': True}}},
+                {'status': 'ok', 'articles': {'article-2': {'access': False}, 'article-3': {'access': False}}},
+                {'status': 'ok', 'articles': {'article-1': {'access': True}}},
+            ])
+
+        self.run_with_server(test)
+
+    def test_access_batcher_max_batch_size(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient('fake-cp-key', 'fake-shared-secret', api_root=api_root) as client:
+                batcher = AsyncAccessBatcher(client, window=5, max_batch_size=2)
+                results = await asyncio.wait_for(asyncio.gather(
+                    batcher.get_access_data('article-1', muid='some-user'),
+                    batcher.get_access_data('article-2', muid='some-user'),
+                ), timeout=2)
+            self.assertEqual(len(server.requests), 1)
+            self.assertEqual(results[1], {'status': 'ok', 'articles': {'article-2': {'access': False}}})
+
+        self.run_with_server(test)
+
+    def test_access_batcher_error(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient('fake-cp-key', 'fake-shared-secret', api_root=api_root) as client:
+                batcher = AsyncAccessBatcher(client, window=0.01)
+                results = await asyncio.gather(
+                    batcher.get_access_data('article-1', muid='some-user'),
+                    batcher.get_access_data('article-2', muid='some-user'),
+                    return_exceptions=True,
+                )
+            self.assertEqual(len(server.requests), 1)
+            self.assertTrue(all(isinstance(result, aiohttp.ClientResponseError) for result in results))
+
+        self.run_with_server(test, status=500)
+
+    def test_chunked(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root, max_url_length=300,
+            ) as client:
+                article_ids = ['article-%03d' % i for i in range(60)]
+                data = await client.get_access_data(article_ids, muid='some-user')
+            self.assertGreater(len(server.requests), 1)
+            self.assertEqual(sorted(data['articles']), article_ids)
+            self.assertEqual(data['articles']['article-001'], {'access': True})
+
+        self.run_with_server(test)
+
+    def test_stale_while_revalidate(self):
+        async def test(server, api_root):
+            access_cache = InMemoryAccessCache(ttl=60, stale_ttl=30)
+            key = ('fake-cp-key', 'muid:some-user', 'article-2')
+            access_cache.set_many({key: {'access': True}}, now=time.time() - 70)
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root, access_cache=access_cache,
+            ) as client:
+                data = await client.get_access_data('article-2', muid='some-user')
+                self.assertEqual(data['articles'], {'article-2': {'access': True}})
+            self.assertEqual(len(server.requests), 1)
+            self.assertEqual(access_cache.get_many([key]), {key: {'access': False}})
+
+        self.run_with_server(test)
+
+    def test_retry_policy(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root,
+                retry_policy=RetryPolicy(backoff=0.001),
+            ) as client:
+                with self.assertRaises(aiohttp.ClientResponseError):
+                    await client.get_access_data('article-1', muid='some-user')
+            self.assertEqual(len(server.requests), 3)
+
+        self.run_with_server(test, status=503)
+
+    def test_circuit_breaker(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root,
+                circuit_breaker=CircuitBreaker(min_requests=1),
+            ) as client:
+                with self.assertRaises(aiohttp.ClientResponseError):
+                    await client.get_access_data('article-1', muid='some-user')
+                with self.assertRaises(CircuitOpenError):
+                    await client.get_access_data('article-1', muid='some-user')
+            self.assertEqual(len(server.requests), 1)
+
+        self.run_with_server(test, status=503)
+
+    def test_circuit_breaker_serves_from_cache(self):
+        async def test(server, api_root):
+            access_cache = InMemoryAccessCache()
+            access_cache.set_many({('fake-cp-key', 'muid:some-user', 'article-1'): {'access': True}})
+            breaker = CircuitBreaker(min_requests=1)
+            breaker.record_failure()
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root,
+                access_cache=access_cache, circuit_breaker=breaker,
+            ) as client:
+                data = await client.get_access_data(['article-1', 'article-2'], muid='some-user')
+                self.assertEqual(data, {
+                    'status': 'ok', 'articles': {'article-1': {'access': True}}, 'unavailable': ['article-2'],
+                })
+                with self.assertRaises(CircuitOpenError):
+                    await client.get_access_data('article-2', muid='some-user')
+            self.assertEqual(server.requests, [])
+
+        self.run_with_server(test)
+
+    def test_max_concurrency(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root, max_concurrency=2,
+            ) as client:
+                await asyncio.gather(*[
+                    client.get_access_data('article-%d' % i, muid='some-user') for i in range(6)
+                ])
+            self.assertEqual(len(server.requests), 6)
+            self.assertEqual(server.max_in_flight, 2)
+
+        self.run_with_server(test, delay=0.05)
+
+    def test_timeout(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient(
+                'fake-cp-key', 'fake-shared-secret', api_root=api_root, timeout_seconds=0.05,
+            ) as client:
+                with self.assertRaises(asyncio.TimeoutError):
+                    await client.get_access_data('article-1', muid='some-user')
+
+        self.run_with_server(test, delay=1)
+
+    def test_error_status(self):
+        async def test(server, api_root):
+            async with AsyncLaterPayClient('fake-cp-key', 'fake-shared-secret', api_root=api_root) as client:
+                with self.assertRaises(aiohttp.ClientResponseError):
+                    await client.get_access_data('article-1', muid='some-user')
+
+        self.run_with_server(test, status=500)
+
+    def test_custom_connection_handler(self):
+        connection_handler = mock.Mock()
+        client = AsyncLaterPayClient('fake-cp-key', 'fake-shared-secret', connection_handler=connection_handler)
+        self.assertIs(client.connection_handler, connection_handler)
+        run_until_complete(client.close())
+        connection_handler.close.assert_not_called()
+
+    def test_sync_context_manager(self):
+        client = AsyncLaterPayClient('fake-cp-key', 'fake-shared-secret')
+        with self.assertRaises(TypeError):
+            with client:
+                pass  # pragma: no cover
+
+
+if __name__ == '__main__':
+    unittest.main()
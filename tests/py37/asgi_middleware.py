@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ``laterpay.middleware.ASGIMiddleware``.
+
+They use ``async def`` and only run on Python 3.7+, see
+``tests/test_middleware_asgi.py``.
+"""
+import asyncio
+import unittest
+
+import mock
+
+from laterpay.middleware import ASGIMiddleware, RequestVerifier
+from tests.test_middleware import signed_query
+
+
+async def asgi_app(scope, receive, send):
+    body = b'verified' if scope.get('laterpay.verified') else b'unverified'
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class TestASGIMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.app = ASGIMiddleware(asgi_app, RequestVerifier('secret'), paths=['/callback'])
+
+    def call(self, query_string, path='/callback', headers=((b'host', b'example.com'), ), **scope):
+        scope = dict({
+            'type': 'http',
+            'method': 'GET',
+            'scheme': 'https',
+            'path': path,
+            'query_string': query_string.encode(),
+            'headers': list(headers),
+            'server': ('example.com', 443),
+        }, **scope)
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.app(scope, receive, send))
+        finally:
+            loop.close()
+        return messages[0]['status'], messages[1]['body']
+
+    @mock.patch('time.time', return_value=1000)
+    def test_verified(self, time_mock):
+        qs = signed_query({'foo': 'bar'})
+        self.assertEqual(self.call(qs), (200, b'verified'))
+        self.assertEqual(self.call(qs), (403, b'Replayed request'))
+        self.assertEqual(self.call(signed_query({'foo': 'baz'}), headers=()), (200, b'verified'))
+
+    @mock.patch('time.time', return_value=1000)
+    def test_rejected(self, time_mock):
+        qs = signed_query({'foo': 'bar'})
+        self.assertEqual(self.call(qs, headers=[(b'host', b'other.com')]), (403, b'Invalid signature'))
+
+    def test_other_paths(self):
+        self.assertEqual(self.call('', path='/other'), (200, b'unverified'))
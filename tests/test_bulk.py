@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from six.moves.urllib.parse import parse_qs, urlparse
+
+from laterpay import InvalidItemDefinition, ItemDefinition, LaterPayClient, bulk
+
+
+ROWS = [
+    {'item_id': 'article-%d' % i, 'pricing': 'EUR%d' % (100 + i), 'url': 'http://example.com/%d' % i,
+     'title': u'Tîtle %d' % i}
+    for i in range(25)
+]
+
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.client = LaterPayClient('cp-key', 'secret')
+
+    def expected_urls(self, rows, page='buy', **kwargs):
+        kwargs.setdefault('is_permalink', True)
+        get_url = getattr(self.client, 'get_%s_url' % page)
+        return [get_url(ItemDefinition(**row), **kwargs) for row in rows]
+
+    def assertSameURLs(self, urls, expected):
+        self.assertEqual(len(urls), len(expected))
+        for url, expected_url in zip(urls, expected):
+            url, expected_url = urlparse(url), urlparse(expected_url)
+            self.assertEqual(url.path, expected_url.path)
+            self.assertEqual(parse_qs(url.query), parse_qs(expected_url.query))
+
+    def test_read_items_jsonl(self):
+        fileobj = io.StringIO(u'\n'.join(json.dumps(row) for row in ROWS[:2]) + u'\n\n')
+        self.assertEqual(list(bulk.read_items(fileobj)), ROWS[:2])
+
+    def test_read_items_csv(self):
+        fileobj = io.StringIO(
+            u'item_id,pricing,url,title,expiry,sub_id,period\n'
+            u'a1,EUR100,http://example.com/1,"Title, 1",,,\n'
+            u'a2,EUR200,http://example.com/2,Title 2,+3600,sub,3600\n'
+        )
+        self.assertEqual(list(bulk.read_items(fileobj, 'csv')), [
+            {'item_id': 'a1', 'pricing': 'EUR100', 'url': 'http://example.com/1', 'title': 'Title, 1'},
+            {'item_id': 'a2', 'pricing': 'EUR200', 'url': 'http://example.com/2', 'title': 'Title 2',
+             'expiry': '+3600', 'sub_id': 'sub', 'period': 3600},
+        ])
+
+    def test_read_items_invalid_format(self):
+        with self.assertRaises(ValueError):
+            list(bulk.read_items(io.StringIO(u''), 'xml'))
+
+    def test_sign_items(self):
+        urls = bulk.sign_items('cp-key', 'secret', iter(ROWS), processes=2, chunk_size=4, max_pending_chunks=2)
+        self.assertSameURLs(list(urls), self.expected_urls(ROWS))
+
+    def test_sign_items_in_process(self):
+        urls = bulk.sign_items(
+            'cp-key', 'secret', ROWS, page='add', processes=0, chunk_size=10, product_key='product',
+        )
+        self.assertSameURLs(list(urls), self.expected_urls(ROWS, page='add', product_key='product'))
+
+    def test_sign_items_invalid(self):
+        rows = ROWS[:3] + [dict(ROWS[3], pricing='invalid')]
+        with self.assertRaises(InvalidItemDefinition):
+            list(bulk.sign_items('cp-key', 'secret', rows, processes=2, chunk_size=2))
+        with self.assertRaises(ValueError):
+            list(bulk.sign_items('cp-key', 'secret', rows, page='invalid'))
+
+    @mock.patch('time.time', return_value=123)
+    def test_main(self, time_mock):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        infile = os.path.join(tmpdir, 'items.jsonl')
+        outfile = os.path.join(tmpdir, 'urls.txt')
+        with io.open(infile, 'w', encoding='utf-8') as f:
+            f.write(u'\n'.join(json.dumps(row) for row in ROWS))
+
+        with mock.patch.dict(os.environ, {'LATERPAY_SHARED_SECRET': 'secret'}):
+            result = bulk.main([
+                infile, '-o', outfile, '--cp-key', 'cp-key', '--page', 'subscribe',
+                '--processes', '0', '--no-dialog', '--expiring',
+            ])
+
+        self.assertEqual(result, 0)
+        with io.open(outfile, encoding='utf-8') as f:
+            # Parsed as native strings, like the expected URLs.
+            urls = [str(url) for url in f.read().splitlines()]
+        self.assertSameURLs(urls, self.expected_urls(ROWS, page='subscribe', dialog=False, is_permalink=False))
+
+    def test_main_missing_secret(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            with self.assertRaises(SystemExit):
+                bulk.main(['--cp-key', 'cp-key', '--secret-env', 'MISSING'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from laterpay.cache import InMemoryAccessCache, LRUCache, SQLiteAccessCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(maxsize=2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 'default'), 'default')
+
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIn('a', cache)
+        self.assertEqual(len(cache), 1)
+
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertNotIn('a', cache)
+
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Mark "a" as recently used, "b" is evicted next
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_invalid_maxsize(self):
+        with self.assertRaises(ValueError):
+            LRUCache(maxsize=0)
+
+
+class AccessCacheTestMixin(object):
+
+    def get_cache(self, **kwargs):
+        raise NotImplementedError
+
+    def test_ttl(self):
+        cache = self.get_cache(ttl=60, negative_ttl=5)
+        cache.set_many({
+            ('cp', 'lptoken:token', 'article-1'): {'access': True},
+            ('cp', 'lptoken:token', 'article-2'): {'access': False},
+        }, now=100)
+
+        keys = [
+            ('cp', 'lptoken:token', 'article-1'),
+            ('cp', 'lptoken:token', 'article-2'),
+            ('cp', 'lptoken:token', 'article-3'),
+        ]
+        self.assertEqual(cache.get_many(keys, now=104), {
+            ('cp', 'lptoken:token', 'article-1'): {'access': True},
+            ('cp', 'lptoken:token', 'article-2'): {'access': False},
+        })
+        self.assertEqual(cache.get_many(keys, now=105), {
+            ('cp', 'lptoken:token', 'article-1'): {'access': True},
+        })
+        self.assertEqual(cache.get_many(keys, now=160), {})
+
+    def test_stale_ttl(self):
+        cache = self.get_cache(ttl=60, negative_ttl=5, stale_ttl=30)
+        cache.set_many({
+            ('cp', 'lptoken:token', 'article-1'): {'access': True},
+            ('cp', 'lptoken:token', 'article-2'): {'access': False},
+        }, now=100)
+        keys = [('cp', 'lptoken:token', 'article-1'), ('cp', 'lptoken:token', 'article-2')]
+
+        self.assertEqual(cache.get_many_with_stale(keys, now=159), ({
+            ('cp', 'lptoken:token', 'article-1'): {'access': True},
+        }, {}))
+        # Only entries granting access are served stale
+        self.assertEqual(cache.get_many_with_stale(keys, now=160), ({}, {
+            ('cp', 'lptoken:token', 'article-1'): {'access': True},
+        }))
+        self.assertEqual(cache.get_many(keys, now=160), {})
+        self.assertEqual(cache.get_many_with_stale(keys, now=190), ({}, {}))
+
+    def test_disabled_negative_ttl(self):
+        cache = self.get_cache(negative_ttl=0)
+        cache.set_many({('cp', 'muid:user', 'article-1'): {'access': False}}, now=100)
+        self.assertEqual(cache.get_many([('cp', 'muid:user', 'article-1')], now=100), {})
+
+    def test_eviction(self):
+        cache = self.get_cache(maxsize=2)
+        cache.set_many({('a',): {'access': True}}, now=100)
+        cache.set_many({('b',): {'access': True}}, now=101)
+        # Mark "a" as recently used, "b" is evicted next
+        cache.get_many([('a',)], now=102)
+        cache.set_many({('c',): {'access': True}}, now=103)
+
+        self.assertEqual(cache.get_many([('a',), ('b',), ('c',)], now=104), {
+            ('a',): {'access': True},
+            ('c',): {'access': True},
+        })
+
+        cache.clear()
+        self.assertEqual(cache.get_many([('a',), ('c',)], now=104), {})
+
+
+class TestInMemoryAccessCache(AccessCacheTestMixin, unittest.TestCase):
+
+    def get_cache(self, **kwargs):
+        return InMemoryAccessCache(**kwargs)
+
+    def test_expired_entries_are_removed(self):
+        cache = self.get_cache(ttl=60)
+        cache.set_many({('a',): {'access': True}}, now=100)
+        self.assertEqual(len(cache), 1)
+        cache.get_many([('a',)], now=200)
+        self.assertEqual(len(cache), 0)
+
+
+def _set_access_in_subprocess(path):
+    SQLiteAccessCache(path).set_many({('cp', 'muid:user', 'article-1'): {'access': True}})
+
+
+class TestSQLiteAccessCache(AccessCacheTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'access.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_cache(self, **kwargs):
+        return SQLiteAccessCache(self.path, **kwargs)
+
+    def test_shared_between_processes(self):
+        cache = self.get_cache()
+        process = multiprocessing.Process(target=_set_access_in_subprocess, args=(self.path,))
+        process.start()
+        process.join()
+        self.assertEqual(cache.get_many([('cp', 'muid:user', 'article-1')]), {
+            ('cp', 'muid:user', 'article-1'): {'access': True},
+        })
+
+    def test_many_keys(self):
+        cache = self.get_cache()
+        keys = [('cp', 'muid:user', 'article-%d' % i) for i in range(1200)]
+        cache.set_many(dict((key, {'access': True}) for key in keys))
+        self.assertEqual(len(cache.get_many(keys)), 1200)
+
+    def test_invalid_maxsize(self):
+        with self.assertRaises(ValueError):
+            self.get_cache(maxsize=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import six
+from six.moves.urllib.parse import parse_qs, urlparse
+
+from laterpay import (
+    FrozenItemDefinition,
+    InvalidItemDefinition,
+    InvalidItemDefinitions,
+    ItemDefinition,
+    LaterPayClient,
+)
+from laterpay.catalog import Catalog, CatalogItem
+
+
+ROWS = [
+    {'item_id': 'article-%d' % i, 'pricing': 'EUR%d' % (100 + i % 3), 'url': 'http://example.com/%d' % i,
+     'title': u'Tîtle %d' % i}
+    for i in range(10)
+] + [
+    {'item_id': 'expiring', 'pricing': 'EUR100', 'url': 'http://example.com/e', 'title': 'E',
+     'expiry': '+3600'},
+    {'item_id': 'absolute', 'pricing': 'EUR100', 'url': 'http://example.com/a', 'title': 'A',
+     'expiry': '1577836800'},
+    {'item_id': 'sub', 'pricing': 'EUR100', 'url': 'http://example.com/s', 'title': 'S',
+     'sub_id': 'monthly', 'period': 2592000},
+    {'item_id': 'campaign', 'pricing': 'EUR500', 'url': 'http://example.com/c', 'title': 'C',
+     'item_type': 'donation'},
+    {'item_id': 42, 'pricing': 'USD500', 'url': 'http://example.com/p', 'title': 'P',
+     'item_type': 'political', 'election_id': 'election-2020'},
+]
+
+
+@unittest.skipIf(six.PY2, 'Catalogs require Python 3')
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.client = LaterPayClient('cp-key', 'secret')
+        self.catalog = Catalog.from_rows(ROWS)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'items.catalog')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameItems(self, catalog, rows):
+        self.assertEqual(len(catalog), len(rows))
+        for index, row in enumerate(rows):
+            item_definition = ItemDefinition(**row)
+            item = catalog.get_item(index)
+            expected_data = dict(item_definition.data)
+            if expected_data.get('article_id') == 42 or expected_data.get('campaign_id') == 42:
+                expected_data['campaign_id'] = '42'
+            self.assertEqual(item.data, expected_data)
+            self.assertEqual(item.item_type, item_definition.item_type)
+
+    def assertSameUrls(self, urls, expected):
+        # Rows are signed like a ``FrozenItemDefinition``, which lists the
+        # item's params sorted.
+        self.assertEqual(
+            [(urlparse(url).path, parse_qs(urlparse(url).query)) for url in urls],
+            [(urlparse(url).path, parse_qs(urlparse(url).query)) for url in expected],
+        )
+
+    def test_get_item(self):
+        self.assertSameItems(self.catalog, ROWS)
+        self.assertIsInstance(self.catalog[0], CatalogItem)
+        self.assertEqual(self.catalog[-1], self.catalog.get_item(len(ROWS) - 1))
+        with self.assertRaises(IndexError):
+            self.catalog.get_item(len(ROWS))
+
+    def test_append(self):
+        catalog = Catalog()
+        self.assertEqual(catalog.append('a1', 'EUR100', 'http://example.com/1', 'Title'), 0)
+        self.assertEqual(catalog.append(**ROWS[1]), 1)
+        self.assertEqual(len(catalog), 2)
+        self.assertEqual(catalog[0].data['article_id'], 'a1')
+
+    def test_append_validates(self):
+        with self.assertRaises(InvalidItemDefinition):
+            self.catalog.append('a1', 'invalid', 'http://example.com/1', 'Title')
+        with self.assertRaises(InvalidItemDefinition):
+            self.catalog.append('a1', 'EUR100', 'http://example.com/1', 'Title', expiry='tomorrow')
+        self.assertEqual(len(self.catalog), len(ROWS))
+
+    def test_extend_reports_all_invalid_rows(self):
+        catalog = Catalog()
+        rows = list(ROWS)
+        rows[1] = dict(rows[1], pricing='invalid')
+        rows[7] = dict(rows[7], expiry='tomorrow')
+        with self.assertRaises(InvalidItemDefinitions) as cm:
+            catalog.extend(iter(rows), chunk_size=4)
+        self.assertEqual(sorted(cm.exception.errors), [1, 7])
+        self.assertEqual(len(catalog), len(ROWS) - 2)
+        self.assertEqual(catalog[1].data['article_id'], 'article-2')
+
+    def test_extend_reports_rows_failing_to_append(self):
+        catalog = Catalog()
+        rows = list(ROWS[:4])
+        rows[1] = dict(rows[1])
+        del rows[1]['pricing']
+        rows[2] = dict(rows[2], colour='red')
+        rows[3] = dict(rows[3], sub_id='monthly', period=2 ** 64)
+        with self.assertRaises(InvalidItemDefinitions) as cm:
+            catalog.extend(rows)
+        self.assertEqual(sorted(cm.exception.errors), [1, 2, 3])
+        self.assertEqual(len(catalog), 1)
+        self.assertEqual(catalog[0].data['article_id'], 'article-0')
+
+    def test_none_texts(self):
+        self.catalog.append(None, 'EUR100', None, None)
+        self.catalog.append('after', 'EUR100', '', u'Tîtle')
+        item = self.catalog[-2]
+        self.assertIsNone(item.data['article_id'])
+        self.assertIsNone(item.data['url'])
+        self.assertIsNone(item.data['title'])
+        self.assertEqual(self.catalog[-1].data['url'], '')
+        self.assertEqual(self.catalog[-1].data['title'], u'Tîtle')
+        self.catalog.save(self.path)
+        with Catalog.open(self.path) as catalog:
+            self.assertEqual(catalog[-2], item)
+            self.assertEqual(catalog[-1], self.catalog[-1])
+
+    def test_interned_columns(self):
+        pricing = self.catalog._symbols['pricing']
+        self.assertEqual(len(pricing), 5)
+        self.assertEqual(len(self.catalog._symbols['sub_id']), 1)
+
+    def test_expiry_is_kept_verbatim(self):
+        catalog = Catalog()
+        catalog.append('a1', 'EUR100', 'http://example.com/1', 'Title', expiry='+0060')
+        catalog.append('a2', 'EUR100', 'http://example.com/2', 'Title', expiry='0099')
+        self.assertEqual(catalog[0].data['expiry'], '+0060')
+        self.assertEqual(catalog[1].data['expiry'], '0099')
+        self.assertSameUrls(
+            [catalog.get_buy_url(self.client, 0, is_permalink=True)],
+            [self.client.get_buy_url(
+                ItemDefinition('a1', 'EUR100', 'http://example.com/1', 'Title', expiry='+0060'),
+                is_permalink=True,
+            )],
+        )
+
+    def test_get_frozen_item(self):
+        for index, row in enumerate(ROWS):
+            self.assertEqual(self.catalog._get_frozen_item(index), FrozenItemDefinition(**row))
+        self.catalog.append(None, 'EUR100', None, None)
+        self.assertEqual(self.catalog._get_frozen_item(-1), FrozenItemDefinition(None, 'EUR100', None, None))
+
+    def test_load_jsonl(self):
+        rows = ROWS[:3]
+        fileobj = io.StringIO(u'\n'.join(json.dumps(row) for row in rows) + u'\n')
+        self.assertSameItems(Catalog.load(fileobj), rows)
+
+    def test_load_csv(self):
+        fileobj = io.StringIO(
+            u'item_id,pricing,url,title,expiry,sub_id,period\n'
+            u'a1,EUR100,http://example.com/1,"Title, 1",,,\n'
+            u'a2,EUR200,http://example.com/2,Title 2,+3600,sub,3600\n'
+        )
+        catalog = Catalog.load(fileobj, 'csv')
+        self.assertEqual(catalog[0].data['title'], 'Title, 1')
+        self.assertEqual(catalog[1].data['sub_id'], 'sub')
+        self.assertEqual(catalog[1].data['period'], 3600)
+
+    def test_get_urls(self):
+        for page in ('buy', 'add', 'subscribe'):
+            get_url = getattr(self.client, 'get_%s_url' % page)
+            expected = [get_url(ItemDefinition(**row), is_permalink=True) for row in ROWS]
+            expected_batch = getattr(self.client, 'get_%s_urls' % page)(
+                [ItemDefinition(**row) for row in ROWS], is_permalink=True,
+            )
+            self.assertSameUrls([
+                getattr(self.catalog, 'get_%s_url' % page)(self.client, index, is_permalink=True)
+                for index in range(len(ROWS))
+            ], expected)
+            self.assertSameUrls(
+                getattr(self.catalog, 'get_%s_urls' % page)(self.client, is_permalink=True),
+                expected_batch,
+            )
+            self.assertSameUrls(
+                getattr(self.catalog, 'get_%s_urls' % page)(self.client, [3, 1], is_permalink=True),
+                [expected_batch[3], expected_batch[1]],
+            )
+
+    def test_save_and_open(self):
+        self.catalog.save(self.path)
+        with Catalog.open(self.path) as catalog:
+            self.assertTrue(catalog.read_only)
+            self.assertSameItems(catalog, ROWS)
+            self.assertEqual(
+                catalog.get_buy_urls(self.client, is_permalink=True),
+                self.catalog.get_buy_urls(self.client, is_permalink=True),
+            )
+            with self.assertRaises(TypeError):
+                catalog.append(**ROWS[0])
+        self.assertEqual(len(catalog), 0)
+
+    def test_save_opened_catalog(self):
+        self.catalog.save(self.path)
+        copy_path = os.path.join(self.tmpdir, 'copy.catalog')
+        with Catalog.open(self.path) as catalog:
+            catalog.save(copy_path)
+        with open(self.path, 'rb') as original, open(copy_path, 'rb') as copy:
+            self.assertEqual(original.read(), copy.read())
+
+    def test_save_and_open_empty(self):
+        Catalog().save(self.path)
+        with Catalog.open(self.path) as catalog:
+            self.assertEqual(len(catalog), 0)
+            self.assertEqual(catalog.get_buy_urls(self.client), [])
+
+    def test_open_invalid_file(self):
+        with open(self.path, 'wb') as fileobj:
+            fileobj.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            Catalog.open(self.path)
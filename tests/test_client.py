@@ -1,22 +1,35 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import json
+import pickle
+import sys
+import time
 import unittest
 
 import jwt
 import mock
+import requests
 import responses
 
 from furl import furl
-from six.moves.urllib.parse import urlparse, parse_qs
+from six.moves.urllib.parse import urlparse, parse_qs, parse_qsl
 
 from laterpay import (
     APIException,
+    FrozenItemDefinition,
     InvalidItemDefinition,
+    InvalidItemDefinitions,
     ItemDefinition,
     LaterPayClient,
+    _PRICING_LIST_RE,
+    _ValidationMemo,
     constants,
+    signing,
+    utils,
+    validate_item_columns,
 )
+from laterpay.cache import InMemoryAccessCache
+from laterpay.compat import stringify
 
 
 class TestItemDefinition(unittest.TestCase):
@@ -131,6 +144,121 @@ class TestItemDefinition(unittest.TestCase):
         self.assertIsNone(it.item_type)
 
 
+class TestValidation(unittest.TestCase):
+
+    def test_validation_memo(self):
+        is_valid = _ValidationMemo(_PRICING_LIST_RE, maxsize=2)
+        self.assertTrue(is_valid('EUR20'))
+        self.assertFalse(is_valid('invalid'))
+        self.assertEqual(is_valid._valid, {'EUR20'})
+        with mock.patch.object(is_valid, '_match') as match:
+            self.assertTrue(is_valid('EUR20'))
+        self.assertFalse(match.called)
+        is_valid('USD20')
+        is_valid('GBP20')
+        self.assertEqual(is_valid._valid, {'GBP20'})
+
+    def test_validate_item_columns(self):
+        validate_item_columns(
+            pricing=['EUR20', 'EUR20', 'USD10,EUR10'],
+            expiry=[None, '+3600', '1577836800'],
+            sub_id=[None, 'abc', None],
+            period=[None, 3600, None],
+        )
+
+    def test_validate_item_columns_reports_all_invalid_items(self):
+        with self.assertRaises(InvalidItemDefinitions) as cm:
+            validate_item_columns(
+                pricing=['EUR20', 'invalid', 'invalid', 'EUR20', 'EUR20'],
+                expiry=[None, 'tomorrow', None, 3600, None],
+                sub_id=[None, None, 'ä', 'abc', None],
+                period=[None, None, 3600],
+            )
+        errors = cm.exception.errors
+        self.assertEqual(sorted(errors), [1, 2, 3])
+        self.assertEqual(errors[1], [
+            'Pricing is not valid: invalid',
+            "Invalid expiry value tomorrow, it should be '+3600' or UTC-based epoch timestamp "
+            "in seconds of type int",
+        ])
+        self.assertEqual(len(errors[2]), 2)
+        self.assertTrue(errors[2][1].startswith('Invalid sub_id value '))
+        self.assertEqual(len(errors[3]), 2)
+        self.assertTrue(errors[3][1].startswith("Period not set or invalid value 'None'"))
+        self.assertIsInstance(cm.exception, InvalidItemDefinition)
+        self.assertTrue(str(cm.exception).startswith('3 invalid item definitions: item 1: '))
+
+    def test_validate_item_columns_missing_pricing(self):
+        with self.assertRaises(InvalidItemDefinitions) as cm:
+            validate_item_columns(pricing=[None, 'EUR1'], expiry=[None, None])
+        self.assertEqual(cm.exception.errors, {0: ['Pricing is not valid: None']})
+
+
+class TestFrozenItemDefinition(unittest.TestCase):
+
+    def test_validation(self):
+        for args, kwargs in (
+            ((1, '', '', 'title'), {}),
+            ((1, 'EUR20,', '', 'title'), {}),
+            ((1, 'EUR20,USD', '', 'title'), {}),
+            ((1, 'EUR20', 'http://foo.invalid', 'title'), {'expiry': 'illegal123'}),
+            ((1, 'EUR20', 'http://example.com', 'title'), {'sub_id': '', 'period': 3600}),
+            ((1, 'EUR20', 'http://example.com/t', 'title'), {'sub_id': 'a', 'period': '12345'}),
+        ):
+            with self.assertRaises(InvalidItemDefinition):
+                ItemDefinition(*args, **kwargs)
+            with self.assertRaises(InvalidItemDefinition):
+                FrozenItemDefinition(*args, **kwargs)
+
+        # Only the start of each price is validated, as before.
+        FrozenItemDefinition(1, 'EUR20,USD30abc', 'http://example.com/t', 'title')
+
+    def test_data(self):
+        it = FrozenItemDefinition(1, 'EUR20', 'http://example.com/t', u'tïtle &', sub_id='abc', period=12345)
+        self.assertEqual(it.data, {
+            'article_id': '1',
+            'period': 12345,
+            'pricing': 'EUR20',
+            'sub_id': 'abc',
+            'title': stringify(u'tïtle &'),
+            'url': 'http://example.com/t',
+        })
+        self.assertIsNone(it.item_type)
+
+        it = FrozenItemDefinition(
+            1, 'EUR20', 'http://example.com/t', 'title', item_type=constants.ITEM_TYPE_POLITICAL_CONTRIBUTION,
+            election_id='123-election',
+        )
+        self.assertEqual(it.data, {
+            'campaign_id': '1',
+            'election_id': '123-election',
+            'pricing': 'EUR20',
+            'title': 'title',
+            'url': 'http://example.com/t',
+        })
+        self.assertEqual(it.item_type, 'political')
+
+    def test_immutable(self):
+        it = FrozenItemDefinition(1, 'EUR20', 'http://example.com/t', 'title')
+        with self.assertRaises(AttributeError):
+            it.item_type = 'donation'
+        with self.assertRaises(AttributeError):
+            it.data = {}
+        with self.assertRaises(AttributeError):
+            del it.item_type
+        self.assertFalse(hasattr(it, '__dict__'))
+
+    def test_equality_and_pickle(self):
+        it = FrozenItemDefinition(1, 'EUR20', 'http://example.com/t', 'title')
+        self.assertEqual(it, FrozenItemDefinition(1, 'EUR20', 'http://example.com/t', 'title'))
+        self.assertEqual(hash(it), hash(FrozenItemDefinition(1, 'EUR20', 'http://example.com/t', 'title')))
+        self.assertNotEqual(it, FrozenItemDefinition(2, 'EUR20', 'http://example.com/t', 'title'))
+        self.assertNotEqual(it, ItemDefinition(1, 'EUR20', 'http://example.com/t', 'title'))
+        restored = pickle.loads(pickle.dumps(it))
+        self.assertEqual(restored, it)
+        self.assertEqual(restored.item_type, it.item_type)
+
+
 class TestLaterPayClient(unittest.TestCase):
 
     def setUp(self):
@@ -280,6 +408,104 @@ class TestLaterPayClient(unittest.TestCase):
         self.assertQueryString(url, 'ts', '123')
         self.assertNotQueryString(url, 'permalink')
 
+    @unittest.skipIf(sys.version_info < (3, 6), 'dicts are unordered before Python 3.6')
+    @mock.patch('time.time')
+    def test_web_url_param_order(self, time_mock):
+        time_mock.return_value = 123
+        kwargs = {
+            'product_key': 'some-product-key',
+            'use_jsevents': True,
+            'transaction_reference': 'some-reference',
+            'return_url': 'http://return.url/',
+        }
+        # The item's params, the item independent ones, then the timestamp
+        url = self.lp.get_buy_url(self.item, **kwargs)
+        keys = [key for key, _ in parse_qsl(urlparse(url).query)]
+        self.assertEqual(sorted(keys[:4]), ['article_id', 'pricing', 'title', 'url'])
+        self.assertEqual(keys[4:], ['cp', 'product', 'jsevents', 'tref', 'return_url', 'ts', 'hmac'])
+        self.assertEqual(self.lp.get_buy_urls([self.item], **kwargs), [url])
+
+        url = self.lp.get_buy_url(self.item, is_permalink=True, **kwargs)
+        keys = [key for key, _ in parse_qsl(urlparse(url).query)]
+        self.assertEqual(keys[4:], ['cp', 'product', 'jsevents', 'tref', 'return_url', 'permalink', 'hmac'])
+
+    def test_web_url_cached_params_types(self):
+        for value, expected in ((1, '1'), (True, 'True'), (1.0, '1.0')):
+            url = self.lp.get_buy_url(self.item, is_permalink=True, foo=value)
+            self.assertQueryString(url, 'foo', expected)
+            params = parse_qs(urlparse(url).query)
+            signature = params.pop('hmac')
+            self.assertTrue(signing.verify(
+                signature, 'some-secret', params, 'https://web.laterpay.net/dialog/buy', 'GET',
+            ))
+
+    @mock.patch('time.time')
+    def test_web_url_signature(self, time_mock):
+        time_mock.return_value = 123
+        kwargs = {
+            'product_key': 'some-product-key',
+            'return_url': 'http://return.url/foo?bar=buz&lorem=ipsum',
+            'use_jsevents': True,
+            'muid': 'someone',
+            'cp': 'overridden-cp',
+            'title': 'overridden title',
+            'BLUB': ['u2', 'u1'],
+        }
+
+        for _ in range(2):
+            url = self.lp._get_web_url(self.item, 'PAGE_TYPE', **kwargs)
+            params = parse_qs(urlparse(url).query)
+            self.assertEqual(params['cp'], ['overridden-cp'])
+            self.assertEqual(params['title'], ['overridden title'])
+            signature = params.pop('hmac')
+            self.assertTrue(signing.verify(
+                signature, 'some-secret', params, 'https://web.laterpay.net/dialog/PAGE_TYPE', 'GET',
+            ))
+
+        # The shared params are prepared once per combination
+        self.assertEqual(len(self.lp._canonical_params_cache), 1)
+
+    @mock.patch('time.time')
+    def test_frozen_item_definition_urls(self, time_mock):
+        time_mock.return_value = 123
+        args = (1, 'EUR20,USD30', 'http://example.com/t?a=b c', u'tïtle & more')
+        for item_kwargs, get_url, url_kwargs in (
+            ({'expiry': '+100'}, self.lp.get_buy_url, {}),
+            ({}, self.lp.get_buy_url, {'is_permalink': True, 'product_key': 'product'}),
+            ({'item_type': constants.ITEM_TYPE_DONATION}, self.lp.get_add_url, {'muid': 'someone'}),
+            ({'sub_id': 'sub', 'period': 3600}, self.lp.get_subscribe_url, {'use_jsevents': True}),
+            # Params overriding the item's fall back to the generic path
+            ({}, self.lp.get_buy_url, {'title': 'overridden title', 'BLUB': ['u2', 'u1']}),
+        ):
+            frozen_url = get_url(FrozenItemDefinition(*args, **item_kwargs), **url_kwargs)
+            url = get_url(ItemDefinition(*args, **item_kwargs), **url_kwargs)
+
+            self.assertEqual(urlparse(frozen_url).path, urlparse(url).path)
+            params = parse_qs(urlparse(frozen_url).query)
+            self.assertEqual(params, parse_qs(urlparse(url).query))
+            signature = params.pop('hmac')
+            self.assertTrue(signing.verify(
+                signature, 'some-secret', params, frozen_url.split('?')[0], 'GET',
+            ))
+
+    @mock.patch('time.time')
+    def test_frozen_item_definition_batch_urls(self, time_mock):
+        time_mock.return_value = 123
+        items = [
+            FrozenItemDefinition(1, 'EUR20', 'http://example.net/t1', 'title 1', expiry='+100'),
+            FrozenItemDefinition(
+                'save-the-world', 'EUR20', 'http://example.net/t', 'Save the World!',
+                item_type=constants.ITEM_TYPE_CONTRIBUTION,
+            ),
+            ItemDefinition(2, 'USD10', 'http://example.net/t2', 'title 2'),
+        ]
+        for kwargs in ({'product_key': 'some-product-key'}, {'title': 'Overridden', 'is_permalink': True}):
+            urls = self.lp.get_buy_urls(items, **kwargs)
+            for item, url in zip(items, urls):
+                expected = self.lp.get_buy_url(item, **kwargs)
+                self.assertEqual(urlparse(url).path, urlparse(expected).path)
+                self.assertEqual(parse_qs(urlparse(url).query), parse_qs(urlparse(expected).query))
+
     def test_get_add_url(self):
         item = ItemDefinition(1, 'EUR20', 'http://example.net/t', 'title')
         url = self.lp.get_add_url(
@@ -430,6 +656,153 @@ class TestLaterPayClient(unittest.TestCase):
         self.assertQueryString(url, 'period', '12345')
         self.assertQueryString(url, 'BLUB', ['u2', 'b1', 'b2', 'u1'])
 
+    @mock.patch('time.time')
+    def test_get_buy_urls(self, time_mock):
+        time_mock.return_value = 123
+        items = [
+            ItemDefinition(1, 'EUR20', 'http://example.net/t1', 'title 1', expiry='+100'),
+            ItemDefinition(
+                'save-the-world', 'EUR20', 'http://example.net/t', 'Save the World!',
+                item_type=constants.ITEM_TYPE_CONTRIBUTION,
+            ),
+            ItemDefinition(2, 'USD10', 'http://example.net/t2', 'title 2'),
+        ]
+        kwargs = {
+            'product_key': 'some-product-key',
+            'return_url': 'http://return.url/foo?bar=buz&lorem=ipsum',
+            'title': 'Overridden',
+        }
+
+        urls = self.lp.get_buy_urls(items, **kwargs)
+
+        self.assertEqual(len(urls), 3)
+        self.assertTrue(urls[0].startswith('https://web.laterpay.net/dialog/buy?'))
+        self.assertTrue(urls[1].startswith('https://web.laterpay.net/dialog/contribute/pay_now?'))
+        self.assertTrue(urls[2].startswith('https://web.laterpay.net/dialog/buy?'))
+        for item, url in zip(items, urls):
+            expected = self.lp.get_buy_url(item, **kwargs)
+            self.assertEqual(urlparse(url).path, urlparse(expected).path)
+            self.assertEqual(parse_qs(urlparse(url).query), parse_qs(urlparse(expected).query))
+            self.assertQueryString(url, 'title', 'Overridden')
+
+    @mock.patch('time.time')
+    def test_get_add_urls(self, time_mock):
+        time_mock.return_value = 123
+        items = [
+            ItemDefinition(1, 'EUR20', 'http://example.net/t1', 'title 1'),
+            ItemDefinition('2', 'EUR20', 'http://example.net/t', 'Save!', item_type=constants.ITEM_TYPE_DONATION),
+        ]
+
+        urls = self.lp.get_add_urls(items, dialog=False, is_permalink=True)
+
+        for item, url in zip(items, urls):
+            expected = self.lp.get_add_url(item, dialog=False, is_permalink=True)
+            self.assertEqual(urlparse(url).path, urlparse(expected).path)
+            self.assertEqual(parse_qs(urlparse(url).query), parse_qs(urlparse(expected).query))
+            self.assertQueryString(url, 'permalink', '1')
+            self.assertNotQueryString(url, 'ts')
+
+    @mock.patch('time.time')
+    def test_get_subscribe_urls(self, time_mock):
+        time_mock.return_value = 123
+        items = [
+            ItemDefinition(1, 'EUR20', 'http://example.net/t1', 'title 1', sub_id='abc', period=3600),
+        ]
+
+        urls = self.lp.get_subscribe_urls(items, muid='someone')
+
+        self.assertEqual(
+            parse_qs(urlparse(urls[0]).query),
+            parse_qs(urlparse(self.lp.get_subscribe_url(items[0], muid='someone')).query),
+        )
+        self.assertEqual(self.lp.get_subscribe_urls([]), [])
+
+    @mock.patch('time.time')
+    def test_compile_buy_url(self, time_mock):
+        time_mock.return_value = 123
+        items = [
+            ItemDefinition(1, 'EUR20', 'http://example.net/t1', 'title 1', expiry='+100'),
+            ItemDefinition(
+                'save-the-world', 'EUR20', 'http://example.net/t', 'Save the World!',
+                item_type=constants.ITEM_TYPE_CONTRIBUTION,
+            ),
+            FrozenItemDefinition(2, 'USD10', 'http://example.net/t2', 'title 2'),
+            FrozenItemDefinition(3, 'USD10', 'http://example.net/t3', 'title 3', expiry='+100'),
+        ]
+        kwargs = {
+            'product_key': 'some-product-key',
+            'return_url': 'http://return.url/foo?bar=buz&lorem=ipsum',
+            'transaction_reference': 'unique-reference',
+            'expiry': '+200',
+        }
+
+        template = self.lp.compile_buy_url(**kwargs)
+
+        for item in items:
+            url = template.render(item)
+            expected = self.lp.get_buy_url(item, **kwargs)
+            self.assertEqual(urlparse(url).path, urlparse(expected).path)
+            self.assertEqual(parse_qs(urlparse(url).query), parse_qs(urlparse(expected).query))
+            self.assertQueryString(url, 'ts', '123')
+            self.assertQueryString(url, 'expiry', '+200')
+
+    @mock.patch('time.time')
+    def test_compile_url_item_params(self, time_mock):
+        time_mock.return_value = 123
+        item = ItemDefinition(1, 'EUR20,USD30', 'http://example.com/t?a=b c', u'tïtle & more', expiry='+100')
+        item.data['BLUB'] = ['u2', 'u1']
+        template = self.lp.compile_buy_url(expiry='+200', muid='someone')
+
+        url = template.render(item)
+        data = dict(item.data)
+        del data['expiry']
+        expected = utils.signed_url(
+            self.lp.signer, data, 'https://web.laterpay.net/dialog/buy', add_timestamp=False,
+            common_params=template._get_common_params(),
+        )
+        if sys.version_info < (3, 6):
+            # Dicts are unordered, so the params may be in another order.
+            self.assertEqual(parse_qs(urlparse(url).query), parse_qs(urlparse(expected).query))
+        else:
+            self.assertEqual(url, expected)
+        self.assertQueryString(url, 'expiry', '+200')
+
+    @mock.patch('time.time')
+    def test_compile_url_timestamp(self, time_mock):
+        item = ItemDefinition(1, 'EUR20', 'http://example.net/t1', 'title 1')
+        template = self.lp.compile_add_url()
+        time_mock.return_value = 123
+        self.assertQueryString(template.render(item), 'ts', '123')
+        time_mock.return_value = 124.5
+        url = template.render(item)
+        self.assertQueryString(url, 'ts', '124')
+        self.assertEqual(parse_qs(urlparse(url).query), parse_qs(urlparse(self.lp.get_add_url(item)).query))
+
+        template = self.lp.compile_add_url(ts='100')
+        self.assertQueryString(template.render(item), 'ts', '100')
+
+    @mock.patch('time.time')
+    def test_compile_url_permalink(self, time_mock):
+        time_mock.return_value = 123
+        items = [
+            ItemDefinition(1, 'EUR20', 'http://example.net/t1', 'title 1'),
+            FrozenItemDefinition(
+                '2', 'EUR20', 'http://example.net/t', 'Save!', item_type=constants.ITEM_TYPE_DONATION,
+            ),
+            ItemDefinition(3, 'EUR20', 'http://example.net/t1', 'title 1', sub_id='abc', period=3600),
+        ]
+        for page in ('add', 'subscribe'):
+            template = getattr(self.lp, 'compile_%s_url' % page)(dialog=False, is_permalink=True, ts='100')
+            for item in items:
+                url = template.render(item)
+                expected = getattr(self.lp, 'get_%s_url' % page)(item, dialog=False, is_permalink=True)
+                if isinstance(item, FrozenItemDefinition):
+                    self.assertEqual(url, expected)
+                self.assertEqual(urlparse(url).path, urlparse(expected).path)
+                self.assertEqual(parse_qs(urlparse(url).query), parse_qs(urlparse(expected).query))
+                self.assertQueryString(url, 'permalink', '1')
+                self.assertNotQueryString(url, 'ts')
+
     def test_get_login_dialog_url_with_use_dialog_api_false(self):
         url = self.lp.get_login_dialog_url('http://example.org')
         self.assertEqual(str(furl(url).path), '/account/dialog/login')
@@ -496,7 +869,7 @@ class TestLaterPayClient(unittest.TestCase):
         self.assertNotIn('muid', 'qd')
 
         sign_mock.assert_called_once_with(
-            secret='fake-shared-secret',
+            secret=client.signer,
             params={
                 'cp': 'fake-cp-key',
                 'article_id': ['article-1', 'article-2'],
@@ -561,7 +934,7 @@ class TestLaterPayClient(unittest.TestCase):
         self.assertNotIn('lptoken', 'qd')
 
         sign_mock.assert_called_once_with(
-            secret='fake-shared-secret',
+            secret=client.signer,
             params={
                 'cp': 'fake-cp-key',
                 'article_id': ['article-1', 'article-2'],
@@ -600,6 +973,259 @@ class TestLaterPayClient(unittest.TestCase):
             timeout=10,
         )
 
+    @responses.activate
+    def test_get_access_data_cached(self):
+        def access_callback(request):
+            qd = parse_qs(urlparse(request.url).query)
+            articles = dict(
+                (article_id, {'access': article_id == 'article-1'})
+                for article_id in qd['article_id']
+            )
+            return 200, {}, json.dumps({'status': 'ok', 'articles': articles})
+
+        responses.add_callback(
+            responses.GET,
+            'http://example.net/access',
+            callback=access_callback,
+            content_type='application/json',
+        )
+        client = LaterPayClient(
+            'fake-cp-key',
+            'fake-shared-secret',
+            api_root='http://example.net',
+            access_cache=InMemoryAccessCache(),
+        )
+
+        expected = {
+            'status': 'ok',
+            'articles': {
+                'article-1': {'access': True},
+                'article-2': {'access': False},
+            },
+        }
+        self.assertEqual(client.get_access_data(['article-1', 'article-2'], lptoken='fake-lptoken'), expected)
+        self.assertEqual(len(responses.calls), 1)
+
+        # Fully cached
+        self.assertEqual(client.get_access_data(['article-2', 'article-1'], lptoken='fake-lptoken'), expected)
+        self.assertEqual(len(responses.calls), 1)
+
+        # Only the missing article is requested
+        expected['articles']['article-3'] = {'access': False}
+        data = client.get_access_data(['article-1', 'article-2', 'article-3'], lptoken='fake-lptoken')
+        self.assertEqual(data, expected)
+        self.assertEqual(len(responses.calls), 2)
+        qd = parse_qs(urlparse(responses.calls[1].request.url).query)
+        self.assertEqual(qd['article_id'], ['article-3'])
+
+        # Other users are cached separately
+        client.get_access_data('article-1', muid='fake-lptoken')
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_get_access_data_stale_while_revalidate(self):
+        responses.add(
+            responses.GET,
+            'http://example.net/access',
+            body=json.dumps({'status': 'ok', 'articles': {'article-1': {'access': False}}}),
+            status=200,
+            content_type='application/json',
+        )
+        access_cache = InMemoryAccessCache(ttl=60, stale_ttl=30)
+        key = ('fake-cp-key', 'lptoken:fake-lptoken', 'article-1')
+        access_cache.set_many({key: {'access': True}}, now=time.time() - 70)
+        client = LaterPayClient(
+            'fake-cp-key',
+            'fake-shared-secret',
+            api_root='http://example.net',
+            access_cache=access_cache,
+        )
+
+        with client:
+            # The stale entry is returned right away
+            data = client.get_access_data('article-1', lptoken='fake-lptoken')
+            self.assertEqual(data, {'status': 'ok', 'articles': {'article-1': {'access': True}}})
+        # and was refreshed in the background
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(access_cache.get_many([key]), {key: {'access': False}})
+        self.assertEqual(client._refreshing, set())
+
+    @mock.patch('laterpay._logger')
+    @responses.activate
+    def test_get_access_data_stale_refresh_error(self, logger_mock):
+        responses.add(responses.GET, 'http://example.net/access', status=500)
+        access_cache = InMemoryAccessCache(ttl=60, stale_ttl=30)
+        key = ('fake-cp-key', 'muid:user', 'article-1')
+        access_cache.set_many({key: {'access': True}}, now=time.time() - 70)
+        client = LaterPayClient(
+            'fake-cp-key',
+            'fake-shared-secret',
+            api_root='http://example.net',
+            access_cache=access_cache,
+        )
+
+        data = client.get_access_data('article-1', muid='user')
+        client.close()
+        self.assertEqual(data['articles'], {'article-1': {'access': True}})
+        self.assertEqual(logger_mock.exception.call_count, 1)
+        self.assertEqual(access_cache.get_many_with_stale([key])[1], {key: {'access': True}})
+
+    def test_refresh_stale_access_data_deduplicated(self):
+        client = LaterPayClient('fake-cp-key', 'fake-shared-secret')
+        keys = {('fake-cp-key', 'muid:user', 'article-1'): 'article-1'}
+        with mock.patch.object(client, '_schedule_refresh') as schedule_mock:
+            client._refresh_stale_access_data(keys, muid='user')
+            client._refresh_stale_access_data(keys, muid='user')
+        schedule_mock.assert_called_once_with(keys, lptoken=None, muid='user')
+
+    @responses.activate
+    def test_get_access_data_cached_error(self):
+        responses.add(
+            responses.GET,
+            'http://example.net/access',
+            body=json.dumps({'status': 'invalid_token'}),
+            status=200,
+            content_type='application/json',
+        )
+        access_cache = InMemoryAccessCache()
+        client = LaterPayClient(
+            'fake-cp-key',
+            'fake-shared-secret',
+            api_root='http://example.net',
+            access_cache=access_cache,
+        )
+
+        data = client.get_access_data('article-1', lptoken='fake-lptoken')
+        self.assertEqual(data, {'status': 'invalid_token'})
+        self.assertEqual(len(access_cache), 0)
+
+    @responses.activate
+    def test_get_access_data_chunked(self):
+        def access_callback(request):
+            qd = parse_qs(urlparse(request.url).query)
+            params = dict((key, value) for key, value in qd.items() if key != 'hmac')
+            self.assertTrue(signing.verify(
+                qd['hmac'][0], 'fake-shared-secret', params, 'http://example.net/access', 'GET',
+            ))
+            self.assertLessEqual(len(request.url), 300)
+            articles = dict((article_id, {'access': True}) for article_id in qd['article_id'])
+            return 200, {}, json.dumps({'status': 'ok', 'articles': articles})
+
+        responses.add_callback(
+            responses.GET,
+            'http://example.net/access',
+            callback=access_callback,
+            content_type='application/json',
+        )
+        client = LaterPayClient(
+            'fake-cp-key',
+            'fake-shared-secret',
+            api_root='http://example.net',
+            max_url_length=300,
+        )
+
+        article_ids = ['article-%03d' % i for i in range(100)]
+        data = client.get_access_data(article_ids, lptoken='fake-lptoken')
+
+        self.assertEqual(data, {
+            'status': 'ok',
+            'articles': dict((article_id, {'access': True}) for article_id in article_ids),
+        })
+        self.assertGreater(len(responses.calls), 1)
+        requested = []
+        for call in responses.calls:
+            requested.extend(parse_qs(urlparse(call.request.url).query)['article_id'])
+        self.assertEqual(sorted(requested), article_ids)
+
+    def test_get_article_id_chunks(self):
+        client = LaterPayClient('fake-cp-key', 'fake-shared-secret', max_url_length=10)
+        # Every chunk holds at least one article id
+        self.assertEqual(
+            client._get_article_id_chunks(['b', 'a'], muid='user'),
+            [['a'], ['b']],
+        )
+        client.max_url_length = 2000
+        self.assertEqual(
+            client._get_article_id_chunks(['b', 'a'], muid='user'),
+            [['a', 'b']],
+        )
+
+    def test_merge_access_data(self):
+        client = LaterPayClient('fake-cp-key', 'fake-shared-secret')
+        self.assertEqual(client._merge_access_data([
+            {'status': 'ok', 'articles': {'a': {'access': True}}},
+            {'status': 'ok', 'articles': {'b': {'access': False}}},
+        ]), {'status': 'ok', 'articles': {'a': {'access': True}, 'b': {'access': False}}})
+        self.assertEqual(client._merge_access_data([
+            {'status': 'ok', 'articles': {'a': {'access': True}}},
+            {'status': 'invalid_token'},
+        ]), {'status': 'invalid_token'})
+
+    def test_get_request_headers(self):
+        client = LaterPayClient('fake-cp-key', 'fake-shared-secret')
+        with mock.patch('laterpay.__version__', '1.2.3'):
+            headers = client.get_request_headers()
+
+        self.assertEqual(headers, {
+            'X-LP-APIVersion': '2',
+            'User-Agent': 'LaterPay Client Python v1.2.3',
+        })
+        # The headers are built once
+        self.assertIs(client._request_headers, client._request_headers)
+        headers['X-Other'] = 'value'
+        self.assertNotIn('X-Other', client.get_request_headers())
+
+    def test_custom_request_headers(self):
+        class Client(LaterPayClient):
+            def get_request_headers(self):
+                headers = super(Client, self).get_request_headers()
+                headers['X-Custom'] = 'value'
+                return headers
+
+        connection_handler = mock.Mock()
+        client = Client('fake-cp-key', 'fake-shared-secret', connection_handler=connection_handler)
+        client.get_access_data('article-1', muid='some-user')
+
+        headers = connection_handler.get.call_args[1]['headers']
+        self.assertEqual(headers['X-Custom'], 'value')
+        self.assertEqual(headers['X-LP-APIVersion'], '2')
+
+    def test_default_connection_handler(self):
+        client = LaterPayClient('fake-cp-key', 'fake-shared-secret', pool_size=3)
+        session = client.connection_handler
+
+        self.assertIsInstance(session, requests.Session)
+        self.assertIs(client.connection_handler, session)
+        self.assertEqual(session.get_adapter('https://api.laterpay.net')._pool_maxsize, 3)
+        self.assertEqual(session.headers['Connection'], 'keep-alive')
+
+        # A forked child process gets its own session
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(client.connection_handler, session)
+
+        client = LaterPayClient('fake-cp-key', 'fake-shared-secret', keep_alive=False)
+        self.assertEqual(client.connection_handler.headers['Connection'], 'close')
+
+    def test_close(self):
+        client = LaterPayClient('fake-cp-key', 'fake-shared-secret')
+        session = client.connection_handler
+        with mock.patch.object(session, 'close') as close_mock:
+            client.close()
+        close_mock.assert_called_once_with()
+        self.assertIsNot(client.connection_handler, session)
+
+        with mock.patch.object(requests.Session, 'close') as close_mock:
+            with LaterPayClient('fake-cp-key', 'fake-shared-secret') as client:
+                client.connection_handler
+        close_mock.assert_called_once_with()
+
+        # A custom connection handler is not closed
+        connection_handler = mock.Mock()
+        client = LaterPayClient('fake-cp-key', 'fake-shared-secret', connection_handler=connection_handler)
+        client.close()
+        self.assertIs(client.connection_handler, connection_handler)
+        connection_handler.close.assert_not_called()
+
     @mock.patch('laterpay.signing.sign')
     @mock.patch('time.time')
     def test_get_access_params(self, time_time_mock, sign_mock):
@@ -703,6 +1329,30 @@ class TestLaterPayClient(unittest.TestCase):
             ['4f59ae6601fc99e962297fb1db607caeeb8e841fee8f439b526c7f41'],
         )
 
+    def test_shared_secret_signer(self):
+        client = LaterPayClient('cp-key', 'shared-secret')
+        self.assertIsInstance(client.signer, signing.Signer)
+        self.assertEqual(client.shared_secret, 'shared-secret')
+
+        client.shared_secret = 'other-secret'
+        self.assertEqual(client.signer.secret, 'other-secret')
+        self.assertEqual(client.shared_secret, 'other-secret')
+
+    def test_shared_secret_key_ring(self):
+        key_ring = signing.KeyRing(['new-secret', 'old-secret'])
+        client = LaterPayClient('cp-key', key_ring)
+        self.assertIs(client.signer, key_ring)
+        self.assertEqual(client.shared_secret, 'new-secret')
+
+        url = client.get_buy_url(self.item)
+        params = parse_qs(urlparse(url).query)
+        self.assertTrue(signing.verify(
+            params.pop('hmac'), 'new-secret', params, 'https://web.laterpay.net/dialog/buy', 'GET',
+        ))
+
+        token = client._get_manual_ident_token('http://example.com', ['aid'])
+        self.assertEqual(jwt.decode(token, 'new-secret', algorithms=['HS256'])['ids'], ['aid'])
+
     def test_has_token(self):
         client = LaterPayClient('cp-key', 'shared-secret')
         self.assertFalse(client.has_token())
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+import mock
+
+from laterpay import LaterPayClient
+from laterpay.coalescing import AccessBatcher, SingleFlight
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:  # pragma: no cover
+            raise AssertionError('Timed out waiting for condition')
+        time.sleep(0.001)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_concurrently(self, single_flight, func, count=5):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(single_flight.do('key', func))
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_shared_result(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait()
+            return {'status': 'ok'}
+
+        threads, results, errors = self.run_concurrently(single_flight, func)
+        _wait_for(lambda: calls)
+        # Give the other threads a chance to join the call in flight
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'status': 'ok'}] * 5)
+        self.assertEqual(errors, [])
+        # Every caller gets its own copy
+        self.assertEqual(len(set(id(result) for result in results)), 5)
+
+        # Later calls call the function again
+        self.assertEqual(single_flight.do('key', func), {'status': 'ok'})
+        self.assertEqual(len(calls), 2)
+
+    def test_leader_mutating_result(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        # Keeps the waiting callers from resuming until the leader mutated
+        # its result.
+        mutated = threading.Event()
+        results = []
+
+        class GatedEvent(object):
+            def __init__(self, event):
+                self.event = event
+
+            def set(self):
+                self.event.set()
+
+            def wait(self):
+                self.event.wait()
+                mutated.wait()
+
+        def leader_func():
+            release.wait()
+            return {'articles': {'a1': {'access': True}}}
+
+        def leader():
+            result = single_flight.do('key', leader_func)
+            result['articles'].clear()
+            mutated.set()
+
+        def waiter():
+            results.append(single_flight.do('key', lambda: None))
+
+        leader_thread = threading.Thread(target=leader)
+        leader_thread.start()
+        _wait_for(lambda: 'key' in single_flight._calls)
+        call = single_flight._calls['key']
+        call.event = GatedEvent(call.event)
+        threads = [threading.Thread(target=waiter) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads + [leader_thread]:
+            thread.join()
+
+        self.assertEqual(results, [{'articles': {'a1': {'access': True}}}] * 3)
+
+    def test_shared_exception(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait()
+            raise ValueError('boom')
+
+        threads, results, errors = self.run_concurrently(single_flight, func)
+        _wait_for(lambda: calls)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+
+    def test_different_keys(self):
+        single_flight = SingleFlight()
+        self.assertEqual(single_flight.do('a', lambda: 1), 1)
+        self.assertEqual(single_flight.do('b', lambda: 2), 2)
+
+
+class TestLaterPayClientSingleFlight(unittest.TestCase):
+
+    def test_get_access_data(self):
+        release = threading.Event()
+        connection_handler = mock.Mock()
+
+        def get(*args, **kwargs):
+            release.wait()
+            return mock.Mock(**{'json.return_value': {'status': 'ok', 'articles': {}}})
+
+        connection_handler.get.side_effect = get
+        client = LaterPayClient(
+            'fake-cp-key',
+            'fake-shared-secret',
+            connection_handler=connection_handler,
+            single_flight=True,
+        )
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                client.get_access_data(['article-1', 'article-2'], lptoken='fake-lptoken'),
+            ))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        _wait_for(lambda: connection_handler.get.called)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(connection_handler.get.call_count, 1)
+        self.assertEqual(results, [{'status': 'ok', 'articles': {}}] * 5)
+
+    def test_get_access_key(self):
+        client = LaterPayClient('fake-cp-key', 'fake-shared-secret')
+        key = client._get_access_key(['article-2', 'article-1'], lptoken='fake-lptoken')
+        self.assertEqual(key, ('fake-cp-key', 'lptoken', 'fake-lptoken', ('article-1', 'article-2')))
+        self.assertEqual(key, client._get_access_key(['article-1', 'article-2'], lptoken='fake-lptoken'))
+        self.assertNotEqual(key, client._get_access_key(['article-1', 'article-2'], muid='fake-lptoken'))
+
+
+class TestAccessBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.client = LaterPayClient('fake-cp-key', 'fake-shared-secret')
+
+        def get_access_data(article_ids, lptoken=None, muid=None):
+            return {
+                'status': 'ok',
+                'articles': dict(
+                    (article_id, {'access': article_id.endswith('1')}) for article_id in article_ids
+                ),
+            }
+
+        # The batcher uses the other methods of the client as they are.
+        self.client.get_access_data = mock.Mock(side_effect=get_access_data)
+
+    def lookup_concurrently(self, batcher, lookups):
+        results = [None] * len(lookups)
+        errors = []
+
+        def lookup(index, article_ids, kwargs):
+            try:
+                results[index] = batcher.get_access_data(article_ids, **kwargs)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [
+            threading.Thread(target=lookup, args=(index, article_ids, kwargs))
+            for index, (article_ids, kwargs) in enumerate(lookups)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_batching(self):
+        batcher = AccessBatcher(self.client, window=0.2)
+        results, errors = self.lookup_concurrently(batcher, [
+            ('article-1', {'lptoken': 'token'}),
+            (['article-2', 'article-3'], {'lptoken': 'token'}),
+            (['article-1', 'article-4'], {'lptoken': 'token'}),
+            ('article-1', {'muid': 'user'}),
+        ])
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.client.get_access_data.call_count, 2)
+        self.client.get_access_data.assert_any_call(
+            ['article-1', 'article-2', 'article-3', 'article-4'], lptoken='token',
+        )
+        self.client.get_access_data.assert_any_call(['article-1'], muid='user')
+        self.assertEqual(results, [
+            {'status': 'ok', 'articles': {'article-1': {'access': True}}},
+            {'status': 'ok', 'articles': {'article-2': {'access': False}, 'article-3': {'access': False}}},
+            {'status': 'ok', 'articles': {'article-1': {'access': True}, 'article-4': {'access': False}}},
+            {'status': 'ok', 'articles': {'article-1': {'access': True}}},
+        ])
+
+    def test_max_batch_size(self):
+        batcher = AccessBatcher(self.client, window=5, max_batch_size=2)
+        started = time.time()
+        results, errors = self.lookup_concurrently(batcher, [
+            ('article-1', {'lptoken': 'token'}),
+            ('article-2', {'lptoken': 'token'}),
+        ])
+        # The full batch is sent without waiting for the window
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual(errors, [])
+        self.client.get_access_data.assert_called_once_with(['article-1', 'article-2'], lptoken='token')
+
+    def test_error(self):
+        self.client.get_access_data.side_effect = ValueError('boom')
+        batcher = AccessBatcher(self.client, window=0.1)
+        results, errors = self.lookup_concurrently(batcher, [
+            ('article-1', {'lptoken': 'token'}),
+            ('article-2', {'lptoken': 'token'}),
+        ])
+        self.assertEqual(self.client.get_access_data.call_count, 1)
+        self.assertEqual(len(errors), 2)
+
+        # Error responses are passed on as they are
+        self.client.get_access_data.side_effect = None
+        self.client.get_access_data.return_value = {'status': 'invalid_token'}
+        self.assertEqual(batcher.get_access_data('article-1', lptoken='token'), {'status': 'invalid_token'})
+
+    def test_unavailable_articles(self):
+        self.client.get_access_data.side_effect = None
+        self.client.get_access_data.return_value = {
+            'status': 'ok',
+            'articles': {'article-1': {'access': True}},
+            'unavailable': ['article-2', 'article-3'],
+        }
+        batcher = AccessBatcher(self.client, window=0.2)
+        results, errors = self.lookup_concurrently(batcher, [
+            (['article-1', 'article-2'], {'lptoken': 'token'}),
+            ('article-3', {'lptoken': 'token'}),
+        ])
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [
+            {'status': 'ok', 'articles': {'article-1': {'access': True}}, 'unavailable': ['article-2']},
+            {'status': 'ok', 'articles': {}, 'unavailable': ['article-3']},
+        ])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            AccessBatcher(self.client, max_batch_size=0)
+        batcher = AccessBatcher(self.client)
+        with self.assertRaises(AssertionError):
+            batcher.get_access_data('article-1', lptoken='token', muid='user')
+
+
+if __name__ == '__main__':
+    unittest.main()
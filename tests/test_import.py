@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+import unittest
+
+# Budgets for the cumulative cold import time in milliseconds, as reported
+# by ``python -X importtime``. Importing ``requests`` alone takes longer.
+IMPORT_TIME_BUDGETS = {
+    'laterpay': 120,
+    'laterpay.signing': 60,
+}
+
+# Dependencies only imported once the feature needing them is used.
+LAZY_MODULES = ('furl', 'jwt', 'orderedmultidict', 'pkg_resources', 'requests', 'sqlite3')
+
+
+def _run_python(*args):
+    return subprocess.check_output((sys.executable,) + args, stderr=subprocess.STDOUT).decode()
+
+
+def _get_import_time(module):
+    output = _run_python('-X', 'importtime', '-c', 'import %s' % module)
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000.0
+    raise AssertionError('%s not found in the -X importtime output' % module)  # pragma: no cover
+
+
+class TestImport(unittest.TestCase):
+
+    def test_lazy_dependencies(self):
+        output = _run_python(
+            '-c',
+            'import sys, laterpay; '
+            'from laterpay import ItemDefinition, signing, utils; '
+            'client = laterpay.LaterPayClient("cp", "secret"); '
+            'client.get_request_headers(); '
+            'client.get_access_params("article-1", muid="user"); '
+            'client.get_buy_url(ItemDefinition(1, "EUR20", "http://example.com/", "title")); '
+            'signing.sign("secret", {"a": "b"}, "http://example.com/"); '
+            'print(",".join(sorted(module for module in sys.modules if module.split(".")[0] in %r)))'
+            % (LAZY_MODULES,),
+        )
+        self.assertEqual(output.strip(), '')
+
+    def test_lazy_dependencies_are_imported_on_use(self):
+        output = _run_python(
+            '-c',
+            'import sys, laterpay; '
+            'client = laterpay.LaterPayClient("cp", "secret"); '
+            'client.get_manual_ident_url("http://example.com/", ["article-1"]); '
+            'client.connection_handler; '
+            'print("%s %s" % ("jwt" in sys.modules, "requests" in sys.modules))',
+        )
+        self.assertEqual(output.strip(), 'True True')
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime requires Python 3.7')
+    def test_import_time(self):
+        for module, budget in sorted(IMPORT_TIME_BUDGETS.items()):
+            import_time = min(_get_import_time(module) for _ in range(3))
+            self.assertLess(
+                import_time, budget,
+                'import %s took %.1f ms, the budget is %d ms' % (module, import_time, budget),
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import mock
+import six
+
+from laterpay import utils
+from laterpay.middleware import (
+    InvalidRequest,
+    ReplayCache,
+    RequestVerifier,
+    WSGIMiddleware,
+)
+
+
+URL = 'https://example.com/callback'
+
+
+def signed_query(params, ts=1000):
+    return utils.signed_query('secret', dict(params, ts=str(ts)), URL, method='GET')
+
+
+class TestReplayCache(unittest.TestCase):
+
+    def test_add(self):
+        cache = ReplayCache(max_age=60, bucket_seconds=10)
+        self.assertTrue(cache.add('ABC', now=1000))
+        self.assertFalse(cache.add('abc', now=1001))
+        self.assertTrue(cache.add('def', now=1011))
+        self.assertEqual(len(cache), 2)
+
+        # The bucket of "abc" is older than max_age and evicted
+        self.assertTrue(cache.add('ghi', now=1075))
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.add('abc', now=1075))
+
+    def test_expires(self):
+        cache = ReplayCache(max_age=60, bucket_seconds=10)
+        self.assertTrue(cache.add('abc', now=1000, expires=1310))
+        self.assertFalse(cache.add('abc', now=1100))
+        self.assertFalse(cache.add('abc', now=1305))
+        self.assertTrue(cache.add('def', now=1300))
+        # Evicted once expired, although a later expiring bucket was added
+        self.assertTrue(cache.add('abc', now=1320))
+
+    def test_max_entries(self):
+        cache = ReplayCache(max_age=60, max_entries=2, bucket_seconds=10)
+        cache.add('a', now=1000)
+        cache.add('b', now=1010)
+        # Unexpired signatures are never forgotten, new ones are refused
+        with six.assertRaisesRegex(self, InvalidRequest, 'Too many recent requests'):
+            cache.add('c', now=1020)
+        self.assertFalse(cache.add('a', now=1021))
+        self.assertEqual(len(cache), 2)
+        # Once "a" expired, there is room again
+        self.assertTrue(cache.add('c', now=1070))
+        self.assertTrue(cache.add('a', now=1080))
+
+
+class TestRequestVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.verifier = RequestVerifier('secret', max_age=60)
+
+    def test_verify(self):
+        qs = signed_query({'foo': 'bar'})
+        self.verifier.verify('GET', URL, qs, now=1030)
+
+        with six.assertRaisesRegex(self, InvalidRequest, 'Replayed request'):
+            self.verifier.verify('GET', URL, qs, now=1031)
+
+    def test_verify_future_timestamp(self):
+        qs = signed_query({'foo': 'bar'}, ts=1050)
+        self.verifier.verify('GET', URL, qs, now=1000)
+        # Remembered for as long as the timestamp is accepted
+        for now in (1040, 1110):
+            with six.assertRaisesRegex(self, InvalidRequest, 'Replayed request'):
+                self.verifier.verify('GET', URL, qs, now=now)
+        with six.assertRaisesRegex(self, InvalidRequest, 'Stale timestamp'):
+            self.verifier.verify('GET', URL, qs, now=1111)
+
+    def test_verify_invalid_signature(self):
+        qs = signed_query({'foo': 'bar'})
+        with six.assertRaisesRegex(self, InvalidRequest, 'Invalid signature'):
+            self.verifier.verify('GET', URL, qs.replace('foo=bar', 'foo=baz'), now=1000)
+        with six.assertRaisesRegex(self, InvalidRequest, 'Invalid signature'):
+            self.verifier.verify('POST', URL, qs, now=1000)
+        # Invalid requests don't end up in the replay cache
+        self.assertEqual(len(self.verifier.replay_cache), 0)
+
+    def test_verify_encoded_signature_param(self):
+        qs = signed_query({'foo': 'bar'})
+        encoded = qs.replace('hmac=', 'hm%61c=')
+
+        self.verifier.verify('GET', URL, encoded + '&hmac=junk1', now=1000)
+        # The verified signature is remembered, not the appended one
+        for query_string in (encoded + '&hmac=junk2', encoded, qs):
+            with six.assertRaisesRegex(self, InvalidRequest, 'Replayed request'):
+                self.verifier.verify('GET', URL, query_string, now=1000)
+        self.assertEqual(len(self.verifier.replay_cache), 1)
+
+    def test_verify_missing_signature(self):
+        qs = signed_query({'foo': 'bar'})
+        with six.assertRaisesRegex(self, InvalidRequest, 'Invalid signature'):
+            self.verifier.verify('GET', URL, qs.split('&hmac=')[0], now=1000)
+        with six.assertRaisesRegex(self, InvalidRequest, 'Invalid signature'):
+            self.verifier.verify('GET', URL, qs.split('&hmac=')[0] + '&hmac=', now=1000)
+
+    def test_verify_timestamp(self):
+        with six.assertRaisesRegex(self, InvalidRequest, 'Stale timestamp'):
+            self.verifier.verify('GET', URL, signed_query({'foo': 'bar'}, ts=1000), now=1061)
+        with six.assertRaisesRegex(self, InvalidRequest, 'Stale timestamp'):
+            self.verifier.verify('GET', URL, signed_query({'foo': 'bar'}, ts=1100), now=1000)
+        with six.assertRaisesRegex(self, InvalidRequest, 'Missing or invalid timestamp'):
+            self.verifier.verify('GET', URL, 'foo=bar&hmac=abc', now=1000)
+        with six.assertRaisesRegex(self, InvalidRequest, 'Missing or invalid timestamp'):
+            self.verifier.verify('GET', URL, 'ts=abc&hmac=abc', now=1000)
+
+    def test_verify_without_replay_cache(self):
+        verifier = RequestVerifier('secret', max_age=60, replay_cache=None)
+        qs = signed_query({'foo': 'bar'})
+        verifier.verify('GET', URL, qs, now=1000)
+        verifier.verify('GET', URL, qs, now=1000)
+
+
+def wsgi_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'verified' if environ.get('laterpay.verified') else b'unverified']
+
+
+class TestWSGIMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.app = WSGIMiddleware(wsgi_app, RequestVerifier('secret'), paths=['/callback'])
+
+    def call(self, query_string, path='/callback', **environ):
+        environ = dict({
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': query_string,
+            'HTTP_HOST': 'example.com',
+            'wsgi.url_scheme': 'https',
+        }, **environ)
+        start_response = mock.Mock()
+        body = b''.join(self.app(environ, start_response))
+        return start_response.call_args[0][0], body
+
+    @mock.patch('time.time', return_value=1000)
+    def test_verified(self, time_mock):
+        qs = signed_query({'foo': 'bar'})
+        self.assertEqual(self.call(qs), ('200 OK', b'verified'))
+        self.assertEqual(self.call(qs), ('403 Forbidden', b'Replayed request'))
+
+    @mock.patch('time.time', return_value=1000)
+    def test_rejected(self, time_mock):
+        qs = signed_query({'foo': 'bar'})
+        self.assertEqual(self.call(qs, HTTP_HOST='other.com'), ('403 Forbidden', b'Invalid signature'))
+        self.assertEqual(self.call(''), ('403 Forbidden', b'Missing or invalid timestamp'))
+
+    def test_other_paths(self):
+        self.assertEqual(self.call('', path='/other'), ('200 OK', b'unverified'))
+
+    @mock.patch('time.time', return_value=1000)
+    def test_url(self, time_mock):
+        qs = signed_query({'foo': 'bar'})
+        self.assertEqual(
+            self.call(qs, HTTP_HOST='', SERVER_NAME='example.com', SERVER_PORT='443'),
+            ('200 OK', b'verified'),
+        )
+
+        self.app = WSGIMiddleware(wsgi_app, RequestVerifier('secret'), url_root='https://example.com')
+        self.assertEqual(
+            self.call(signed_query({'foo': 'baz'}), HTTP_HOST='internal:8000'),
+            ('200 OK', b'verified'),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+import sys
+
+# The ASGI tests use ``async def``, which older Pythons can't even parse.
+# They live in a directory without ``__init__.py``, which the test loader of
+# ``setup.py test`` does not scan.
+if sys.version_info >= (3, 7):
+    from tests.py37.asgi_middleware import TestASGIMiddleware  # noqa: F401
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+import unittest
+
+import mock
+import requests
+from six.moves import BaseHTTPServer, socketserver
+
+from laterpay import LaterPayClient
+from laterpay.cache import InMemoryAccessCache
+from laterpay.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+class FaultInjectingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        fault = self.server.faults.pop(0) if self.server.faults else 'ok'
+        if fault == 'reset':
+            # Close the connection without responding
+            self.close_connection = True
+            return
+        if fault == 'slow':
+            time.sleep(0.5)
+        status = {'error': 503, 'bad_request': 400}.get(fault, 200)
+        body = json.dumps({'status': 'ok', 'articles': {'article-1': {'access': True}}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FaultInjectingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A local /access endpoint failing its requests as scripted in ``faults``.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, faults=()):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FaultInjectingHandler)
+        self.faults = list(faults)
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_backoff(self):
+        policy = RetryPolicy(backoff=0.1, max_backoff=0.3)
+        with mock.patch('random.uniform', side_effect=lambda a, b: b) as uniform_mock:
+            self.assertEqual([policy.get_backoff(retry) for retry in range(4)], [0.1, 0.2, 0.3, 0.3])
+        uniform_mock.assert_called_with(0, 0.3)
+
+    def test_max_retries(self):
+        policy = RetryPolicy(max_retries=2)
+        self.assertTrue(policy.acquire_retry(0, now=100))
+        self.assertTrue(policy.acquire_retry(1, now=100))
+        self.assertFalse(policy.acquire_retry(2, now=100))
+
+    def test_budget(self):
+        policy = RetryPolicy(max_retries=10, min_retries=1, budget_ratio=0.5, budget_window=10)
+        for _ in range(4):
+            policy.record_request(now=100)
+        # 1 + 0.5 * 4 retries are allowed
+        self.assertEqual([policy.acquire_retry(0, now=100) for _ in range(4)], [True, True, True, False])
+        # The budget is replenished once the window passed
+        self.assertTrue(policy.acquire_retry(0, now=111))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_on_failure_rate(self):
+        breaker = CircuitBreaker(failure_threshold=0.5, min_requests=4, window=10, reset_timeout=5)
+        breaker.record_failure(now=100)
+        breaker.record_failure(now=100)
+        breaker.record_failure(now=100)
+        # Not enough requests yet
+        self.assertTrue(breaker.allow_request(now=100))
+        breaker.record_success(now=100)
+        self.assertTrue(breaker.allow_request(now=100))
+        breaker.record_failure(now=100)
+        self.assertFalse(breaker.allow_request(now=100))
+        self.assertFalse(breaker.allow_request(now=104))
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(min_requests=1, reset_timeout=5)
+        breaker.record_failure(now=100)
+        self.assertFalse(breaker.allow_request(now=101))
+
+        # A single trial request is let through
+        self.assertTrue(breaker.allow_request(now=105))
+        self.assertFalse(breaker.allow_request(now=105))
+        breaker.record_failure(now=105)
+        self.assertFalse(breaker.allow_request(now=106))
+
+        self.assertTrue(breaker.allow_request(now=110))
+        breaker.record_success(now=110)
+        self.assertTrue(breaker.allow_request(now=110))
+        self.assertTrue(breaker.allow_request(now=110))
+
+    def test_state(self):
+        breaker = CircuitBreaker(min_requests=1, reset_timeout=0.05)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertFalse(breaker.is_open)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.is_open)
+        time.sleep(0.05)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+
+class TestLaterPayClientRetries(unittest.TestCase):
+
+    def get_client(self, server, **kwargs):
+        kwargs.setdefault('retry_policy', RetryPolicy(backoff=0.001))
+        return LaterPayClient('fake-cp-key', 'fake-shared-secret', api_root=server.url, **kwargs)
+
+    def test_retries_transient_errors(self):
+        with FaultInjectingServer(['error', 'reset']) as server:
+            with self.get_client(server) as client:
+                data = client.get_access_data('article-1', muid='user')
+        self.assertEqual(data['articles'], {'article-1': {'access': True}})
+        self.assertEqual(len(server.requests), 3)
+
+    def test_retries_timeouts(self):
+        with FaultInjectingServer(['slow']) as server:
+            with self.get_client(server, timeout_seconds=0.1) as client:
+                data = client.get_access_data('article-1', muid='user')
+        self.assertEqual(data['status'], 'ok')
+        self.assertEqual(len(server.requests), 2)
+
+    def test_gives_up(self):
+        with FaultInjectingServer(['error', 'error', 'error', 'error']) as server:
+            with self.get_client(server) as client:
+                with self.assertRaises(requests.HTTPError):
+                    client.get_access_data('article-1', muid='user')
+        # Two retries by default
+        self.assertEqual(len(server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        with FaultInjectingServer(['bad_request']) as server:
+            with self.get_client(server) as client:
+                with self.assertRaises(requests.HTTPError):
+                    client.get_access_data('article-1', muid='user')
+        self.assertEqual(len(server.requests), 1)
+
+    def test_no_retry_policy(self):
+        with FaultInjectingServer(['error']) as server:
+            with self.get_client(server, retry_policy=None) as client:
+                with self.assertRaises(requests.HTTPError):
+                    client.get_access_data('article-1', muid='user')
+        self.assertEqual(len(server.requests), 1)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(min_requests=2, reset_timeout=0.1)
+        with FaultInjectingServer(['error', 'error']) as server:
+            with self.get_client(server, retry_policy=None, circuit_breaker=breaker) as client:
+                for _ in range(2):
+                    with self.assertRaises(requests.HTTPError):
+                        client.get_access_data('article-1', muid='user')
+
+                # Fails fast without a request
+                with self.assertRaises(CircuitOpenError):
+                    client.get_access_data('article-1', muid='user')
+                self.assertEqual(len(server.requests), 2)
+
+                # A trial request closes the breaker again
+                time.sleep(0.1)
+                self.assertEqual(client.get_access_data('article-1', muid='user')['status'], 'ok')
+                self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_circuit_breaker_stops_retries(self):
+        breaker = CircuitBreaker(min_requests=2, reset_timeout=10)
+        with FaultInjectingServer(['error', 'error', 'error']) as server:
+            with self.get_client(server, circuit_breaker=breaker) as client:
+                with self.assertRaises(CircuitOpenError):
+                    client.get_access_data('article-1', muid='user')
+        self.assertEqual(len(server.requests), 2)
+
+    def test_circuit_breaker_serves_from_cache(self):
+        access_cache = InMemoryAccessCache(ttl=60, stale_ttl=600)
+        stale_key = ('fake-cp-key', 'muid:user', 'article-1')
+        access_cache.set_many({stale_key: {'access': True}}, now=time.time() - 70)
+        breaker = CircuitBreaker(min_requests=1, reset_timeout=10)
+        breaker.record_failure()
+
+        with FaultInjectingServer() as server:
+            with self.get_client(server, circuit_breaker=breaker, access_cache=access_cache) as client:
+                data = client.get_access_data('article-1', muid='user')
+                self.assertEqual(data['articles'], {'article-1': {'access': True}})
+                self.assertNotIn('unavailable', data)
+                data = client.get_access_data(['article-2', 'article-1', 'article-3'], muid='user')
+                self.assertEqual(data['status'], 'ok')
+                self.assertEqual(data['articles'], {'article-1': {'access': True}})
+                self.assertEqual(data['unavailable'], ['article-2', 'article-3'])
+                with self.assertRaises(CircuitOpenError):
+                    client.get_access_data(['article-2'], muid='user')
+        # The stale entry is not refreshed while the breaker is open
+        self.assertEqual(server.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
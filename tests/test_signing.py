@@ -5,8 +5,10 @@ import unittest
 import warnings
 
 import furl
+from six.moves.urllib.parse import parse_qs
 
-from laterpay import signing
+from laterpay import signing, utils
+from laterpay.compat import stringify
 
 
 class TestSigningHelper(unittest.TestCase):
@@ -76,6 +78,38 @@ class TestSigningHelper(unittest.TestCase):
             '%26param3%3Dwith%2520a%2520space',
         )
 
+    def test_create_message_flat_dict_fast_path(self):
+        params = {
+            'article_id': ['article-2', 'article-1'],
+            'cp': 'some-cp',
+            # The fast path takes native strings only, i.e. bytes on Python 2.
+            'title': stringify(u'Tîtle with spaces & ~marks~'),
+            'url': 'http://example.com/news?id=10&page=2',
+            'pricing': 'EUR20,USD30',
+            'hmac': 'will-be-removed',
+            'gettoken': 'will-be-removed-too',
+        }
+        url = 'https://endpoint.com/api'
+
+        self.assertIsNotNone(signing._quote_flat_params(params))
+
+        # Passing the same data as a list of tuples takes the generic path
+        self.assertEqual(
+            signing.create_base_message(params, url),
+            signing.create_base_message(list(params.items()), url),
+        )
+        self.assertEqual(
+            signing.create_base_message({}, url),
+            signing.create_base_message([], url),
+        )
+
+    def test_create_message_flat_dict_fast_path_fallback(self):
+        self.assertIsNone(signing._quote_flat_params([('key', 'value')]))
+        self.assertIsNone(signing._quote_flat_params({'key': 1}))
+        self.assertIsNone(signing._quote_flat_params({'key': ('value', )}))
+        self.assertIsNone(signing._quote_flat_params({'key': ['value', 1]}))
+        self.assertIsNone(signing._quote_flat_params({1: 'value'}))
+
     def test_create_message_wrong_method(self):
         params = {u'parĄm1': u'valuĘ'}
         url = u'https://endpoint.com/ąpi'
@@ -205,6 +239,147 @@ class TestSigningHelper(unittest.TestCase):
         )
         self.assertFalse(verified)
 
+    def test_signer(self):
+        params = {
+            u'parĄm1': u'valuĘ',
+            'param2': ['value2', 'value3'],
+        }
+        url = u'https://endpoint.com/api'
+        signer = signing.Signer('secret')
+
+        signature = signer.sign(params, url)
+        self.assertEqual(signature, '346f3d53ad762f3ed3fb7f2427dec2bbfaf0338bb7f91f0460aff15c')
+        self.assertEqual(signature, signing.sign('secret', params, url))
+        self.assertEqual(signature, signing.sign(signer, params, url))
+
+        # The keyed state is copied, so signing twice yields the same result
+        self.assertEqual(signer.sign(params, url), signature)
+        self.assertEqual(signer.create_HMAC('foo'), signing.create_HMAC('secret', 'foo'))
+        self.assertEqual(signing.create_HMAC(signer, 'foo'), signing.create_HMAC('secret', 'foo'))
+
+        self.assertTrue(signer.verify(signature.upper(), params, url, 'POST'))
+        self.assertTrue(signing.verify(signature, signer, params, url, 'POST'))
+        self.assertFalse(signer.verify(signature, params, url, 'GET'))
+
+    def test_message_prefix_cache(self):
+        url = 'https://endpoint.com/cached-api'
+        signing._message_prefix_cache.clear()
+
+        prefix = signing._create_message_prefix('GET', url)
+        self.assertEqual(prefix, 'GET&https%3A%2F%2Fendpoint.com%2Fcached-api&')
+        self.assertEqual(signing._message_prefix_cache.get(('GET', url)), prefix)
+        self.assertEqual(signing.create_base_message({}, url, 'GET'), prefix)
+
+        with self.assertRaises(ValueError):
+            signing._create_message_prefix('WRONG', url)
+        self.assertNotIn(('WRONG', url), signing._message_prefix_cache)
+
+    def test_signer_message_hmac_cache(self):
+        signer = signing.Signer('secret')
+        params = {'foo': 'bar'}
+        url = 'https://endpoint.com/api'
+
+        signature = signer.sign(params, url, 'GET')
+        self.assertIn(('GET', url), signer._message_hmacs)
+        # The cached state is copied and not modified by signing
+        self.assertEqual(signer.sign(params, url, 'GET'), signature)
+        self.assertEqual(
+            signature,
+            signing.create_HMAC('secret', signing.create_base_message(params, url, 'GET')),
+        )
+
+    def test_canonical_params(self):
+        shared = {'cp': 'some-cp', 'product': 'some product', 'return_url': 'http://example.com/?a=b'}
+        canonical_params = signing.CanonicalParams(shared)
+
+        self.assertIn('cp', canonical_params)
+        self.assertNotIn('ts', canonical_params)
+        # In the order of the dict, which is arbitrary on Python 2.
+        self.assertEqual(
+            sorted(canonical_params.query_string.split('&')),
+            ['cp=some-cp', 'product=some+product', 'return_url=http%3A%2F%2Fexample.com%2F%3Fa%3Db'],
+        )
+
+        for params in [
+            {},
+            {'article_id': 'a', 'ts': '123', 'url': 'http://example.com/a'},
+            {'zzz': ['2', '1'], 'aaa': '1', 'cp': 'another-cp', 'hmac': 'ignored'},
+            [(u'parĄm1', u'valuĘ'), ('product', 'some product')],
+        ]:
+            merged = signing.normalise_param_structure(params)
+            for key, value in shared.items():
+                merged.setdefault(key, []).append(value)
+            self.assertEqual(
+                canonical_params.extend(params),
+                signing.create_base_message(merged, 'http://example.com/').split('&', 2)[2],
+            )
+            self.assertEqual(
+                signing.sign('secret', params, 'http://example.com/', common_params=canonical_params),
+                signing.sign('secret', merged, 'http://example.com/'),
+            )
+            self.assertEqual(
+                signing.sign('secret', params, 'http://example.com/', common_params=shared),
+                signing.sign('secret', merged, 'http://example.com/'),
+            )
+
+    def test_sign_many(self):
+        params_list = [
+            {u'parĄm1': u'valuĘ', 'param2': ['value2', 'value3']},
+            {'param2': 'value1', 'hmac': 'will-be-removed'},
+            {},
+        ]
+        common_params = {'cp': 'some-cp', 'param2': 'value4', 'ts': '123'}
+        url = 'https://endpoint.com/api'
+
+        signatures = signing.sign_many('secret', params_list, url, common_params=common_params)
+
+        self.assertEqual(len(signatures), 3)
+        for params, signature in zip(params_list, signatures):
+            merged = signing.normalise_param_structure(params)
+            for key, values in common_params.items():
+                merged.setdefault(key, []).append(values)
+            self.assertEqual(signature, signing.sign('secret', merged, url))
+
+        self.assertEqual(
+            signing.sign_many(signing.Signer('secret'), params_list, url, method='GET'),
+            [signing.sign('secret', params, url, method='GET') for params in params_list],
+        )
+        self.assertEqual(signing.sign_many('secret', [], url), [])
+
+    def test_time_independent_HMAC_compare(self):
+        self.assertTrue(signing.time_independent_HMAC_compare('abc123', 'abc123'))
+        self.assertTrue(signing.time_independent_HMAC_compare(u'ABC123', b'abc123'))
+        self.assertTrue(signing.time_independent_HMAC_compare(b'aBc123', u'AbC123'))
+        self.assertFalse(signing.time_independent_HMAC_compare('abc123', 'abc124'))
+        self.assertFalse(signing.time_independent_HMAC_compare('abc123', 'abc1234'))
+        self.assertFalse(signing.time_independent_HMAC_compare(u'Ɛbc123', 'abc123'))
+
+    def test_key_ring(self):
+        params = {'foo': 'bar'}
+        url = 'https://endpoint.com/api'
+        key_ring = signing.KeyRing(['new-secret', signing.Signer('old-secret')])
+
+        self.assertEqual(key_ring.secret, 'new-secret')
+        self.assertEqual(key_ring.sign(params, url), signing.sign('new-secret', params, url))
+        self.assertEqual(signing.sign(key_ring, params, url), signing.sign('new-secret', params, url))
+
+        old_signature = signing.sign('old-secret', params, url)
+        new_signature = signing.sign('new-secret', params, url)
+        self.assertTrue(key_ring.verify(new_signature, params, url, 'POST'))
+        self.assertIs(key_ring._preferred, key_ring.signers[0])
+
+        self.assertTrue(signing.verify(old_signature, key_ring, params, url, 'POST'))
+        self.assertIs(key_ring._preferred, key_ring.signers[1])
+        self.assertTrue(key_ring.verify(new_signature, params, url, 'POST'))
+        self.assertIs(key_ring._preferred, key_ring.signers[0])
+
+        self.assertFalse(key_ring.verify(signing.sign('other', params, url), params, url, 'POST'))
+        self.assertTrue(key_ring.verify_query_string(
+            'hmac', 'foo=bar&hmac=' + old_signature, url, 'POST'))
+
+        with self.assertRaises(ValueError):
+            signing.KeyRing([])
+
     def test_url_verification(self):
         secret = '401e9a684fcc49578c1f23176a730abc'
         url = 'http://example.com'
@@ -232,6 +407,38 @@ class TestSigningHelper(unittest.TestCase):
         false_params['ts'] = '1234567890'
         self.assertFalse(signing.verify(false_params['hmac'], secret, false_params, url, method))
 
+    def test_verify_query_string(self):
+        secret = 'secret'
+        url = 'https://endpoint.com/api'
+        params = {
+            u'parĄm1': u'valuĘ with spaces',
+            'param2': ['value2', 'value1'],
+            'url': 'http://example.com/news?id=10&page=2',
+            'tilde': '~a-b_c.d',
+            'gettoken': 'ignored',
+        }
+        signature = signing.sign(secret, params, url, method='GET')
+
+        for raw_qs in [
+            # As created by urlencode
+            utils.signed_query(secret, params, url, add_timestamp=False),
+            # Spaces as %20, lowercase escapes, unescaped reserved characters,
+            # blank values and a different order
+            'gettoken=other&url=http://example.com/news%3fid%3d10%26page%3d2&param2=value1&param2=value2'
+            '&tilde=%7ea-b_c.d&blank=&novalue&par%c4%84m1=valu%C4%98%20with+spaces&hmac=' + signature.upper(),
+        ]:
+            self.assertTrue(signing.verify_query_string('hmac', secret, raw_qs, url, 'GET'), msg=raw_qs)
+            self.assertTrue(signing.verify_query_string('hmac', secret, raw_qs.encode(), url, 'GET'))
+            self.assertTrue(signing.verify(parse_qs(raw_qs)['hmac'], secret, parse_qs(raw_qs), url, 'GET'))
+            self.assertFalse(signing.verify_query_string('hmac', secret, raw_qs, url, 'POST'))
+            self.assertFalse(signing.verify_query_string('hmac', secret, raw_qs + '&extra=1', url, 'GET'))
+
+        signer = signing.Signer(secret)
+        raw_qs = utils.signed_query(signer, params, url, add_timestamp=False, signature_param_name='sig')
+        self.assertTrue(signer.verify_query_string('sig', raw_qs, url, 'GET'))
+        self.assertFalse(signer.verify_query_string('hmac', raw_qs, url, 'GET'))
+        self.assertFalse(signer.verify_query_string('sig', '', url, 'GET'))
+
     def test_normalise_param_structure(self):
         params = {
             'key1': 'value1',
@@ -256,6 +463,12 @@ class TestSigningHelper(unittest.TestCase):
             'key3': ['value31', 'value32'],  # Converted from tuple to list
         })
 
+        params = furl.furl('http://example.com/?key1=value11&key1=value12&key2=value2').args
+        self.assertEqual(signing.normalise_param_structure(params), {
+            'key1': ['value11', 'value12'],
+            'key2': ['value2'],
+        })
+
         with self.assertRaises(TypeError):
             signing.normalise_param_structure('not a dict, list or tuple')
 
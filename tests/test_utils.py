@@ -5,9 +5,9 @@ import unittest
 
 import mock
 
-from six.moves.urllib.parse import parse_qs
+from six.moves.urllib.parse import parse_qs, urlencode
 
-from laterpay import utils
+from laterpay import signing, utils
 from laterpay.compat import stringify
 
 
@@ -121,3 +121,99 @@ class UtilsTest(unittest.TestCase):
             'http://example.net/here?foo=bar'
             '&sig=83e26a62c0a3cf7405c7f2b4b75a46c4facc5c4dd013d57fa24936ce',
         )
+
+    @mock.patch('time.time')
+    def test_signed_query_common_params(self, time_time_mock):
+        time_time_mock.return_value = 123
+        url = 'https://endpoint.com/api'
+        common_params = signing.CanonicalParams({'cp': 'some-cp', 'product': 'some product'})
+
+        qs = utils.signed_query('secret', {'foo': 'bar'}, url, common_params=common_params)
+        qsd = parse_qs(qs)
+
+        # The params, then the common params, each in the order of their dict.
+        query = qs.split('&hmac=')[0].split('&')
+        self.assertEqual(sorted(query[:2]), ['foo=bar', 'ts=123'])
+        self.assertEqual(sorted(query[2:]), ['cp=some-cp', 'product=some+product'])
+        self.assertEqual(
+            qsd['hmac'],
+            [signing.sign('secret', {'foo': 'bar', 'ts': '123', 'cp': 'some-cp', 'product': 'some product'},
+                          url, method='GET')],
+        )
+
+        # A "ts" in the common params is not duplicated
+        qs = utils.signed_query('secret', {'foo': 'bar'}, url, common_params={'ts': '456'})
+        self.assertEqual(parse_qs(qs)['ts'], ['456'])
+
+    def test_signed_query_matches_urlencode_and_sign(self):
+        # Quoting the params once must give the same query string as
+        # ``urlencode`` and the same signature as ``signing.sign``.
+        params = {
+            'a b': ['x y', 'x+y', '100%', u'ümlaut', '~-._*', ''],
+            'url': 'http://example.com/?q=a b&c=d',
+            'title': '%20 is not a space',
+            'gettoken': 'not signed',
+        }
+        url = 'https://endpoint.com/api'
+        normalised = signing.normalise_param_structure(params)
+        query = urlencode(list(normalised.items()), doseq=True)
+
+        self.assertEqual(
+            utils.signed_query('secret', params, url, add_timestamp=False),
+            '%s&hmac=%s' % (query, signing.sign('secret', normalised, url, method='GET')),
+        )
+
+        common_params = signing.CanonicalParams({'cp': 'some cp', 'ts': '123'})
+        self.assertEqual(
+            utils.signed_query('secret', params, url, common_params=common_params),
+            '%s&cp=some+cp&ts=123&hmac=%s' % (
+                query, signing.sign('secret', normalised, url, method='GET', common_params=common_params),
+            ),
+        )
+
+    @mock.patch('time.time')
+    def test_signed_queries(self, time_time_mock):
+        time_time_mock.return_value = 123
+        params_list = [{'foo': 'bar'}, {'foo': ['baz', 'buz'], 'ts': '456'}]
+        url = 'https://endpoint.com/api'
+
+        queries = utils.signed_queries('secret', params_list, url, common_params={'cp': 'some-cp'})
+
+        self.assertEqual(len(queries), 2)
+        for params, qs in zip(params_list, queries):
+            qsd = parse_qs(qs)
+            self.assertEqual(qsd['cp'], ['some-cp'])
+            self.assertEqual(qsd['ts'][-1], '123')
+            expected = dict(params, cp='some-cp', ts='123')
+            expected['ts'] = qsd['ts']
+            self.assertEqual(qsd['hmac'], [signing.sign('secret', expected, url, method='GET')])
+
+        self.assertEqual(parse_qs(queries[0])['foo'], ['bar'])
+        self.assertEqual(parse_qs(queries[1])['foo'], ['baz', 'buz'])
+
+    def test_signed_queries_is_permalink(self):
+        params_list = [{'foo': 'bar', 'ts': '456'}]
+        url = 'https://endpoint.com/api'
+
+        queries = utils.signed_queries('secret', params_list, url, is_permalink=True, common_params={'ts': '123'})
+        qsd = parse_qs(queries[0])
+
+        self.assertFalse('ts' in qsd)
+        self.assertEqual(qsd['permalink'], ['1'])
+        self.assertEqual(qsd['foo'], ['bar'])
+
+    def test_signed_urls(self):
+        urls = utils.signed_urls(
+            'secret',
+            [{'foo': 'bar'}],
+            'http://example.net/here',
+            add_timestamp=False,
+            signature_param_name='sig',
+        )
+        self.assertEqual(urls, [utils.signed_url(
+            'secret',
+            {'foo': 'bar'},
+            'http://example.net/here',
+            add_timestamp=False,
+            signature_param_name='sig',
+        )])